@@ -2,9 +2,15 @@
 import pandas as pd
 import requests
 import json
+import random
+import sqlite3
+import time
 import urllib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import closing
 from pathlib import Path
 
+from esupy.processed_data_mgmt import Paths
 from stewi.globals import config, log
 
 MODULEPATH = Path(__file__).resolve().parent
@@ -21,18 +27,130 @@ srs_replace_group = ['%2B', '/', '.']
 
 inventory_to_SRSlist_acronymns = SRSconfig['inventory_lists']
 
+paths = Paths()
+# SRS responses by query url, see fetch_SRS_responses()
+SRS_CACHE = Path(paths.local_path) / 'chemicalmatcher' / 'srs_cache.sqlite'
+SRS_CACHE_TTL = 30 * 24 * 3600  # seconds
+# hashes of the flow files included in the chemical matches by source and year
+MATCHED_FLOW_FILES = (Path(paths.local_path) / 'chemicalmatcher' /
+                      'matched_flow_files.json')
+MAX_WORKERS = 8
+MAX_ATTEMPTS = 3
+BACKOFF_FACTOR = 2
 
-# Return json object with SRS result
-def get_SRSInfo_for_substance_name(name):
+
+def get_SRS_name_url(name):
+    """Return the SRS query url for a substance name."""
     name_for_query = urllib.parse.quote(name)
     for i in srs_replace_group:
         name_for_query = name_for_query.replace(i, '_')
-    url = (f'{base}{queries.get("nameprefix")}{name_for_query}'
-           '?excludeSynonyms=True')
+    return (f'{base}{queries.get("nameprefix")}{name_for_query}'
+            '?excludeSynonyms=True')
+
+
+# Return json object with SRS result
+def get_SRSInfo_for_substance_name(name):
+    url = get_SRS_name_url(name)
     flow_info = query_SRS_for_flow(url)
     return flow_info
 
 
+def get_SRSInfo_for_substance_names(names, max_workers=MAX_WORKERS):
+    """Query SRS for substance names concurrently, using cached responses.
+
+    :param names: iterable of substance names
+    :param max_workers: int, maximum concurrent requests
+    :return: tuple of dataframes, SRS info with columns 'FlowName', 'SRS_ID'
+        and 'SRS_CAS', and errors with columns 'FlowName' and
+        'ErrorDescription', each in order of names
+    """
+    names = list(names)
+    urls = [get_SRS_name_url(name) for name in names]
+    responses = fetch_SRS_responses(urls, max_workers=max_workers)
+    records, errors = [], []
+    for name, url in zip(names, urls):
+        result = parse_SRS_flow_response(responses[url])
+        if isinstance(result, str):
+            errors.append({'FlowName': name, 'ErrorDescription': result})
+        else:
+            records.append({'FlowName': name, **result})
+    return (pd.DataFrame(records, columns=['FlowName', 'SRS_ID', 'SRS_CAS']),
+            pd.DataFrame(errors, columns=['FlowName', 'ErrorDescription']))
+
+
+def normalize_SRS_url(url):
+    """Return url with lower case scheme and host and sorted query, as the
+    key of cached responses."""
+    parts = urllib.parse.urlsplit(url.strip())
+    query = urllib.parse.urlencode(sorted(urllib.parse.parse_qsl(
+        parts.query, keep_blank_values=True)))
+    return urllib.parse.urlunsplit((parts.scheme.lower(), parts.netloc.lower(),
+                                    parts.path, query, ''))
+
+
+def request_SRS(url):
+    """Return the status code and text of an SRS request, retrying
+    connection and server errors; (None, None) if it fails."""
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        try:
+            r = requests.get(url, timeout=60)
+            if r.status_code < 500:
+                return r.status_code, r.text
+            log.debug(f'{url} returned {r.status_code}')
+        except requests.RequestException as e:
+            log.debug(f'{url} failed: {e}')
+        if attempt < MAX_ATTEMPTS:
+            time.sleep(BACKOFF_FACTOR * 2**(attempt - 1) *
+                       (1 + random.random()))
+    return None, None
+
+
+def fetch_SRS_responses(urls, max_workers=MAX_WORKERS, ttl=SRS_CACHE_TTL):
+    """Return the text of SRS responses by url.
+
+    Responses are stored in the SRS_CACHE sqlite database by normalized url
+    and reused for ttl seconds; urls not in the cache are requested with up
+    to max_workers concurrent requests. Only successful and not found (404)
+    responses are cached.
+    :param urls: iterable of urls
+    :param max_workers: int, maximum concurrent requests
+    :param ttl: float, seconds a cached response is used
+    :return: dict of url and response text, None if the request failed or
+        was not successful
+    """
+    keys = {url: normalize_SRS_url(url) for url in urls}
+    responses = {}
+    SRS_CACHE.parent.mkdir(parents=True, exist_ok=True)
+    with closing(sqlite3.connect(SRS_CACHE)) as con:
+        con.execute('CREATE TABLE IF NOT EXISTS responses (url TEXT PRIMARY '
+                    'KEY, status INTEGER, body TEXT, fetched REAL)')
+        for key in set(keys.values()):
+            row = con.execute('SELECT status, body FROM responses WHERE '
+                              'url = ? AND fetched > ?',
+                              (key, time.time() - ttl)).fetchone()
+            if row is not None:
+                responses[key] = row[1] if row[0] == 200 else None
+        missing = set(keys.values()) - responses.keys()
+        log.info(f'{len(responses)} SRS responses found in cache, '
+                 f'requesting {len(missing)}')
+        urls_by_key = {v: k for k, v in keys.items()}
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(request_SRS, urls_by_key[key]): key
+                       for key in missing}
+            for i, future in enumerate(as_completed(futures), 1):
+                key = futures[future]
+                status, body = future.result()
+                responses[key] = body if status == 200 else None
+                if status in (200, 404):
+                    con.execute('INSERT OR REPLACE INTO responses '
+                                'VALUES (?, ?, ?, ?)',
+                                (key, status, body, time.time()))
+                if i % 100 == 0:
+                    con.commit()
+        con.commit()
+    return {url: responses[key] for url, key in keys.items()}
+
+
 def get_SRSInfo_for_program_list(inventory):
     # See all lists
     # https://cdxnodengn.epa.gov/cdx-srs-rest/reference/substance_lists
@@ -78,24 +196,23 @@ def query_SRS_for_program_list(url, inventory):
 
 
 def query_SRS_for_flow(url, for_single_flow=False):
+    result = parse_SRS_flow_response(fetch_SRS_responses([url])[url])
+    if isinstance(result, str):
+        return result
+    return pd.DataFrame([result])
+
+
+def parse_SRS_flow_response(text):
+    """Return a dict of SRS_ID and SRS_CAS from the text of an SRS substance
+    response, or a str describing the error."""
     try:
-        chemicallistresponse = requests.get(url)
-        chemicallistjson = json.loads(chemicallistresponse.text)
-    except:
+        chemicallistjson = json.loads(text)
+    except (TypeError, ValueError):
         return "Error:404"
     if len(chemicallistjson) == 0:
         return "Error: No SRS info found"
-    else:
-        flow_info = process_single_SRS_json_response(chemicallistjson)
-        return flow_info
-
-
-# Processes json response, returns a dataframe with key and CAS
-def process_single_SRS_json_response(srs_json_response):
-    chemical_srs_info = pd.DataFrame(columns=["SRS_ID", "SRS_CAS"])
-    chemical_srs_info.loc[0, "SRS_ID"] = srs_json_response[0]['subsKey']
-    chemical_srs_info.loc[0, "SRS_CAS"] = srs_json_response[0]['currentCasNumber']
-    return chemical_srs_info
+    return {"SRS_ID": chemicallistjson[0]['subsKey'],
+            "SRS_CAS": chemicallistjson[0]['currentCasNumber']}
 
 
 def add_manual_matches(df_matches, include_proxies=True):
@@ -1,11 +1,15 @@
 # Retrieves all unique flow names from the StEWI flow list, uses SRS web
 # service to find their SRSname and CAS
+import json
+
 import pandas as pd
 
 import stewi
-from stewi.globals import log
-from chemicalmatcher.globals import OUTPUT_PATH, get_SRSInfo_for_substance_name,\
-    get_SRSInfo_for_program_list, add_manual_matches
+from esupy.processed_data_mgmt import find_file
+from stewi.globals import log, paths, set_stewi_meta, get_file_hash
+from chemicalmatcher.globals import OUTPUT_PATH, MATCHED_FLOW_FILES,\
+    get_SRSInfo_for_substance_names, get_SRSInfo_for_program_list,\
+    add_manual_matches
 
 flowlist_cols = {"RCRAInfo": ['FlowName', 'FlowID'],
                  "eGRID": ['FlowName'],
@@ -14,25 +18,77 @@ flowlist_cols = {"RCRAInfo": ['FlowName', 'FlowID'],
                  "DMR": ['FlowName', 'FlowID'],
                  "GHGRP": ['FlowName', 'FlowID']}
 
-
-def writeChemicalMatches():
-    all_list_names = extract_flows_for_chemical_matcher()
-    if len(all_list_names) == 0:
+# Determine whether to use the id or name to query SRS
+inventory_query_type = {"RCRAInfo": "list",
+                        "TRI": "list",
+                        "NEI": "list",
+                        "eGRID": "name",
+                        "DMR": "list",
+                        "GHGRP": "name"}
+
+
+def writeChemicalMatches(force=False):
+    """Add SRS matches for the flows of local inventories to the chemical
+    match list.
+
+    Only flow files that changed or were added since they were last matched,
+    tracked by hash in MATCHED_FLOW_FILES, are read, and only their flows not
+    already in the chemical match list are queried. Flows that were not
+    matched to an SRS_ID are kept in MATCHED_FLOW_FILES and queried again on
+    the next run.
+
+    :param force: bool, if True reads all flow files
+    """
+    flow_files = get_flow_file_hashes()
+    if len(flow_files) == 0:
         log.error('no local flows found, chemical matches can not be assessed, '
                   'generate local inventories before continuing.')
         return
-
-    # Determine whether to use the id or name to query SRS
-    inventory_query_type = {"RCRAInfo": "list",
-                            "TRI": "list",
-                            "NEI": "list",
-                            "eGRID": "name",
-                            "DMR": "list",
-                            "GHGRP": "name"}
-
-    # Create a df to store the results
-    all_lists_srs_info = pd.DataFrame(columns=["FlowName", "SRS_ID",
-                                               "SRS_CAS", "Source"])
+    matched = read_matched_flow_files()
+    if force:
+        matched['files'] = {}
+    source_dict = {source: [year for year, file_hash in years.items()
+                            if matched['files'].get(source, {}).get(year)
+                            != file_hash]
+                   for source, years in flow_files.items()}
+    source_dict = {k: v for k, v in source_dict.items() if v}
+    unresolved = pd.DataFrame(matched['unresolved'],
+                              columns=['FlowName', 'FlowID', 'Source'])
+    if not source_dict and unresolved.empty:
+        log.info('chemical matches are up to date with local flows')
+        return
+    filepath = OUTPUT_PATH.joinpath('ChemicalsByInventorywithSRS_IDS_forStEWI.csv')
+    flows_list = pd.read_csv(filepath, dtype={'SRS_ID': str})
+    new_flows = []
+    if source_dict:
+        new_flows.append(remove_matched_flows(
+            extract_flows_for_chemical_matcher(source_dict), flows_list))
+    if not unresolved.empty:
+        log.info(f'querying {len(unresolved)} flows not matched previously')
+    all_list_names = (pd.concat(new_flows + [unresolved], ignore_index=True)
+                      .drop_duplicates(ignore_index=True))
+    if len(all_list_names) > 0:
+        unresolved = update_chemical_matches(all_list_names, flows_list)
+    for source, years in source_dict.items():
+        for year in years:
+            matched['files'].setdefault(source, {})[year] = \
+                flow_files[source][year]
+    matched['unresolved'] = (unresolved[['FlowName', 'FlowID', 'Source']]
+                             .astype(object)
+                             .where(unresolved.notna(), None)
+                             .to_dict('records'))
+    write_matched_flow_files(matched)
+
+
+def update_chemical_matches(all_list_names, flows_list):
+    """Query SRS for flows and add them to the chemical match list.
+
+    :param all_list_names: df of flows with 'FlowName', 'FlowID', 'Source'
+    :param flows_list: df, the current chemical match list
+    :return: df of flows in all_list_names not matched to an SRS_ID
+    """
+    # Collect the results by source
+    srs_info_by_source = []
     errors_srs = pd.DataFrame(columns=["FlowName", "Source", "ErrorType"])
 
     # Loop through sources, querying SRS by the query type defined for the
@@ -56,46 +112,27 @@ def writeChemicalMatches():
                                      left_on='FlowID', right_on='PGM_ID',
                                      how='left')
         elif inventory_query_type[source] == 'name':
-            # For names, query SRS one by one to get results
-            list_srs_info = pd.DataFrame(columns=["FlowName", "SRS_ID",
-                                                  "SRS_CAS", "Source"])
-            errors_srs = pd.DataFrame(columns=["FlowName", "Source", "ErrorType"])
-            # Cycle through names one by one
-            for index, row in inventory_flows.iterrows():
-                chemical_srs_info = pd.DataFrame(columns=["FlowName", "SRS_ID",
-                                                          "SRS_CAS", "Source"])
-                error_srs = pd.DataFrame(columns=["FlowName", "Source",
-                                                  "ErrorDescription"])
-                name = row["FlowName"]
-                result = get_SRSInfo_for_substance_name(name)
-                if isinstance(result, str):
-                    # This is an error
-                    error_srs.loc[0, 'FlowName'] = name
-                    #error_srs.loc[0, 'FlowID'] = id
-                    error_srs.loc[0, 'Source'] = source
-                    error_srs.loc[0, 'ErrorDescription'] = result
-                else:
-                    chemical_srs_info = result
-                    chemical_srs_info.loc[0, "FlowName"] = name
-                    #chemical_srs_info.loc[0, "FlowID"] = name
-                    chemical_srs_info.loc[0, "Source"] = source
-
-                errors_srs = pd.concat([errors_srs, error_srs], sort=False)
-                list_srs_info = pd.concat([list_srs_info, chemical_srs_info],
-                                          sort=False)
-
-        all_lists_srs_info = pd.concat([all_lists_srs_info, list_srs_info],
-                                       sort=False)
+            # For names, query SRS concurrently using cached responses
+            list_srs_info, errors_srs = get_SRSInfo_for_substance_names(
+                inventory_flows['FlowName'])
+            list_srs_info['Source'] = source
+            errors_srs['Source'] = source
+
+        srs_info_by_source.append(list_srs_info)
+    all_lists_srs_info = pd.concat(srs_info_by_source, sort=False)
 
     # Remove waste code and PGM_ID
-    all_lists_srs_info = all_lists_srs_info.drop(columns=['PGM_ID'])
+    all_lists_srs_info = all_lists_srs_info.reindex(
+        columns=['FlowID', 'FlowName', 'SRS_CAS', 'SRS_ID', 'Source'])
 
     # Add in manually found matches
     all_lists_srs_info = add_manual_matches(all_lists_srs_info)
 
-    # Write to csv
+    # Write to csv, flows matched now replace those without an SRS_ID
     filepath = OUTPUT_PATH.joinpath('ChemicalsByInventorywithSRS_IDS_forStEWI.csv')
-    flows_list = pd.read_csv(filepath, dtype={'SRS_ID': str})
+    resolved = all_lists_srs_info.dropna(subset=['SRS_ID'])
+    flows_list = flows_list[flows_list['SRS_ID'].notna() |
+                            ~is_matched(flows_list, resolved)]
     flows_list = pd.concat([flows_list,
                             all_lists_srs_info[['FlowID', 'FlowName', 'SRS_CAS',
                                                 'SRS_ID', 'Source']]
@@ -110,10 +147,9 @@ def writeChemicalMatches():
     # Write flows missing srs_ids to file for more inspection
     filepath = OUTPUT_PATH.joinpath('flows_missing_SRS_ID.csv')
     flows_missing_SRS_ID = flows_list.query('SRS_ID.isnull()')
-    missing_list = (pd.read_csv(filepath)
-                    .query('FlowID not in list(@flows_list.query( \
-                           "SRS_ID.notnull()").FlowID)')
-                    )
+    missing_list = pd.read_csv(filepath)
+    missing_list = missing_list[~missing_list['FlowID'].isin(
+        flows_list.loc[flows_list['SRS_ID'].notna(), 'FlowID'])]
     missing_list = (pd.concat([missing_list, flows_missing_SRS_ID],
                              ignore_index=True)
                     .drop_duplicates(['FlowID', 'FlowName', 'Source'])
@@ -121,33 +157,95 @@ def writeChemicalMatches():
                                   'SRS_ID', 'FlowID'])
                     )
     missing_list.to_csv(filepath, index=False)
+    return all_list_names[~is_matched(all_list_names, resolved)]
 
 
-def extract_flows_for_chemical_matcher():
+def get_flow_file_hashes():
+    """Return the hash of the local flow file of each inventory and year,
+    as a dict of dicts by source and year."""
+    source_dict = stewi.getAvailableInventoriesandYears(stewiformat='flow')
+    flow_files = {}
+    for source, years in source_dict.items():
+        for year in years:
+            file = find_file(set_stewi_meta(f'{source}_{year}', 'flow'), paths)
+            if file is not None:
+                flow_files.setdefault(source, {})[str(year)] = \
+                    get_file_hash(file)
+    return flow_files
+
+
+def read_matched_flow_files():
+    """Return the hashes of flow files already matched, as a dict of dicts
+    by source and year under 'files', and the flows not matched to an
+    SRS_ID under 'unresolved'."""
+    try:
+        with open(MATCHED_FLOW_FILES) as f:
+            matched = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        matched = {}
+    matched.setdefault('files', {})
+    matched.setdefault('unresolved', [])
+    return matched
+
+
+def write_matched_flow_files(matched):
+    MATCHED_FLOW_FILES.parent.mkdir(parents=True, exist_ok=True)
+    temp = MATCHED_FLOW_FILES.with_suffix('.tmp')
+    with open(temp, 'w') as f:
+        json.dump(matched, f, indent=2, sort_keys=True)
+    temp.replace(MATCHED_FLOW_FILES)
+
+
+def is_matched(flows, flows_list):
+    """Return a boolean series of whether flows are in flows_list,
+    identified by FlowName for sources queried by name and also by FlowID
+    for the others."""
+    matched = pd.Series(False, index=flows.index)
+    for query_type, cols in [('list', ['FlowID', 'FlowName', 'Source']),
+                             ('name', ['FlowName', 'Source'])]:
+        sources = [k for k, v in inventory_query_type.items()
+                   if v == query_type]
+        existing = pd.MultiIndex.from_frame(
+            flows_list.loc[flows_list['Source'].isin(sources), cols]
+            .astype(str))
+        keys = pd.MultiIndex.from_frame(flows[cols].astype(str))
+        matched |= flows['Source'].isin(sources) & keys.isin(existing)
+    return matched
+
+
+def remove_matched_flows(all_list_names, flows_list):
+    """Return flows not in the chemical match list."""
+    keep = ~is_matched(all_list_names, flows_list)
+    log.info(f'{keep.sum()} of {len(keep)} flows are not yet matched')
+    return all_list_names[keep].reset_index(drop=True)
+
+
+def extract_flows_for_chemical_matcher(source_dict=None):
+    """Return the unique flows of local flow files.
+
+    :param source_dict: dict of sources and list of years to read, defaults
+        to all inventories and years with local flow files
+    """
     log.info('generating chemical matches from local flow lists')
     # First loop through flows lists to create a list of all unique flows
-    source_dict = stewi.getAvailableInventoriesandYears(stewiformat='flow')
-    all_list_names = pd.DataFrame(columns=["FlowName", "FlowID"])
+    if source_dict is None:
+        source_dict = stewi.getAvailableInventoriesandYears(stewiformat='flow')
+    names_by_source = [pd.DataFrame(columns=["FlowName", "FlowID"])]
     for source in source_dict.keys():
-        list_names_years = pd.DataFrame()
-        for year in source_dict[source]:
-            list_names = pd.DataFrame()
-            list_names = stewi.getInventoryFlows(source, year)
-            list_names = list_names[flowlist_cols[source]]
-            list_names = list_names.drop_duplicates()
-            list_names_years = pd.concat([list_names_years, list_names],
-                                         sort=False)
+        list_names_years = pd.concat(
+            [stewi.getInventoryFlows(source, year)[flowlist_cols[source]]
+             .drop_duplicates() for year in source_dict[source]],
+            sort=False)
         if source == 'TRI':
             list_names_years['FlowID'] = (
                 list_names_years['FlowID'].apply(
                     lambda x: x.lstrip('0').replace('-', '')))
         list_names_years = list_names_years.drop_duplicates()
         list_names_years['Source'] = source
-        all_list_names = pd.concat([all_list_names, list_names_years],
-                                   sort=False)
+        names_by_source.append(list_names_years)
 
     # Drop duplicates from lists with same names
-    all_list_names = (all_list_names
+    all_list_names = (pd.concat(names_by_source, sort=False)
                       .drop_duplicates()
                       .reset_index(drop=True))
     return all_list_names
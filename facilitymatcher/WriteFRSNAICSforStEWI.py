@@ -7,11 +7,11 @@ import facilitymatcher.globals as fmg
 
 
 def write_NAICS_matches():
-    FRS_NAICS = fmg.download_and_read_frs_file('FRS_NAICS_file')
-
     # Filter this list for stewi
     # Programs of interest
     stewi_programs = fmg.get_programs_for_inventory_list(fmg.stewi_inventories)
+    FRS_NAICS = fmg.download_and_read_frs_file('FRS_NAICS_file',
+                                               programs=stewi_programs)
 
     # Limit to EPA programs of interest for StEWI
     stewi_NAICS = fmg.filter_by_program_list(FRS_NAICS, stewi_programs)
@@ -10,9 +10,10 @@ import pandas as pd
 import facilitymatcher.globals as fmg
 
 def write_facility_matches():
-    FRS_Bridges = fmg.download_and_read_frs_file('FRS_bridge_file')
     # Programs of interest
     stewi_programs = fmg.get_programs_for_inventory_list(fmg.stewi_inventories)
+    FRS_Bridges = fmg.download_and_read_frs_file(
+        'FRS_bridge_file', programs=stewi_programs + ['EIA-860'])
 
     # Limit to EPA programs of interest for StEWI
     stewi_bridges = fmg.filter_by_program_list(FRS_Bridges, stewi_programs)
@@ -6,8 +6,12 @@ Public API for facilitymatcher. Functions to match facilities across inventories
 """
 
 
+import pyarrow as pa
+import pyarrow.compute as pc
+
 from facilitymatcher.globals import filter_by_inventory_list, stewi_inventories,\
-    filter_by_facility_list, filter_by_inventory_id_list, get_fm_file
+    filter_by_facility_list, get_fm_file, get_fm_table, find_rows,\
+    take_rows, facility_keys
 
 
 def get_matches_for_inventories(inventory_list=stewi_inventories, **kwargs):
@@ -15,13 +19,15 @@ def get_matches_for_inventories(inventory_list=stewi_inventories, **kwargs):
 
     :param inventory_list: list of inventories for desired matches using
         StEWI inventory names e.g. ['NEI','TRI']
-    :return: dataframe in FacilityMatches standard output format
+    :return: dataframe in FacilityMatches standard output format, indexed
+        by row of the stored file as in get_matches_for_id_list
     """
     download_if_missing = kwargs.get('download_if_missing', False)
-    facilitymatches = get_fm_file('FacilityMatchList_forStEWI',
-                                  download_if_missing=download_if_missing)
-    facilitymatches = filter_by_inventory_list(facilitymatches, inventory_list)
-    return facilitymatches
+    table, _ = get_fm_table('FacilityMatchList_forStEWI',
+                            download_if_missing=download_if_missing)
+    rows = pc.indices_nonzero(pc.is_in(table['Source'], pa.array(
+        inventory_list, type=table.schema.field('Source').type)))
+    return take_rows(table, rows.to_numpy())
 
 
 def get_FRS_NAICSInfo_for_facility_list(frs_id_list,
@@ -39,11 +45,14 @@ def get_FRS_NAICSInfo_for_facility_list(frs_id_list,
     :return: dataframe with columns 'FRS_ID', 'Source', 'NAICS',
         'PRIMARY_INDICATOR'
     """
-    all_NAICS = get_fm_file('FRS_NAICSforStEWI', download_if_missing)
     if frs_id_list is not None:
-        NAICS_of_interest = filter_by_facility_list(all_NAICS, frs_id_list)
+        table, index = get_fm_table('FRS_NAICSforStEWI', download_if_missing)
+        NAICS_of_interest = filter_by_facility_list(
+            take_rows(table, find_rows(index, 'frs', frs_id_list)),
+            frs_id_list)
     else:
-        NAICS_of_interest = all_NAICS
+        NAICS_of_interest = get_fm_file('FRS_NAICSforStEWI',
+                                        download_if_missing)
     if inventories_of_interest_list is not None:
         NAICS_of_interest = filter_by_inventory_list(NAICS_of_interest,
                                                      inventories_of_interest_list)
@@ -64,6 +73,15 @@ def get_matches_for_id_list(base_inventory, id_list,
     :return: dataframe in FacilityMatches standard output format
     """
     download_if_missing = kwargs.get('download_if_missing', False)
-    return filter_by_inventory_id_list(
-        get_fm_file('FacilityMatchList_forStEWI', download_if_missing),
-        inventory_list, base_inventory, id_list)
+    table, index = get_fm_table('FacilityMatchList_forStEWI',
+                                download_if_missing)
+    # Find FRS_IDs first
+    df = take_rows(table, find_rows(
+        index, 'key', facility_keys(base_inventory, id_list)))
+    FRS_ID_list = list(df.loc[(df['Source'] == base_inventory) &
+                              (df['FacilityID'].isin(id_list)), "FRS_ID"])
+    # Now use that FRS_ID list and list of inventories of interest to get
+    # desired matches
+    df = take_rows(table, find_rows(index, 'frs', FRS_ID_list))
+    return df.loc[(df['Source'].isin(inventory_list)) &
+                  (df['FRS_ID'].isin(FRS_ID_list))]
@@ -5,20 +5,31 @@
 Supporting variables and functions used in facilitymatcher
 """
 
+import base64
+import hashlib
+import random
+import time
 import zipfile
-import io
 import requests
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
 import os
+import shutil
 from datetime import datetime
+from email.utils import parsedate_to_datetime
 from pathlib import Path
 
-from stewi.globals import log, set_stewi_meta, source_metadata, config
+from stewi.globals import log, set_stewi_meta, source_metadata, config,\
+    get_file_hash
 import facilitymatcher.WriteFacilityMatchesforStEWI as write_fm
 import facilitymatcher.WriteFRSNAICSforStEWI as write_naics
-from esupy.processed_data_mgmt import Paths, load_preprocessed_output,\
-    write_df_to_file, write_metadata_to_file, read_source_metadata,\
-    download_from_remote
+from esupy.processed_data_mgmt import Paths, write_df_to_file,\
+    write_metadata_to_file, read_source_metadata,\
+    download_from_remote, find_file
 from esupy.util import strip_file_extension
 
 MODULEPATH = Path(__file__).resolve().parent
@@ -29,6 +40,17 @@ paths.local_path = paths.local_path / 'facilitymatcher'
 output_dir = paths.local_path
 ext_folder = 'FRS Data Files'
 FRSpath = paths.local_path / ext_folder
+cache_dir = paths.local_path / 'cache'
+
+# bytes per read when downloading and extracting FRS files
+CHUNK_SIZE = 2**20
+MAX_ATTEMPTS = 5
+BACKOFF_FACTOR = 3
+
+# separates Source and FacilityID in the keys of the facility index
+KEY_SEP = '\x1f'
+# memory-mapped facilitymatcher tables by file name, see get_fm_table()
+_fm_tables = {}
 
 FRS_config = config(config_path=MODULEPATH)['databases']['FRS']
 
@@ -43,32 +65,165 @@ def set_facilitymatcher_meta(file_name, category):
     return facilitymatcher_meta
 
 
+def download_file(url, filepath: Path, sha256=None):
+    """Stream a file to disk, resuming an interrupted download.
+
+    Data is written to filepath + '.part', which is continued with an HTTP
+    range request on the next attempt or call. The ETag, or else the
+    Last-Modified date, of the first response is kept in filepath +
+    '.validator' and sent as If-Range, so a file changed on the server is
+    downloaded again from the start. The completed file is checked against
+    the size reported by the server, its Content-MD5 header if sent, and
+    sha256 if given, before it is moved to filepath.
+    :param url: str
+    :param filepath: Path, destination
+    :param sha256: str, optional expected sha256 hex digest
+    :return: str, sha256 hex digest of the file
+    """
+    part = filepath.with_name(filepath.name + '.part')
+    validator = filepath.with_name(filepath.name + '.validator')
+    filepath.parent.mkdir(parents=True, exist_ok=True)
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        if attempt > 1:
+            time.sleep(BACKOFF_FACTOR * 2**(attempt - 2) *
+                       (1 + random.random()))
+        start = part.stat().st_size if part.exists() else 0
+        headers = {'Range': f'bytes={start}-'} if start else {}
+        if start and validator.exists():
+            headers['If-Range'] = validator.read_text()
+        try:
+            with requests.get(url, headers=headers, stream=True,
+                              timeout=60) as r:
+                if r.status_code == 416:
+                    # the partial file does not match the remote file
+                    part.unlink()
+                    validator.unlink(missing_ok=True)
+                    continue
+                r.raise_for_status()
+                if r.status_code == 206:
+                    size = int(r.headers['Content-Range'].rsplit('/', 1)[-1])
+                    mode = 'ab'
+                    log.info(f'resuming download of {url} at {start} bytes')
+                else:
+                    if start:
+                        log.info(f'{url} changed or can not be resumed, '
+                                 'downloading from the start')
+                    size = int(r.headers.get('Content-Length', -1))
+                    mode = 'wb'
+                    write_validator(r, validator)
+                content_md5 = r.headers.get('Content-MD5')
+                with open(part, mode) as f:
+                    for chunk in r.iter_content(CHUNK_SIZE):
+                        f.write(chunk)
+        except requests.RequestException as e:
+            log.warning(f'download of {url} interrupted '
+                        f'(attempt {attempt} of {MAX_ATTEMPTS}): {e}')
+            continue
+        if size >= 0 and part.stat().st_size != size:
+            log.warning(f'{part.name} is {part.stat().st_size} bytes, '
+                        f'expected {size}')
+            if part.stat().st_size > size:
+                part.unlink()
+            continue
+        md5, digest = hashlib.md5(), hashlib.sha256()
+        with open(part, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                md5.update(chunk)
+                digest.update(chunk)
+        if ((content_md5 and
+             base64.b64encode(md5.digest()).decode() != content_md5) or
+                (sha256 and digest.hexdigest() != sha256)):
+            log.warning(f'checksum of {part.name} does not match, '
+                        'downloading again')
+            part.unlink()
+            validator.unlink(missing_ok=True)
+            continue
+        part.replace(filepath)
+        validator.unlink(missing_ok=True)
+        return digest.hexdigest()
+    raise ConnectionError(f'failed to download {url}')
+
+
+def write_validator(r, validator: Path):
+    """Keep the strong ETag, or else the Last-Modified date, of a response
+    for If-Range requests; weak ETags can not be used with If-Range."""
+    etag = r.headers.get('ETag')
+    value = (etag if etag and not etag.startswith('W/')
+             else r.headers.get('Last-Modified'))
+    if value:
+        validator.write_text(value)
+    else:
+        validator.unlink(missing_ok=True)
+
+
+def remote_file_changed(url, filepath: Path):
+    """Return True if the remote file differs in size from filepath or was
+    modified after it was downloaded. False if neither or if the server
+    can not be reached.
+    """
+    try:
+        r = requests.head(url, allow_redirects=True, timeout=60)
+        r.raise_for_status()
+    except requests.RequestException as e:
+        log.warning(f'unable to check {url} for updates, using existing '
+                    f'{filepath.name}: {e}')
+        return False
+    size = r.headers.get('Content-Length')
+    modified = r.headers.get('Last-Modified')
+    if size is not None and int(size) != filepath.stat().st_size:
+        return True
+    return (modified is not None and
+            parsedate_to_datetime(modified).timestamp() >
+            filepath.stat().st_mtime)
+
+
+def extract_member(zip_path: Path, member, path: Path):
+    """Stream a single member of a zip archive to path, the CRC of the
+    member is checked as it is read."""
+    temp = path.joinpath(member + '.tmp')
+    with zipfile.ZipFile(zip_path) as z, z.open(member) as src,\
+            open(temp, 'wb') as dst:
+        shutil.copyfileobj(src, dst, CHUNK_SIZE)
+    temp.replace(path.joinpath(member))
+
+
 def download_extract_FRS_combined_national(file=None):
-    """Download and extract file from source to local directory."""
+    """Download and extract file from source to local directory.
+
+    The downloaded archive is kept in the FRS directory so that other files
+    are extracted without downloading it again, unless the remote archive
+    has changed since.
+    """
     url = FRS_config['url']
-    log.info('initiating url request from %s', url)
-    request = requests.get(url).content
-    zip_file = zipfile.ZipFile(io.BytesIO(request))
+    zip_path = FRSpath / url.rsplit('/', 1)[-1]
     source_dict = dict(source_metadata)
     source_dict['SourceType'] = 'Zip file'
     source_dict['SourceURL'] = url
+    if not zip_path.exists() or remote_file_changed(url, zip_path):
+        log.info('initiating url request from %s', url)
+        source_dict['SourceFileHash'] = download_file(url, zip_path)
+    else:
+        source_dict['SourceFileHash'] = get_file_hash(zip_path)
     if file is None:
         log.info(f'extracting all FRS files from {url}')
         name = 'FRS_Files'
-        zip_file.extractall(FRSpath)
+        with zipfile.ZipFile(zip_path) as z:
+            z.extractall(FRSpath)
     else:
         log.info('extracting %s from %s', file, url)
-        zip_file.extract(file, path=FRSpath)
+        extract_member(zip_path, file, FRSpath)
         source_dict['SourceFileName'] = file
         name = strip_file_extension(file)
-    source_dict['SourceAcquisitionTime'] = datetime.now().strftime('%d-%b-%Y')
+    source_dict['SourceAcquisitionTime'] = datetime.fromtimestamp(
+        zip_path.stat().st_mtime).strftime('%d-%b-%Y')
     write_fm_metadata(name, source_dict, category=ext_folder)
 
 
-def download_and_read_frs_file(filetype):
+def download_and_read_frs_file(filetype, programs=None):
     """
     Downloads, if necessary, and returns a df of the FRS filetype
     :param filetype: str, "FRS_bridge_file" or "FRS_NAICS_file"
+    :param programs: list of FRS program acronyms to keep, None keeps all
     """
     file = FRS_config[filetype]
     # Check to see if file exists
@@ -84,21 +239,55 @@ def download_and_read_frs_file(filetype):
                     'PGM_SYS_ACRNM': 'str',
                     'NAICS_CODE': 'str',
                     'PRIMARY_INDICATOR': 'str'}
-    df = read_FRS_file(file, col_dict)
+    df = read_FRS_file(file, col_dict, programs)
     return df
 
 
-def read_FRS_file(file_name, col_dict):
-    """Retrieve FRS data file stored locally."""
-    file_meta = set_facilitymatcher_meta(file_name, category=ext_folder)
-    log.info(f'loading {file_meta.name_data} from {FRSpath}')
-    file_meta.name_data = strip_file_extension(file_meta.name_data)
-    file_meta.ext = 'csv'
-    df = load_preprocessed_output(file_meta, paths)
-    df_FRS = pd.DataFrame()
-    for k, v in col_dict.items():
-        df_FRS[k] = df[k].astype(v)
-    return df_FRS
+def read_FRS_file(file_name, col_dict, programs=None):
+    """Retrieve FRS data file stored locally.
+
+    Only the columns in col_dict are parsed, as str, and rows are
+    filtered by program while reading. The result is cached as parquet
+    keyed by the hash of the file and the programs.
+    :param file_name: str, FRS file in FRSpath
+    :param col_dict: dict of columns and dtypes
+    :param programs: list of FRS program acronyms to keep, None keeps all
+    """
+    path = FRSpath / file_name
+    file_hash = get_file_hash(path)[:16]
+    query_hash = hashlib.sha256(
+        repr((sorted(col_dict.items()), sorted(programs or []))).encode()
+        ).hexdigest()[:8]
+    stem = strip_file_extension(file_name)
+    cache = cache_dir / f'{stem}_{file_hash}_{query_hash}.parquet'
+    if cache.exists():
+        log.info(f'loading {file_name} from {cache_dir}')
+        return pd.read_parquet(cache)
+
+    log.info(f'loading {file_name} from {FRSpath}')
+    columns = list(col_dict.keys())
+    reader = pacsv.open_csv(
+        path, read_options=pacsv.ReadOptions(block_size=2**24),
+        convert_options=pacsv.ConvertOptions(
+            include_columns=columns,
+            column_types={c: pa.string() for c in columns},
+            strings_can_be_null=True))
+    batches = []
+    for batch in reader:
+        if programs is not None:
+            batch = batch.filter(pc.is_in(batch['PGM_SYS_ACRNM'],
+                                          pa.array(programs, pa.string())))
+        batches.append(batch)
+    table = pa.Table.from_batches(batches, schema=reader.schema)
+
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    for old in cache_dir.glob(f'{stem}_*.parquet'):
+        if not old.name.startswith(f'{stem}_{file_hash}_'):
+            old.unlink()
+    temp = cache.with_suffix('.tmp')
+    pq.write_table(table, temp)
+    temp.replace(cache)
+    return table.to_pandas()
 
 
 def store_fm_file(df, file_name, category='', sources=None):
@@ -121,32 +310,151 @@ def store_fm_file(df, file_name, category='', sources=None):
         log.error('Failed to save inventory')
 
 
-def get_fm_file(file_name, download_if_missing=False):
-    """Read facilitymatcher file, if not present, generate it.
+def find_fm_file(file_name):
+    """Return the local facilitymatcher file selected by esupy, or None."""
+    return find_file(set_facilitymatcher_meta(file_name, ''), paths)
+
+
+def get_fm_path(file_name, download_if_missing=False):
+    """Return the local facilitymatcher file, if not present, generate it.
     :param file_name: str, can be 'FacilityMatchList_forStEWI' or
         'FRS_NAICSforStEWI'
     :param download_if_missing: bool, if True will attempt to load from
         remote server prior to generating if file not found locally
     """
-    file_meta = set_facilitymatcher_meta(file_name, category='')
-    df = load_preprocessed_output(file_meta, paths)
-    if df is None:
+    path = find_fm_file(file_name)
+    if path is None:
         log.info(f'{file_name} not found in {output_dir}, '
                  'writing facility matches to file')
         if download_if_missing:
-            download_from_remote(file_meta, paths)
+            download_from_remote(set_facilitymatcher_meta(file_name, ''),
+                                 paths)
         elif file_name == 'FacilityMatchList_forStEWI':
             write_fm.write_facility_matches()
         elif file_name == 'FRS_NAICSforStEWI':
             write_naics.write_NAICS_matches()
-        df = load_preprocessed_output(file_meta, paths)
+        path = find_fm_file(file_name)
+    return path
+
+
+def hash_keys(values):
+    """Return uint64 hashes of string values, stable across sessions."""
+    return pd.util.hash_array(np.asarray(values, dtype=object))
+
+
+def facility_keys(source, facility_id):
+    """Return the keys of the facility index for Source, as a str or
+    sequence, and a sequence of FacilityID."""
+    facility_id = pd.Series(facility_id, dtype=object).astype(str).values
+    if not isinstance(source, str):
+        source = np.asarray(source, dtype=object)
+    return source + KEY_SEP + facility_id
+
+
+def write_fm_cache(df, path: Path):
+    """Write a facilitymatcher file as Arrow IPC with a hash index.
+
+    The index holds, sorted by hash, the hash of FRS_ID and of
+    Source + FacilityID (if present) and the corresponding table rows.
+    :param df: dataframe of the facilitymatcher file
+    :param path: Path, directory of the cache
+    """
     col_dict = {"FRS_ID": "str",
                 "FacilityID": "str",
                 "NAICS": "str"}
     for k, v in col_dict.items():
         if k in df:
             df[k] = df[k].astype(v)
-    return df
+    index = {}
+    frs_hash = hash_keys(df['FRS_ID'])
+    order = np.argsort(frs_hash, kind='stable')
+    index['frs_hash'], index['frs_row'] = frs_hash[order], order
+    if 'FacilityID' in df:
+        key_hash = hash_keys(facility_keys(df['Source'], df['FacilityID']))
+        order = np.argsort(key_hash, kind='stable')
+        index['key_hash'], index['key_row'] = key_hash[order], order
+    temp = path.with_name(f'.{path.name}.tmp')
+    shutil.rmtree(temp, ignore_errors=True)
+    temp.mkdir(parents=True)
+    data = (pa.Table.from_pandas(df, preserve_index=False)
+            .replace_schema_metadata().combine_chunks())
+    # single record batches, so that rows are taken without concatenating
+    for name, table in [('data', data), ('index', pa.table(index))]:
+        with pa.OSFile(str(temp / f'{name}.arrow'), 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+    temp.replace(path)
+
+
+def read_arrow(file: Path):
+    """Return a memory-mapped table from an Arrow IPC file."""
+    return pa.ipc.open_file(pa.memory_map(str(file), 'r')).read_all()
+
+
+def get_fm_table(file_name, download_if_missing=False):
+    """Return a facilitymatcher file as a memory-mapped Arrow table and its
+    hash index, building the Arrow cache from the stored file if needed.
+    :param file_name: str, can be 'FacilityMatchList_forStEWI' or
+        'FRS_NAICSforStEWI'
+    :param download_if_missing: bool, if True will attempt to load from
+        remote server prior to generating if file not found locally
+    :return: tuple of pa.Table and dict of index arrays, see write_fm_cache,
+        or (None, None) if the file is not available
+    """
+    source = get_fm_path(file_name, download_if_missing)
+    if source is None:
+        log.error(f'{file_name} not available')
+        return None, None
+    path = cache_dir / f'{source.stem}_{source.stat().st_mtime_ns}'
+    if file_name in _fm_tables and _fm_tables[file_name][0] == path:
+        return _fm_tables[file_name][1:]
+    if not path.exists():
+        log.info(f'caching {source.name} to {cache_dir}')
+        write_fm_cache(pd.read_parquet(source), path)
+        for old in cache_dir.glob(f'{file_name}_v*'):
+            if old != path:
+                shutil.rmtree(old, ignore_errors=True)
+    table = read_arrow(path / 'data.arrow')
+    index_table = read_arrow(path / 'index.arrow')
+    index = {c: index_table[c].to_numpy() for c in index_table.column_names}
+    _fm_tables[file_name] = (path, table, index)
+    return table, index
+
+
+def find_rows(index, name, values):
+    """Return the sorted table rows whose key may be in values.
+
+    Rows are found by hash, so callers filter on the values themselves.
+    :param index: dict of index arrays from get_fm_table()
+    :param name: str, 'frs' for FRS_ID or 'key' for facility_keys()
+    :param values: list of keys
+    """
+    hashes, rows = index[f'{name}_hash'], index[f'{name}_row']
+    query = hash_keys(list(values))
+    start = np.searchsorted(hashes, query, side='left')
+    counts = np.searchsorted(hashes, query, side='right') - start
+    offsets = np.arange(counts.sum()) - np.repeat(counts.cumsum() - counts,
+                                                  counts)
+    return np.unique(rows[np.repeat(start, counts) + offsets])
+
+
+def take_rows(table, rows):
+    """Return the table rows as a dataframe indexed by row number."""
+    return table.take(pa.array(rows, type=pa.int64())).to_pandas().set_axis(
+        pd.Index(rows), axis=0)
+
+
+def get_fm_file(file_name, download_if_missing=False):
+    """Read facilitymatcher file, if not present, generate it.
+    :param file_name: str, can be 'FacilityMatchList_forStEWI' or
+        'FRS_NAICSforStEWI'
+    :param download_if_missing: bool, if True will attempt to load from
+        remote server prior to generating if file not found locally
+    """
+    table, _ = get_fm_table(file_name, download_if_missing)
+    if table is None:
+        return None
+    return table.to_pandas()
 
 
 def write_fm_metadata(file_name, metadata_dict, category=''):
@@ -0,0 +1,64 @@
+"""Time stewicombo overlap removal on a synthetic combined inventory"""
+
+import time
+
+import numpy as np
+import pandas as pd
+
+from stewicombo.overlaphandler import aggregate_and_remove_overlap
+
+
+def synthetic_inventory(n_facilities=20000, n_flows=200, seed=0):
+    """Combined inventory where each facility reports a random subset of
+    flows to one or more inventories, sharing FRS_ID across sources."""
+    rng = np.random.default_rng(seed)
+    sources = {'air': ['eGRID', 'GHGRP', 'NEI', 'TRI'],
+               'water': ['TRI'],
+               'waste': ['RCRAInfo', 'TRI']}
+    frames = []
+    for cmpt, inventories in sources.items():
+        for source in inventories:
+            n = n_facilities * 10 // len(inventories)
+            frs = rng.integers(0, n_facilities, n)
+            srs = rng.integers(0, n_flows, n)
+            frames.append(pd.DataFrame({
+                'FacilityID': [f'{source}{i}' for i in frs],
+                'FRS_ID': (110000000000 + frs).astype(str),
+                'SRS_ID': srs.astype(str),
+                'SRS_CAS': [f'{i}-00-0' for i in srs],
+                'FlowName': [f'Flow {i}' for i in srs],
+                'Compartment': rng.choice([cmpt, f'{cmpt}/urban',
+                                           f'{cmpt}/rural'], n),
+                'FlowAmount': rng.random(n) * 1000,
+                'Unit': 'kg',
+                'DataReliability': rng.integers(1, 6, n).astype(float),
+                'Source': source,
+                'Year': '2017',
+                }))
+    return pd.concat(frames, ignore_index=True)
+
+
+def main(n_facilities, n_flows, repeat):
+    df = synthetic_inventory(n_facilities, n_flows)
+    print(f'{len(df)} records')
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = aggregate_and_remove_overlap(df.copy())
+        times.append(time.perf_counter() - start)
+    print(f'{len(result)} records after overlap removal')
+    print(f'best of {repeat}: {min(times):.2f} s')
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--facilities', type=int, default=20000,
+                        help='number of facilities in synthetic data')
+    parser.add_argument('--flows', type=int, default=200,
+                        help='number of flows in synthetic data, fewer flows '
+                        'increases the overlap between inventories')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    main(args.facilities, args.flows, args.repeat)
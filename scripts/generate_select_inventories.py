@@ -3,22 +3,33 @@
 import stewi
 
 
-def main(inventory, years):
+def parse_years(years):
+    if isinstance(years, list):
+        return years
     if '-' in years:
         years_list = years.split('-')
-        year_iter = list(range(int(years_list[0]), int(years_list[1]) + 1))
-    elif ',' in years:
-        year_iter = [int(y.strip()) for y in years.split(',')]
-    elif isinstance(years, list):
-        year_iter = years
-    else:
-        year_iter = [years]
-    for i_year in year_iter:
-        try:
-            stewi.globals.generate_inventory(inventory, i_year)
-        except stewi.exceptions.InventoryNotAvailableError as err:
-            print(err)
-            continue
+        return list(range(int(years_list[0]), int(years_list[1]) + 1))
+    if ',' in years:
+        return [int(y.strip()) for y in years.split(',')]
+    return [years]
+
+
+def main(inventory, years, workers=1, memory=None):
+    """Generate each inventory for each year, running up to workers jobs
+    at a time within memory (MB), then print the result of each job.
+
+    :param inventory: str or list of inventory acronyms
+    :param years: str, single year, years separated by dash or by comma
+    """
+    inventories = [inventory] if isinstance(inventory, str) else inventory
+    jobs = [(i, y) for i in inventories for y in parse_years(years)]
+    results = stewi.globals.generate_inventories(
+        jobs, max_workers=workers, memory_limit_mb=memory)
+    for r in results:
+        print(f"{r['inventory']} {r['year']}: {r['status']}, "
+              f"{r['seconds']} s, peak memory {r['peak_memory_MB']} MB"
+              + (f" - {r['error']}" if r['error'] else ''))
+    return results
 
 
 if __name__=="__main__":
@@ -28,8 +39,14 @@ if __name__=="__main__":
 
     parser.add_argument('--years', help='single year or years separated'
                         'by dash')
-    parser.add_argument('--inventory', help='inventory acroynym')
+    parser.add_argument('--inventory', nargs='+',
+                        help='one or more inventory acroynyms')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='maximum number of inventories generated at once')
+    parser.add_argument('--memory', type=float,
+                        help='memory (MB) available to concurrent jobs, '
+                        'defaults to system memory')
 
     args = vars(parser.parse_args())
 
-    main(args['inventory'], args['years'])
+    main(args['inventory'], args['years'], args['workers'], args['memory'])
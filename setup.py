@@ -18,6 +18,7 @@ setup(
         'esupy @ git+https://github.com/USEPA/esupy.git#egg=esupy',
         'numpy>=1.20.1',
         'pandas>=1.3',
+        'pyarrow>=10.0',
         'requests>=2.20',
         'PyYAML>=5.1',
         'openpyxl>=3.0.7',
@@ -20,9 +20,16 @@ Year:
 
 import pandas as pd
 import numpy as np
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
 import argparse
+import json
+import random
+import threading
 import urllib
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 from io import BytesIO
 
@@ -53,6 +60,18 @@ PARAM_GROUP = True
 DETECTION = 'HALF'
 ESTIMATION = True
 
+# Values used for concurrent state queries
+MAX_WORKERS = 8
+REQUESTS_PER_SECOND = 4  # per host
+MAX_ATTEMPTS = 4
+BACKOFF_FACTOR = 2  # seconds, doubled for each retry
+# leading underscore excludes the manifest from the parquet dataset
+MANIFEST = '_manifest.json'
+# partition value for queries without nutrient aggregation
+NO_NUTRIENT = 'none'
+# raw query columns stored as numeric, all others are stored as strings
+FLOAT_FIELDS = ['Facility Latitude', 'Facility Longitude']
+
 
 def generate_url(url_params):
     """Generate the url for DMR query.
@@ -87,19 +106,99 @@ def generate_url(url_params):
     return url
 
 
-def query_dmr(year, state_list=STATES, nutrient=''):
-    """Loop through a set of states to download and pickle DMR data.
+class HostRateLimiter:
+    """Space out the start of requests to each host to a maximum rate."""
+
+    def __init__(self, requests_per_second=REQUESTS_PER_SECOND):
+        self.interval = 1 / requests_per_second if requests_per_second else 0
+        self._next_start = {}
+        self._lock = threading.Lock()
+
+    def wait(self, url):
+        host = urllib.parse.urlsplit(url).netloc
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_start.get(host, now))
+            self._next_start[host] = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+def request_with_retry(url, rate_limiter=None):
+    """Make url request, retrying failed requests with exponential backoff."""
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        if rate_limiter:
+            rate_limiter.wait(url)
+        try:
+            r = make_url_request(url)
+            if r is not None:
+                return r
+            error = 'no response'
+        except Exception as e:
+            error = e
+        if attempt == MAX_ATTEMPTS:
+            break
+        delay = BACKOFF_FACTOR * 2 ** (attempt - 1) * (1 + random.random())
+        log.debug(f'request failed ({error}), retrying in {delay:.1f}s')
+        time.sleep(delay)
+    raise ConnectionError(f'{url} failed after {MAX_ATTEMPTS} attempts: '
+                          f'{error}')
+
+
+def read_manifest(path: Path) -> dict:
+    """Read the manifest of prior query results for a year of DMR data.
+
+    Entries are keyed by nutrient and state and record the result of the
+    query and, when successful, the size of the stored file.
+    """
+    try:
+        with open(path.joinpath(MANIFEST)) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def write_manifest(path: Path, manifest: dict):
+    temp = path.joinpath(MANIFEST + '.tmp')
+    with open(temp, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    temp.replace(path.joinpath(MANIFEST))
+
 
+def year_path(year) -> Path:
+    """Return the root of the stored DMR queries for a year."""
+    return OUTPUT_PATH.joinpath(f'year={year}')
+
+
+def state_file(path: Path, state, nutrient='') -> Path:
+    """Return the file of a stored DMR query in the hive partitioned
+    dataset: year={year}/nutrient={nutrient}/state={state}."""
+    return path.joinpath(f'nutrient={nutrient or NO_NUTRIENT}',
+                         f'state={state}', 'data.parquet')
+
+
+def query_dmr(year, state_list=STATES, nutrient='', max_workers=MAX_WORKERS,
+              requests_per_second=REQUESTS_PER_SECOND):
+    """Download and store DMR data for a set of states concurrently.
+
+    Results are recorded in a manifest as each state completes so that an
+    interrupted run resumes without repeating successful queries; a stored
+    file that is not recorded as complete in the manifest is queried again.
+    Queries pickled by prior versions are converted rather than repeated.
     :param year: str, year of data
     :param state_list: List of states to include in query
     :param nutrient: Option to query by nutrient category with aggregation.
         Input 'N' or 'P'
+    :param max_workers: int, maximum number of concurrent queries
+    :param requests_per_second: float, maximum rate of requests to the host
     :return: results dictionary
     """
-    path = OUTPUT_PATH.joinpath(year)
+    path = year_path(year)
     path.mkdir(parents=True, exist_ok=True)
+    convert_pickled_files(year, state_list, nutrient)
+    manifest = read_manifest(path)
+    rate_limiter = HostRateLimiter(requests_per_second)
     results = {}
-    filestub = ''
     url_params = {'p_year': year,
                   'p_st': '',
                   'p_poll_cat': nutrient,
@@ -109,21 +208,50 @@ def query_dmr(year, state_list=STATES, nutrient=''):
                   # 'pageno': '1',
                   }
     if nutrient:
-        filestub = nutrient + "_"
         url_params['p_nutrient_agg'] = 'Y'
-    for state in state_list:
-        filename = f"{filestub}state_{state}.pickle"
-        filepath = path.joinpath(filename)
-        if check_for_file(filepath, state):
-            results[state] = 'success'
-        else:
-            url_params['p_st'] = state
-            results[state] = download_data(url_params, filepath)
-    return results
-
-
-def check_for_file(filepath: Path, state) -> bool:
-    if filepath.is_file():
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {}
+        for state in state_list:
+            filepath = state_file(path, state, nutrient)
+            if check_for_file(path, manifest, state, nutrient):
+                results[state] = 'success'
+            else:
+                futures[executor.submit(
+                    download_data, {**url_params, 'p_st': state}, filepath,
+                    rate_limiter)] = (state, filepath)
+        for future in as_completed(futures):
+            state, filepath = futures[future]
+            try:
+                results[state] = future.result()
+            except Exception as e:
+                log.error(f'query failed for {state}: {e}')
+                results[state] = 'error'
+            manifest[manifest_key(state, nutrient)] = {
+                'state': state,
+                'nutrient': nutrient,
+                'result': results[state],
+                'bytes': (filepath.stat().st_size
+                          if results[state] == 'success' else None),
+                'time': time.strftime('%Y-%m-%d %H:%M:%S')}
+            write_manifest(path, manifest)
+    return {state: results[state] for state in state_list}
+
+
+def manifest_key(state, nutrient='') -> str:
+    return f'{nutrient or NO_NUTRIENT}_{state}'
+
+
+def is_stored(path: Path, manifest: dict, state, nutrient='') -> bool:
+    """Return True if the query for a state is recorded as complete in the
+    manifest and its file has the recorded size."""
+    filepath = state_file(path, state, nutrient)
+    entry = manifest.get(manifest_key(state, nutrient), {})
+    return (entry.get('result') == 'success' and filepath.is_file() and
+            entry.get('bytes') == filepath.stat().st_size)
+
+
+def check_for_file(path: Path, manifest: dict, state, nutrient='') -> bool:
+    if is_stored(path, manifest, state, nutrient):
         log.debug(f'file already exists for {state}, skipping')
         return True
     else:
@@ -131,32 +259,84 @@ def check_for_file(filepath: Path, state) -> bool:
         return False
 
 
-def download_data(url_params, filepath: Path) -> str:
+def download_data(url_params, filepath: Path, rate_limiter=None) -> str:
     df = pd.DataFrame()
     url = generate_url(url_params)
     log.debug(url)
-    r = make_url_request(url)
+    r = request_with_retry(url, rate_limiter)
     # When more than 100,000 records, need to split queries
     if ((len(r.content) < 1000) and
         ('Maximum number of records' in str(r.content))):
         for x in ('NGP', 'GPC', 'NPD'):
             split_url = f'{url}&p_permit_type={x}'
-            r = make_url_request(split_url)
-            df_sub = pd.read_csv(BytesIO(r.content), low_memory=False)
+            r = request_with_retry(split_url, rate_limiter)
+            df_sub = pd.read_csv(BytesIO(r.content), dtype=str)
             if len(df_sub) < 3: continue
             df = pd.concat([df, df_sub], ignore_index=True)
     else:
-        df = pd.read_csv(BytesIO(r.content), low_memory=False)
+        df = pd.read_csv(BytesIO(r.content), dtype=str)
     log.debug(f"saving to {filepath}")
-    pd.to_pickle(df, filepath)
+    write_state_file(df, filepath)
     return 'success'
 
 
+def write_state_file(df, filepath: Path):
+    """Store the DMR query for a state with text fields except for the
+    coordinates."""
+    for field in FLOAT_FIELDS:
+        if field in df:
+            df[field] = pd.to_numeric(df[field], errors='coerce')
+    schema = pa.schema([(c, pa.float64() if c in FLOAT_FIELDS else pa.string())
+                        for c in df.columns])
+    table = pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+    # write to a hidden temporary file so an interrupted run leaves no
+    # partial file in the dataset
+    filepath.parent.mkdir(parents=True, exist_ok=True)
+    temp = filepath.with_name(f'.{filepath.name}.tmp')
+    pq.write_table(table, temp)
+    temp.replace(filepath)
+
+
+def convert_pickled_files(year, state_list, nutrient=''):
+    """Store DMR queries pickled by prior versions in the partitioned dataset.
+
+    Pickled queries were stored as {year}/{nutrient}_state_{state}.pickle
+    with numeric codes; integral codes are stored as text without a decimal.
+    """
+    path = year_path(year)
+    manifest = read_manifest(path)
+    filestub = f'{nutrient}_' if nutrient else ''
+    for state in state_list:
+        pickle = OUTPUT_PATH.joinpath(str(year),
+                                      f'{filestub}state_{state}.pickle')
+        if not pickle.is_file() or is_stored(path, manifest, state, nutrient):
+            continue
+        log.info(f'converting stored DMR query {pickle}')
+        df = pd.read_pickle(pickle)
+        for c in df.columns.difference(FLOAT_FIELDS):
+            if (pd.api.types.is_float_dtype(df[c]) and
+                    (df[c].dropna() % 1 == 0).all()):
+                df[c] = df[c].astype('Int64')
+            df[c] = df[c].astype('string')
+        filepath = state_file(path, state, nutrient)
+        write_state_file(df, filepath)
+        manifest[manifest_key(state, nutrient)] = {
+            'state': state,
+            'nutrient': nutrient,
+            'result': 'success',
+            'bytes': filepath.stat().st_size,
+            'time': time.strftime('%Y-%m-%d %H:%M:%S')}
+    write_manifest(path, manifest)
+
+
+def read_required_fields():
+    return list(pd.read_csv(DMR_DATA_PATH / 'DMR_required_fields.txt',
+                            header=None)[0])
+
+
 def standardize_df(input_df):
     """Modify DMR data to meet StEWI specifications."""
-    dmr_required_fields = pd.read_csv(DMR_DATA_PATH / 'DMR_required_fields.txt',
-                                      header=None)[0]
-    output_df = input_df[dmr_required_fields].copy()
+    output_df = input_df[read_required_fields()].copy()
     dmr_reliability_table = (get_reliability_table_for_source('DMR')
                              .drop(columns=['Code']))
     output_df['DataReliability'] = dmr_reliability_table[
@@ -188,6 +368,12 @@ def standardize_df(input_df):
     output_df['FlowAmount'] = pd.to_numeric(output_df['FlowAmount'],
                                             errors='coerce')
 
+    # Codes are stored as text; drop leading zeros so that they match the
+    # numeric codes of the ECHO data as previously read
+    for field in ['FlowID', 'SIC', 'NAICS']:
+        output_df[field] = output_df[field].str.replace(r'^0+(?=\d)', '',
+                                                        regex=True)
+
     if PARAM_GROUP:
         flows = read_pollutant_parameter_list()
         dmr_flows = flows[['FlowName', 'FlowID']
@@ -203,38 +389,36 @@ def standardize_df(input_df):
 
 
 def combine_DMR_inventory(year, nutrient=''):
-    """Loop through pickled data and combines into a dataframe."""
-    path = OUTPUT_PATH.joinpath(year)
+    """Read the stored state queries for a year as a single dataframe.
+
+    Only the required fields are read from the partitioned dataset.
+    """
+    path = year_path(year)
     if not path.is_dir():
         raise stewi.exceptions.DataNotFoundError
-    output_df = pd.DataFrame()
-    filestub = ''
+    manifest = read_manifest(path)
+    missing = [state for state in STATES
+               if not is_stored(path, manifest, state, nutrient)]
+    if missing:
+        log.warning(f'No data found for {", ".join(missing)}. '
+                    'Retrying query...')
+        query_dmr(year=year, state_list=missing, nutrient=nutrient)
     if nutrient:
-        filestub = nutrient + '_'
         log.info(f'reading stored DMR queries by state for {nutrient}...')
     else:
         log.info('reading stored DMR queries by state...')
-    for state in STATES:
-        log.debug(f'accessing data for {state}')
-        filepath = path.joinpath(f'{filestub}state_{state}.pickle')
-        result = unpickle(filepath)
-        if result is None:
-            log.warning(f'No data found for {state}. Retrying query...')
-            if (query_dmr(year=year,
-                         state_list=[state],
-                         nutrient=nutrient).get(state) == 'success'):
-                result = unpickle(filepath)
-        if result is not None:
-            output_df = pd.concat([output_df, result], ignore_index=True)
-    return output_df
-
-
-def unpickle(filepath):
-    try:
-        return pd.read_pickle(filepath)
-    except FileNotFoundError:
-        log.exception(f'error reading {filepath}')
-        return None
+    fields = read_required_fields()
+    schema = pa.schema(
+        [(c, pa.float64() if c in FLOAT_FIELDS else pa.string())
+         for c in fields] +
+        [('nutrient', pa.string()), ('state', pa.string())])
+    dataset = ds.dataset(path, schema=schema, format='parquet',
+                         partitioning='hive')
+    return (dataset.to_table(
+                columns=fields,
+                filter=((ds.field('nutrient') == (nutrient or NO_NUTRIENT)) &
+                        ds.field('state').isin(STATES)))
+            .to_pandas())
 
 
 def download_state_totals_validation(year):
@@ -309,7 +493,7 @@ def validate_state_totals(df, year):
 def generate_metadata(year, datatype='inventory'):
     """Generate metadata and write to json for datatypes 'inventory' or 'source'."""
     if datatype == 'source':
-        source_path = str(OUTPUT_PATH.joinpath(year))
+        source_path = str(year_path(year))
         source_meta = compile_source_metadata(source_path, _config, year)
         source_meta['SourceType'] = 'Web Service'
         write_metadata(f"DMR_{year}", source_meta, category=EXT_DIR,
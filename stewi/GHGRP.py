@@ -29,12 +29,18 @@ Envirofacts web services documentation can be found at:
 import pandas as pd
 import numpy as np
 import time
+import random
+import shutil
 import argparse
 import warnings
 import zipfile
 import io
+import re
 import urllib
 import urllib3
+import pyarrow as pa
+import pyarrow.parquet as pq
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from requests.exceptions import HTTPError
 from xml.dom import minidom
@@ -44,7 +50,8 @@ from esupy.processed_data_mgmt import read_source_metadata
 from esupy.remote import make_url_request
 from stewi.globals import write_metadata, compile_source_metadata, aggregate, \
     DATA_PATH, get_reliability_table_for_source, set_stewi_meta, config,\
-    store_inventory, paths, log
+    store_inventory, paths, log, workbook_cache_path, read_workbook_manifest,\
+    write_workbook_manifest
 from stewi.validate import update_validationsets_sources, validate_inventory,\
     write_validation_result
 from stewi.formats import StewiFormat
@@ -65,6 +72,12 @@ CH4GWP = 25
 N2OGWP = 298
 HFC23GWP = 14800
 
+# Envirofacts chunked downloads
+CHUNK_SIZE = 5000  # rows per request
+MAX_WORKERS = 4
+MAX_ATTEMPTS = 4
+BACKOFF_FACTOR = 3  # seconds, doubled for each retry
+
 # define column groupings
 ghgrp_cols = pd.read_csv(GHGRP_DATA_PATH.joinpath('ghgrp_columns.csv'))
 name_cols = list(ghgrp_cols[ghgrp_cols['ghg_name'] == 1]['column_name'])
@@ -80,6 +93,24 @@ base_cols = list(ghgrp_cols[ghgrp_cols['base_columns'] == 1]['column_name'])
 info_cols = name_cols + quantity_cols + method_cols
 group_cols = co2_cols + ch4_cols + n2o_cols
 ghg_cols = base_cols + info_cols + group_cols
+float_cols = list(ghgrp_cols[ghgrp_cols[
+    ['ghg_quantity', 'species_by_column', 'co2', 'ch4', 'n2o', 'subpart_c',
+     'co2e_quantity']].eq(1).any(axis=1)]['column_name'])
+
+# parquet types for subpart tables, only columns in ghgrp_columns.csv are kept
+TABLE_SCHEMA = {c: pa.int64() if c in base_cols else
+                pa.float64() if c in float_cols else pa.string()
+                for c in ghgrp_cols['column_name']}
+# parquet types for processed GHGRP data
+GHGRP_SCHEMA = {'FacilityID': pa.int64(),
+                'REPORTING_YEAR': pa.int64(),
+                'FlowAmount': pa.float64(),
+                'AmountCO2e': pa.float64(),
+                'METHOD': pa.string(),
+                'SUBPART_NAME': pa.string(),
+                'FlowName': pa.string(),
+                'FlowCode': pa.string(),
+                }
 
 # define filepaths for downloaded data
 data_summaries_path = OUTPUT_PATH.joinpath(
@@ -134,28 +165,77 @@ def get_row_count(table, report_year):
     return table_count
 
 
+def chunk_dir(filepath) -> Path:
+    """Return the directory of completed chunk downloads for filepath."""
+    filepath = Path(filepath)
+    return filepath.parent.joinpath(f'{filepath.stem}_chunks')
+
+
+def download_chunk(url, checkpoint=None):
+    """Download one chunk of a table, retrying failed requests with
+    exponential backoff. If passed, the chunk is saved to the checkpoint
+    path and not requested again while that file exists.
+    """
+    if checkpoint is not None and checkpoint.is_file():
+        return pd.read_csv(checkpoint, low_memory=False)
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        try:
+            r = make_url_request(url)
+            if r is not None:
+                break
+            error = 'no response'
+        except Exception as e:
+            error = e
+        if attempt == MAX_ATTEMPTS:
+            raise ConnectionError(f'{url} failed after {MAX_ATTEMPTS} '
+                                  f'attempts: {error}')
+        delay = BACKOFF_FACTOR * 2 ** (attempt - 1) * (1 + random.random())
+        log.debug(f'request failed ({error}), retrying in {delay:.1f}s')
+        time.sleep(delay)
+    if checkpoint is None:
+        return pd.read_csv(io.BytesIO(r.content), low_memory=False)
+    temp = checkpoint.with_name(f'.{checkpoint.name}.tmp')
+    temp.write_bytes(r.content)
+    temp.replace(checkpoint)
+    return pd.read_csv(checkpoint, low_memory=False)
+
+
 def download_chunks(table, table_count, m, row_start=0, report_year='',
-                    filepath=''):
-    """Download data from envirofacts in chunks."""
-    # Generate URL for each 5,000 row grouping and add to DataFrame
-    output_table = pd.DataFrame()
-    output_list = []
-    while row_start <= table_count:
-        row_end = row_start + 4999
-        table_url = generate_url(table=table, report_year=report_year,
-                                 row_start=row_start, row_end=row_end,
-                                 output_ext='csv')
-        log.debug(f'url: {table_url}')
-        table_temp, temp_time = import_table(table_url, get_time=True)
-        output_list.append(table_temp)
-        row_start += 5000
+                    filepath='', max_workers=MAX_WORKERS):
+    """Download data from envirofacts in chunks.
+
+    Chunks are requested concurrently and reassembled in row order. When a
+    filepath is passed, completed chunks are kept until the full table is
+    saved, so an interrupted download resumes from the missing chunks.
+    """
+    # Generate URL for each 5,000 row grouping
+    urls = [generate_url(table=table, report_year=report_year,
+                         row_start=start, row_end=start + CHUNK_SIZE - 1,
+                         output_ext='csv')
+            for start in range(row_start, table_count + 1, CHUNK_SIZE)]
+    if filepath:
+        checkpoint_dir = chunk_dir(filepath)
+        checkpoint_dir.mkdir(parents=True, exist_ok=True)
+        checkpoints = [checkpoint_dir.joinpath(f'{i}.csv')
+                       for i in range(len(urls))]
+    else:
+        checkpoints = [None] * len(urls)
+    log.debug(f'downloading {len(urls)} chunks of {table}')
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        output_list = list(executor.map(download_chunk, urls, checkpoints))
     output_table = pd.concat(output_list)
     output_table.columns=output_table.columns.str.upper()
-    m.add(time=temp_time, url=generate_url(table, report_year=report_year,
-                                           row_start='', output_ext='csv'),
+    output_table = clean_table_columns(output_table, table)
+    m.add(time=time.ctime(), url=generate_url(table, report_year=report_year,
+                                              row_start='', output_ext='csv'),
           filetype='Database', filename=filepath)
     if filepath:
-        output_table.to_csv(filepath, index=False)
+        if Path(filepath).suffix == '.parquet':
+            output_table = write_parquet(output_table, Path(filepath),
+                                         TABLE_SCHEMA)
+        else:
+            output_table.to_csv(filepath, index=False)
+        shutil.rmtree(checkpoint_dir)
     return output_table
 
 
@@ -170,16 +250,7 @@ def get_facilities(year):
         # folder structure may be duplicated
         facilities_file = (data_summaries_path / data_summaries_path.name /
                            f'ghgp_data_{year}.xlsx')
-    # load .xlsx file from filepath
-    facilities_dict = pd.read_excel(facilities_file, sheet_name=None,
-                                    skiprows=3)
-    # drop excel worksheets that we do not need
-    for s in ['Industry Type', 'FAQs about this Data']:
-        facilities_dict.pop(s, None)
-
-    # for all remaining worksheets, concatenate into single dataframe
     # certain columns need to be renamed for consistency
-
     col_dict = {'Reported Address': 'Address',
                 'Reported City': 'City',
                 'Reported County': 'County',
@@ -189,6 +260,20 @@ def get_facilities(year):
                 #'State where Emissions Occur':'State',
                 'Reported Zip Code': 'Zip Code',
                 }
+    rename_dict = {'Facility Id': 'FacilityID',
+                   'Primary NAICS Code': 'NAICS',
+                   'Facility Name': 'FacilityName',
+                   'Zip Code': 'Zip'}
+    # load worksheets we need from .xlsx file, excluding the
+    # Industry Type and FAQs about this Data worksheets
+    sheets = [s for s in get_sheet_names(facilities_file)
+              if s not in ['Industry Type', 'FAQs about this Data']]
+    facilities_dict = read_workbook(
+        facilities_file, sheets, skiprows=3,
+        columns=(list(col_dict.keys()) + list(col_dict.values()) +
+                 list(rename_dict.keys()) + StewiFormat.FACILITY.fields()))
+
+    # for all worksheets, concatenate into single dataframe
     facilities_df = pd.DataFrame()
     for s in facilities_dict.keys():
         for k in col_dict.keys():
@@ -199,10 +284,7 @@ def get_facilities(year):
                                    facilities_dict[s]]).reset_index(drop=True)
 
     # rename certain columns
-    facilities_df = facilities_df.rename(columns={'Facility Id': 'FacilityID',
-                                                  'Primary NAICS Code': 'NAICS',
-                                                  'Facility Name': 'FacilityName',
-                                                  'Zip Code': 'Zip'})
+    facilities_df = facilities_df.rename(columns=rename_dict)
     # keep only those columns we are interested in retaining
     facilities_df = facilities_df[StewiFormat.FACILITY.subset_fields(facilities_df)]
 
@@ -238,6 +320,7 @@ def import_or_download_table(filepath, table, year, m):
     if filepath.is_file():
         log.info(f'Importing data from {table}')
         table_df, creation_time = import_table(filepath, get_time=True)
+        table_df = clean_table_columns(table_df, table)
         m.add(time=creation_time, filename=filepath, filetype='Database',
               url=generate_url(table, report_year=year, row_start='',
                                output_ext='CSV'))
@@ -251,9 +334,11 @@ def import_or_download_table(filepath, table, year, m):
         table_df = download_chunks(table=table, table_count=row_count, m=m,
                                    report_year=year, filepath=filepath)
 
-    if table_df is None:
-        return None
+    return table_df
+
 
+def clean_table_columns(table_df, table):
+    """Drop unnamed columns and remove subpart-specific column prefixes."""
     # drop any unnamed columns
     table_df = table_df.drop(columns=table_df.columns[
             table_df.columns.str.contains('unnamed', case=False)])
@@ -263,10 +348,48 @@ def import_or_download_table(filepath, table, year, m):
     table_df.columns = np.where(cols.isna(),
                                 table_df.columns,
                                 cols)
-
     return table_df
 
 
+def write_parquet(df, filepath: Path, schema: dict) -> pd.DataFrame:
+    """Save the columns of df found in schema to parquet as those types.
+
+    Missing integers are stored as nulls, values that are not integers are
+    logged and stored as nulls.
+    :return: the stored dataframe, as returned by read_parquet
+    """
+    columns = [c for c in df if c in schema]
+    df = df[columns].copy()
+    for c in columns:
+        if schema[c] == pa.string():
+            df[c] = df[c].where(df[c].isna(), df[c].astype(str))
+        elif pa.types.is_integer(schema[c]):
+            values = pd.to_numeric(df[c], errors='coerce')
+            values = values.where(values % 1 == 0)
+            invalid = values.isna() & df[c].notna()
+            if invalid.any():
+                log.warning(f'{invalid.sum()} values of {c} are not integers '
+                            'and are stored as null')
+            df[c] = values.astype('Int64')
+    table = pa.Table.from_pandas(df, pa.schema([(c, schema[c]) for c in columns]),
+                                 preserve_index=False).replace_schema_metadata()
+    temp = filepath.with_name(f'.{filepath.name}.tmp')
+    pq.write_table(table, temp)
+    temp.replace(filepath)
+    return table_to_df(table)
+
+
+def read_parquet(filepath: Path) -> pd.DataFrame:
+    """Read a file saved by write_parquet."""
+    return table_to_df(pq.read_table(filepath))
+
+
+def table_to_df(table) -> pd.DataFrame:
+    """Convert a pyarrow table to a dataframe, reading integer columns as the
+    nullable Int64 type so that missing values keep the column integer."""
+    return table.to_pandas(types_mapper={pa.int64(): pd.Int64Dtype()}.get)
+
+
 def download_table(filepath: Path, url: str, get_time=False):
     """Download file at url to Path if it does not exist."""
     if not filepath.exists():
@@ -291,14 +414,19 @@ def download_table(filepath: Path, url: str, get_time=False):
 
 
 def import_table(path_or_reference, get_time=False):
-    """Read and return time of csv from url or Path."""
-    try:
-        df = pd.read_csv(path_or_reference, low_memory=False)
-    except (urllib.error.URLError, urllib3.exceptions.HTTPError) as exception:
-        log.warning(exception.reason)
-        log.info('retrying url...')
-        time.sleep(3) # at times increasing this for large tables can be useful
-        df = pd.read_csv(path_or_reference, low_memory=False)
+    """Read and return time of csv from url or Path, or of parquet Path."""
+    if (isinstance(path_or_reference, Path) and
+            path_or_reference.suffix == '.parquet'):
+        df = read_parquet(path_or_reference)
+    else:
+        try:
+            df = pd.read_csv(path_or_reference, low_memory=False)
+        except (urllib.error.URLError,
+                urllib3.exceptions.HTTPError) as exception:
+            log.warning(exception.reason)
+            log.info('retrying url...')
+            time.sleep(3) # at times increasing this for large tables can be useful
+            df = pd.read_csv(path_or_reference, low_memory=False)
     if get_time and isinstance(path_or_reference, Path):
         retrieval_time = path_or_reference.stat().st_ctime
         return df, time.ctime(retrieval_time)
@@ -308,6 +436,74 @@ def import_table(path_or_reference, get_time=False):
     return df
 
 
+def get_sheet_names(path: Path) -> list:
+    """Return the sheet names of a workbook, in workbook order."""
+    cache_path = workbook_cache_path(path, OUTPUT_PATH)
+    manifest = read_workbook_manifest(cache_path)
+    if 'sheet_names' not in manifest:
+        cache_path.mkdir(parents=True, exist_ok=True)
+        with pd.ExcelFile(path) as xl:
+            manifest['sheet_names'] = xl.sheet_names
+        write_workbook_manifest(cache_path, manifest)
+    return manifest['sheet_names']
+
+
+def read_workbook(path: Path, sheets, columns=None, skiprows=0) -> dict:
+    """Read sheets of an Excel workbook from a parquet cache keyed by the
+    workbook's hash. Sheets are parsed from the workbook only when they are
+    not yet cached with the requested columns. Line breaks in column names
+    are replaced with spaces.
+
+    :param path: Path, Excel workbook
+    :param sheets: list, names of the sheets to read
+    :param columns: list, names of the columns to keep, if None keeps all
+    :param skiprows: int, number of rows above the header row
+    :return: dict of DataFrames by sheet name
+    """
+    cache_path = workbook_cache_path(path, OUTPUT_PATH)
+    cache_path.mkdir(parents=True, exist_ok=True)
+    manifest = read_workbook_manifest(cache_path)
+    cached = {}
+    for sheet in sheets:
+        entry = manifest['sheets'].get(f'{sheet}|{skiprows}')
+        if entry is not None and (entry['columns'] is None or (
+                columns is not None and
+                set(columns).issubset(entry['columns']))):
+            cached[sheet] = entry
+    stale = [s for s in sheets if s not in cached]
+    if stale:
+        # include columns cached previously for those sheets
+        keep = None if columns is None else set(columns).union(*[
+            manifest['sheets'].get(f'{s}|{skiprows}', {}).get('columns', [])
+            for s in stale])
+        log.info(f'converting {len(stale)} sheets of {path.name} to parquet')
+        with warnings.catch_warnings():
+            # Avoid the UserWarning for openpyxl "Unknown extension is not supported"
+            warnings.filterwarnings("ignore", category=UserWarning)
+            sheet_dict = pd.read_excel(
+                path, sheet_name=stale, skiprows=skiprows,
+                usecols=None if keep is None else
+                (lambda c: str(c).replace('\n', ' ') in keep))
+        for sheet, df in sheet_dict.items():
+            df.columns = [str(c).replace('\n', ' ') for c in df.columns]
+            schema = {c: pa.string() if (pd.api.types.is_object_dtype(df[c]) or
+                                         pd.api.types.is_string_dtype(df[c]))
+                      else pa.from_numpy_dtype(df[c].dtype) for c in df}
+            filename = re.sub(r'[^\w.-]', '_', sheet) + f'_{skiprows}.parquet'
+            write_parquet(df, cache_path.joinpath(filename), schema)
+            cached[sheet] = {'file': filename,
+                             'columns': None if keep is None else sorted(keep)}
+            manifest['sheets'][f'{sheet}|{skiprows}'] = cached[sheet]
+        write_workbook_manifest(cache_path, manifest)
+    sheet_dict = {}
+    for sheet in sheets:
+        df = pd.read_parquet(cache_path.joinpath(cached[sheet]['file']))
+        if columns is not None:
+            df = df[[c for c in df if c in columns]]
+        sheet_dict[sheet] = df
+    return sheet_dict
+
+
 def download_and_parse_subpart_tables(year, m):
     """
     Generates a list of required subpart tables, based on report year.
@@ -339,7 +535,7 @@ def download_and_parse_subpart_tables(year, m):
     table_list = []
     for subpart_emissions_table in year_tables['TABLE']:
         # define filepath where subpart emissions table will be stored
-        filepath = tables_dir.joinpath(f"{subpart_emissions_table}.csv")
+        filepath = tables_dir.joinpath(f"{subpart_emissions_table}.parquet")
         table_df = import_or_download_table(filepath, subpart_emissions_table,
                                             year, m)
         if table_df is None:
@@ -471,25 +667,18 @@ def calculate_combustion_emissions(df):
 def parse_additional_suparts_data(addtnl_subparts_path, subpart_cols_file, year):
     log.info(f'loading additional subpart data from {addtnl_subparts_path}')
 
-    with warnings.catch_warnings():
-        # Avoid the UserWarning for openpyxl "Unknown extension is not supported"
-        warnings.filterwarnings("ignore", category=UserWarning)
-        # load .xslx data for additional subparts from filepath
-        addtnl_subparts_dict = pd.read_excel(addtnl_subparts_path,
-                                             sheet_name=None)
     # import column headers data for additional subparts
     subpart_cols = pd.read_csv(GHGRP_DATA_PATH.joinpath(subpart_cols_file))
     # get list of tabs to process
     addtnl_tabs = subpart_cols['tab_name'].unique()
-    for key, df in list(addtnl_subparts_dict.items()):
-        if key in addtnl_tabs:
-            for column in df:
-                df.rename(columns={column: column.replace('\n',' ')}, inplace=True)
-                df.rename(columns={'Facility ID': 'GHGRP ID',
-                                   'Reporting Year': 'Year'}, inplace=True)
-            addtnl_subparts_dict[key] = df
-        else:
-            del addtnl_subparts_dict[key]
+    # load .xslx data for additional subparts from filepath
+    addtnl_subparts_dict = read_workbook(
+        addtnl_subparts_path, list(addtnl_tabs),
+        columns=(list(subpart_cols['column_name']) +
+                 ['Facility ID', 'GHGRP ID', 'Reporting Year', 'Year']))
+    for key, df in addtnl_subparts_dict.items():
+        addtnl_subparts_dict[key] = df.rename(columns={'Facility ID': 'GHGRP ID',
+                                                       'Reporting Year': 'Year'})
     # initialize dataframe
     ghgrp = pd.DataFrame()
     addtnl_base_cols = ['GHGRP ID', 'Year']
@@ -505,8 +694,12 @@ def parse_additional_suparts_data(addtnl_subparts_path, subpart_cols_file, year)
         # create temporary dataframe from worksheet, using just the desired columns
         subpart_df = addtnl_subparts_dict[tab][
             addtnl_base_cols + list(set().union(*col_dict.values()))]
-        # keep only those data for the specified report year
-        subpart_df = subpart_df[subpart_df['Year'] == int(year)]
+        # keep only those data for the specified report year, years are
+        # cached as text when the column has other values
+        subpart_df = subpart_df.assign(
+            Year=pd.to_numeric(subpart_df['Year'], errors='coerce'))
+        subpart_df = (subpart_df[subpart_df['Year'] == int(year)]
+                      .astype({'Year': int}))
 
         if 'method' in col_dict.keys():
             # combine all method equation columns into one, drop old method columns
@@ -532,8 +725,9 @@ def parse_additional_suparts_data(addtnl_subparts_path, subpart_cols_file, year)
                                   var_name='Flow Description',
                                   value_name='FlowAmount')
 
-        # drop those rows where flow amount is confidential
-        temp_df = temp_df[temp_df['FlowAmount'] != 'confidential']
+        # flow amounts that are confidential become NaN and are dropped
+        temp_df['FlowAmount'] = pd.to_numeric(temp_df['FlowAmount'],
+                                              errors='coerce')
 
         # add 1-2 letter subpart abbreviation
         temp_df['SUBPART_NAME'] = cols['subpart_abbr'][0]
@@ -774,7 +968,7 @@ def main(**kwargs):
 
     for year in kwargs['Year']:
         year = str(year)
-        pickle_file = OUTPUT_PATH.joinpath(f'GHGRP_{year}.pk')
+        ghgrp_file = OUTPUT_PATH.joinpath(f'GHGRP_{year}.parquet')
         if kwargs['Option'] == 'A':
 
             m = MetaGHGRP()
@@ -814,15 +1008,15 @@ def main(**kwargs):
                                       'GAS_CODE': 'FlowCode'})
                      )
 
-            # pickle data and save to network
-            log.info(f'saving processed GHGRP data to {pickle_file}')
-            ghgrp.to_pickle(pickle_file)
+            # save processed data to network
+            log.info(f'saving processed GHGRP data to {ghgrp_file}')
+            write_parquet(ghgrp, ghgrp_file, GHGRP_SCHEMA)
 
             generate_metadata(year, m, datatype='source')
 
         if kwargs['Option'] == 'B':
-            log.info(f'extracting data from {pickle_file}')
-            ghgrp = pd.read_pickle(pickle_file)
+            log.info(f'extracting data from {ghgrp_file}')
+            ghgrp = read_parquet(ghgrp_file)
 
             # import data reliability scores
             ghgrp_reliability_table = get_reliability_table_for_source('GHGRPa')
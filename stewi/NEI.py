@@ -24,6 +24,7 @@ Year:
 import argparse
 import io
 import zipfile
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 import pandas as pd
@@ -44,60 +45,66 @@ _config = config()['databases']['NEI']
 EXT_DIR = 'NEI Data Files'
 OUTPUT_PATH = paths.local_path / EXT_DIR
 NEI_DATA_PATH = DATA_PATH / 'NEI'
+MAX_WORKERS = 4  # NEI files read concurrently
 
 
-def read_data(year, file):
+def read_required_fields(year):
+    """Return the NEI source fields for year and their Standardized EPA names.
+
+    :param year : str, Year of NEI dataset for identifying field names
+    :returns dict of Standardized EPA names by source field
+    """
+    nei_required_fields = pd.read_table(NEI_DATA_PATH
+                                        .joinpath('NEI_required_fields.csv'),
+                                        sep=',')
+    nei_required_fields = (nei_required_fields[[year, 'StandardizedEPA']]
+                           .dropna(subset=[year]))
+    return dict(zip(nei_required_fields[year],
+                    nei_required_fields['StandardizedEPA']))
+
+
+def read_data(year, file, fields=None):
     """Read NEI data and return a dataframe based on identified columns.
 
     :param year : str, Year of NEI dataset for identifying field names
     :param file : str, File path containing NEI data (parquet).
+    :param fields : dict, optional, from read_required_fields(year)
     :returns df : DataFrame of NEI data from a single file
         with standardized column names.
     """
-    nei_required_fields = pd.read_table(NEI_DATA_PATH
-                                        .joinpath('NEI_required_fields.csv'),
-                                        sep=',')
-    nei_required_fields = nei_required_fields[[year, 'StandardizedEPA']]
-    usecols = list(nei_required_fields[year].dropna())
-    df = pd.read_parquet(file, columns=usecols)
+    if fields is None:
+        fields = read_required_fields(year)
+    df = pd.read_parquet(file, columns=list(fields.keys()))
     # change column names to Standardized EPA names
-    df = df.rename(columns=pd.Series(list(nei_required_fields['StandardizedEPA']),
-                                     index=list(nei_required_fields[year])).to_dict())
+    df = df.rename(columns=fields)
     return df
 
 
-def standardize_output(year, source='Point'):
-    """Read and parses NEI data.
-
-    :param year : str, Year of NEI dataset
-    :returns nei: DataFrame of parsed NEI data.
-    """
-    nei = pd.DataFrame()
-    # read in nei files and concatenate all nei files into one dataframe
-    nei_file_path = _config[year]['file_name']
-    for file in nei_file_path:
-        filename = OUTPUT_PATH.joinpath(file)
-        if not filename.is_file():
-            log.info(f'{file} not found in {OUTPUT_PATH}, '
-                     'downloading source data')
-            # download source file and metadata
-            file_meta = set_stewi_meta(strip_file_extension(file))
-            file_meta.category = EXT_DIR
-            file_meta.tool = file_meta.tool.lower()
-            download_from_remote(file_meta, paths)
-        # concatenate all other files
-        log.info(f'reading NEI data from {filename}')
-        nei = pd.concat([nei, read_data(year, filename)])
-        log.debug(f'{str(len(nei))} records')
+def get_source_file(file):
+    """Return the path to an NEI source file, downloading it if needed."""
+    filename = OUTPUT_PATH.joinpath(file)
+    if not filename.is_file():
+        log.info(f'{file} not found in {OUTPUT_PATH}, '
+                 'downloading source data')
+        # download source file and metadata
+        file_meta = set_stewi_meta(strip_file_extension(file))
+        file_meta.category = EXT_DIR
+        file_meta.tool = file_meta.tool.lower()
+        download_from_remote(file_meta, paths)
+    return filename
+
+
+def parse_data(year, filename, fields, source='Point',
+               reliability_table=None):
+    """Read a single NEI file, convert units and add reliability scores."""
+    log.info(f'reading NEI data from {filename}')
+    nei = read_data(year, filename, fields)
     # convert TON to KG
     nei['FlowAmount'] = nei['FlowAmount'] * USton_kg
 
-    log.info('adding Data Quality information')
     if source == 'Point':
-        nei_reliability_table = get_reliability_table_for_source('NEI')
-        nei_reliability_table['Code'] = nei_reliability_table['Code'].astype(float)
         nei['ReliabilityScore'] = nei['ReliabilityScore'].astype(float)
-        nei = nei.merge(nei_reliability_table, left_on='ReliabilityScore',
+        nei = nei.merge(reliability_table, left_on='ReliabilityScore',
                         right_on='Code', how='left')
         nei['DataReliability'] = nei['DQI Reliability Score']
         # drop Code and DQI Reliability Score columns
@@ -109,7 +116,32 @@ def standardize_output(year, source='Point'):
         nei['DataReliability'] = 3
     # add Source column
     nei['Source'] = source
-    nei = nei.reset_index(drop=True)
+    log.debug(f'{str(len(nei))} records in {filename.name}')
+    return nei
+
+
+def standardize_output(year, source='Point', max_workers=MAX_WORKERS):
+    """Read and parses NEI data.
+
+    Files are read and parsed concurrently and concatenated once.
+    :param year : str, Year of NEI dataset
+    :param max_workers : int, maximum number of files read at once
+    :returns nei: DataFrame of parsed NEI data.
+    """
+    fields = read_required_fields(year)
+    files = [get_source_file(file) for file in _config[year]['file_name']]
+    if source == 'Point':
+        log.info('adding Data Quality information')
+        nei_reliability_table = get_reliability_table_for_source('NEI')
+        nei_reliability_table['Code'] = nei_reliability_table['Code'].astype(float)
+    else:
+        nei_reliability_table = None
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        nei_list = list(executor.map(
+            lambda f: parse_data(year, f, fields, source,
+                                 nei_reliability_table), files))
+    nei = pd.concat(nei_list, ignore_index=True)
+    log.debug(f'{str(len(nei))} records')
     return nei
 
 
@@ -8,7 +8,7 @@ Option -Y Year -T Table1 Table2 ... TableN
 where Option is either A, B, C:
 Options
 A - for extracting files from RCRAInfo site
-B - organize files by year
+B - organize files by year, for all report cycles
 C - for processing Biennial Report into flowbyfacility, validation, and metadata saving
 Year is like 2015 with coverage up for 2011, 2013, 2015
 # List of tables:
@@ -98,9 +98,12 @@ See more documentation of files at https://rcrapublic.epa.gov/rcrainfoweb/
 """
 
 import pandas as pd
+import pyarrow as pa
 import zipfile
 import argparse
 import os
+import re
+import shutil
 import time
 import json
 import io
@@ -122,6 +125,8 @@ EXT_DIR = 'RCRAInfo Data Files'
 OUTPUT_PATH = paths.local_path / EXT_DIR
 RCRA_DATA_PATH = DATA_PATH / 'RCRAInfo'
 DIR_RCRA_BY_YEAR = OUTPUT_PATH / 'RCRAInfo_by_year'
+BR_DATASET = DIR_RCRA_BY_YEAR / 'br_reporting'  # partitioned by year
+CHUNK_SIZE = 500000
 
 
 def waste_description_cleaner(x):
@@ -171,54 +176,97 @@ def download_and_extract_zip(tables):
     log.info('file extraction complete')
 
 
-def organize_br_reporting_files_by_year(tables, year):
-    """Consolidate BR_REPORTING files to single csv."""
-    year = int(year)
-    for table in tables:
-        if 'BR_REPORTING' in table:
-            log.info(f'organizing data for {table} from {year}...')
-            linewidthsdf = pd.read_csv(RCRA_DATA_PATH
-                                       .joinpath('RCRA_FlatFile_LineComponents.csv'))
-            fields = linewidthsdf['Data Element Name'].tolist()
-            files = sorted([file for file in OUTPUT_PATH
-                            .glob(f'{table}*{year}*.csv')])
-            df_full = pd.DataFrame()
-            for filepath in files:
-                log.info(f'extracting {filepath}')
-                df = pd.read_csv(filepath, header=0,
-                                 usecols=list(range(0, len(fields))),
-                                 names=fields,
-                                 low_memory=False,
-                                 encoding='utf-8')
-                df = df[df['Report Cycle'].apply(
-                    lambda x: str(x).replace('.0', '').isdigit())]
-                if df['Location Street Number'].dtype != 'str':
-                    df['Location Street Number'] = df['Location Street Number'].astype(str)
-                    df['Location Street Number'] = df['Location Street Number'].apply(
-                        lambda x: str(x).replace('.0', ''))
-                df['Report Cycle'] = df['Report Cycle'].astype(int)
-                df = df[df['Report Cycle'] == year]
-                df_full = pd.concat([df_full, df])
-            DIR_RCRA_BY_YEAR.mkdir(exist_ok=True)
-            filepath = DIR_RCRA_BY_YEAR.joinpath(f'br_reporting_{year}.csv')
-            log.info(f'saving to {filepath}...')
-            df_full.to_csv(filepath, index=False)
-            generate_metadata(year, files, datatype='source')
-        else:
-            log.info(f'skipping {table}')
+def organize_br_reporting_files(tables, years=None):
+    """Partition BR_REPORTING files by report cycle in a single pass.
+
+    Each file is read once in chunks and rows are written to a parquet
+    dataset partitioned by year, keeping rows whose report cycle matches
+    the year in the file name.
+
+    :param tables: list of tables, files are organized if BR_REPORTING is
+        included
+    :param years: list of years, if passed only the partitions for those
+        years are replaced, otherwise all report cycles are organized
+    """
+    if not any('BR_REPORTING' in table for table in tables):
+        log.info(f'skipping {", ".join(tables)}')
+        return
+    linewidthsdf = pd.read_csv(RCRA_DATA_PATH
+                               .joinpath('RCRA_FlatFile_LineComponents.csv'))
+    fields = linewidthsdf['Data Element Name'].tolist()
+    schema = pa.schema([(f, pa.string()) for f in fields])
+    files = sorted(OUTPUT_PATH.glob('BR_REPORTING*.csv'))
+    if years is not None:
+        years = {int(y) for y in years}
+    # write to a temporary directory and replace the dataset when complete
+    temp = BR_DATASET.with_name(
+        f'.{BR_DATASET.name}.tmp' if years is None else
+        f'.{BR_DATASET.name}_{"_".join(map(str, sorted(years)))}.tmp')
+    shutil.rmtree(temp, ignore_errors=True)
+    files_by_year = {}
+    for filepath in files:
+        file_years = {int(y) for y in
+                      re.findall(r'(?<!\d)\d{4}(?!\d)', filepath.stem)}
+        keep_years = (file_years & years if file_years and years
+                      else file_years or years)
+        if keep_years == set():
+            # no requested year in the file
+            continue
+        log.info(f'extracting {filepath}')
+        chunks = pd.read_csv(filepath, header=0,
+                             usecols=list(range(0, len(fields))),
+                             names=fields, dtype=str, chunksize=CHUNK_SIZE,
+                             encoding='utf-8')
+        for i, df in enumerate(chunks):
+            cycle = df['Report Cycle'].str.replace('.0', '', regex=False)
+            keep = cycle.str.fullmatch(r'\d+', na=False)
+            df = df[keep].assign(**{'Report Cycle': cycle[keep]})
+            year = df['Report Cycle'].astype(int)
+            if keep_years:
+                df = df[year.isin(keep_years)]
+                year = year[df.index]
+            for y, df_year in df.groupby(year):
+                path = temp.joinpath(f'year={y}')
+                path.mkdir(parents=True, exist_ok=True)
+                df_year.to_parquet(path.joinpath(f'{filepath.stem}_{i}.parquet'),
+                                   schema=schema, index=False)
+                files_by_year.setdefault(y, set()).add(filepath)
+    DIR_RCRA_BY_YEAR.mkdir(exist_ok=True)
+    if years is None:
+        shutil.rmtree(BR_DATASET, ignore_errors=True)
+        if temp.exists():
+            temp.replace(BR_DATASET)
+    else:
+        BR_DATASET.mkdir(exist_ok=True)
+        for y in years:
+            partition = BR_DATASET.joinpath(f'year={y}')
+            shutil.rmtree(partition, ignore_errors=True)
+            if temp.joinpath(f'year={y}').exists():
+                temp.joinpath(f'year={y}').replace(partition)
+        shutil.rmtree(temp, ignore_errors=True)
+    log.info(f'saved report cycles {", ".join(map(str, sorted(files_by_year)))}'
+             f' to {BR_DATASET}')
+    for year, year_files in files_by_year.items():
+        generate_metadata(year, sorted(year_files), datatype='source')
 
 
 def Generate_RCRAInfo_files_csv(report_year):
     """Generate stewi inventory files from downloaded data files."""
     log.info(f'generating inventory files for {report_year}')
-    filepath = DIR_RCRA_BY_YEAR.joinpath(f'br_reporting_{str(report_year)}.csv')
+    filepath = BR_DATASET.joinpath(f'year={report_year}')
+    if not filepath.is_dir():
+        raise stewi.exceptions.DataNotFoundError(
+            message=(f'BR_REPORTING data for {report_year} missing, organize '
+                     'files by year (Option B) before proceeding'))
     # Get columns to keep
     fieldstokeep = pd.read_csv(RCRA_DATA_PATH.joinpath('RCRA_required_fields.txt'),
                                header=None)
-    # on_bad_lines requires pandas >= 1.3
-    df = pd.read_csv(filepath, header=0, usecols=list(fieldstokeep[0]),
-                     low_memory=False, on_bad_lines='skip',
-                     encoding='ISO-8859-1')
+    # in the column order of the source files
+    fields = pd.read_csv(RCRA_DATA_PATH
+                         .joinpath('RCRA_FlatFile_LineComponents.csv')
+                         )['Data Element Name']
+    df = pd.read_parquet(filepath, columns=list(
+        fields[fields.isin(fieldstokeep[0])]))
 
     log.info(f'completed reading {filepath}')
     # Checking the Waste Generation Data Health
@@ -420,6 +468,12 @@ def main(**kwargs):
     if len(kwargs) == 0:
         kwargs = vars(parser.parse_args())
 
+    if kwargs['Option'] == 'B':
+        # report cycles are organized in a single pass, all of them if no
+        # year is passed
+        organize_br_reporting_files(kwargs.get('Tables', ['BR_REPORTING']),
+                                    kwargs.get('Year'))
+
     for year in kwargs['Year']:
         if int(year) % 2 == 0:
             raise stewi.exceptions.InventoryNotAvailableError(
@@ -437,9 +491,6 @@ def main(**kwargs):
         if kwargs['Option'] == 'A':
             download_and_extract_zip(tables)
 
-        elif kwargs['Option'] == 'B':
-            organize_br_reporting_files_by_year(kwargs['Tables'], year)
-
         elif kwargs['Option'] == 'C':
             Generate_RCRAInfo_files_csv(year)
 
@@ -23,19 +23,21 @@ Year:
 
 """
 
+import csv
+import itertools
 import zipfile
 import pandas as pd
 import time
 import io
 import argparse
-import re
+import requests
 
 from esupy.processed_data_mgmt import read_source_metadata
-from esupy.remote import url_is_alive, make_url_request
+from esupy.remote import url_is_alive
 from stewi.globals import unit_convert, DATA_PATH, set_stewi_meta,\
     get_reliability_table_for_source, write_metadata,\
     lb_kg, g_kg, config, store_inventory, log, paths, compile_source_metadata,\
-    aggregate, assign_secondary_context, concat_compartment
+    aggregate, assign_secondary_context, concat_compartment, get_peak_memory_mb
 from stewi.validate import update_validationsets_sources, validate_inventory,\
     write_validation_result
 import stewi.exceptions
@@ -45,31 +47,74 @@ EXT_DIR = 'TRI Data Files'
 OUTPUT_PATH = paths.local_path / EXT_DIR
 _config = config()['databases']['TRI']
 TRI_DATA_PATH = DATA_PATH / 'TRI'
+# number of lines parsed and written at a time when extracting files
+CHUNK_SIZE = 100000
 
 
 def extract_TRI_data_files(link_zip, files, year):
-    r_file = make_url_request(link_zip)
-    for file in files:
-        df_columns = pd.read_csv(TRI_DATA_PATH
-                                 .joinpath(f'TRI_File_{file}_columns.txt'),
-                                 header=0)
-        columns = list(df_columns['Names'])
-        filename = f'US_{file}_{year}'
-        dic = {}
-        i = 0
-        with zipfile.ZipFile(io.BytesIO(r_file.content)) as z:
+    """Download the TRI Basic Plus zip archive and extract the files to csv.
+
+    The archive is streamed to a temporary file rather than held in memory.
+    :return: dictionary of extraction statistics by file
+    """
+    OUTPUT_PATH.mkdir(parents=True, exist_ok=True)
+    zip_path = OUTPUT_PATH.joinpath(f'US_{year}.zip.part')
+    try:
+        with requests.get(link_zip, stream=True, timeout=60) as r:
+            r.raise_for_status()
+            with open(zip_path, 'wb') as f:
+                for chunk in r.iter_content(2**20):
+                    f.write(chunk)
+        return extract_TRI_zip(zip_path, files, year)
+    finally:
+        zip_path.unlink(missing_ok=True)
+
+
+def extract_TRI_zip(zip_path, files, year):
+    """Extract the tab delimited TRI files from the zip archive to csv.
+
+    Lines are parsed and written in chunks to limit memory use. Lines with
+    fewer fields than columns are padded with empty values.
+    :return: dictionary of extraction statistics by file
+    """
+    extraction_stats = {}
+    with zipfile.ZipFile(zip_path) as z:
+        for file in files:
+            df_columns = pd.read_csv(TRI_DATA_PATH
+                                     .joinpath(f'TRI_File_{file}_columns.txt'),
+                                     header=0)
+            columns = list(df_columns['Names'])
+            n = len(columns)
+            filename = f'US_{file}_{year}'
+            outfile = OUTPUT_PATH.joinpath(f'{filename}.csv')
+            start = time.time()
+            rows = 0
             with io.TextIOWrapper(z.open(filename + '.txt', mode='r'),
-                                  errors='replace') as txtfile:
-                for line in txtfile:
-                    dic[i] = pd.Series(re.split("\t", line)).truncate(after=len(columns)-1)
-                    i+=1
-        # remove the first row in the dictionary which is the original headers
-        del dic[0]
-        df = pd.DataFrame.from_dict(dic, orient='index')
-        df.columns = columns
-        OUTPUT_PATH.mkdir(parents=True, exist_ok=True)
-        df.to_csv(OUTPUT_PATH.joinpath(f'{filename}.csv'), index=False)
-        log.info(f'{filename}.csv saved to {OUTPUT_PATH}')
+                                  errors='replace', newline='') as txtfile:
+                reader = csv.reader(txtfile, delimiter='\t',
+                                    quoting=csv.QUOTE_NONE)
+                # skip the first line which is the original headers
+                next(reader, None)
+                mode = 'w'
+                while True:
+                    chunk = [line[:n] + [None] * (n - len(line)) for line in
+                             itertools.islice(reader, CHUNK_SIZE)]
+                    if not chunk and mode == 'a':
+                        break
+                    (pd.DataFrame(chunk, columns=columns)
+                       .to_csv(outfile, mode=mode, header=(mode == 'w'),
+                               index=False))
+                    rows += len(chunk)
+                    mode = 'a'
+            elapsed = time.time() - start
+            extraction_stats[filename] = {
+                'rows': rows,
+                'seconds': round(elapsed, 1),
+                'rows_per_second': round(rows / elapsed) if elapsed else None,
+                'peak_memory_MB': get_peak_memory_mb(),
+                }
+            log.info(f'{filename}.csv saved to {OUTPUT_PATH}')
+    return extraction_stats
 
 
 def generate_national_totals(year):
@@ -155,46 +200,87 @@ def concat_req_field(list):
     return source_name
 
 
-# Cycle through file importing by release type, the dictionary key
+# TRI facility fields in US_1a and their name and dtype in StEWI
+TRI_FACILITY_CROSSWALK = {
+    'TRIFID': ['FacilityID', 'str'],
+    'FACILITY NAME': ['FacilityName', 'str'],
+    'FACILITY STREET': ['Address', 'str'],
+    'FACILITY CITY': ['City', 'str'],
+    'FACILITY COUNTY': ['County', 'str'],
+    'FACILITY STATE': ['State', 'str'],
+    'FACILITY ZIP CODE': ['Zip', 'str'],
+    'PRIMARY NAICS CODE': ['NAICS', 'str'],
+    'LATITUDE': ['Latitude', 'float64'],
+    'LONGITUDE': ['Longitude', 'float64'],
+    }
+
+
 def import_TRI_by_release_type(d, year):
-    # Import TRI file
+    """Import the release types in the dictionary keys from the TRI files.
+
+    Each file is read once with the fields of all of its release types,
+    which are then unpivoted to one row per release type. Facility data
+    are taken from the same read of US_1a.
+    :param d: dictionary of release type and list of fields
+    :param year: str
+    :return: tuple of dataframes of releases and of facilities
+    """
     tri_release_output_fieldnames = ['FacilityID', 'CAS', 'FlowName',
-                                     'Unit', 'FlowAmount', 'Basis of Estimate',
-                                     'ReleaseType']
-    df_list = []
+                                     'Unit', 'FlowAmount', 'Basis of Estimate']
+    release_types_by_file = {}
     for k, v in d.items():
+        if k == 'offsiteland' or k == 'offsiteother':
+            file = '3a'
+        else:
+            file = '1a'
+        release_types_by_file.setdefault(file, {})[k] = v
+    parts = {}
+    tri_facility = None
+    for file, release_types in release_types_by_file.items():
         dtype_dict = {'TRIFID': "str",
                       'CHEMICAL NAME': "str",
                       'CAS NUMBER': "str",
                       'UNIT OF MEASURE': "str",
                       }
-        dtype_dict[v[4]] = "float64" # FlowAmount field
-        if len(v) > 5:
-            dtype_dict[v[5]] = "str" # Basis of Estimate field
-        if k == 'offsiteland' or k == 'offsiteother':
-            file = '3a'
-        else:
-            file = '1a'
+        for v in release_types.values():
+            dtype_dict[v[4]] = "float64" # FlowAmount field
+            if len(v) > 5:
+                dtype_dict[v[5]] = "str" # Basis of Estimate field
+        if file == '1a':
+            dtype_dict.update({k: v[1] for k, v in
+                               TRI_FACILITY_CROSSWALK.items()})
         tri_csv = OUTPUT_PATH.joinpath(f'US_{file}_{year}.csv')
         try:
-            tri_part = pd.read_csv(tri_csv, usecols=v,
+            tri_file = pd.read_csv(tri_csv, usecols=dtype_dict.keys(),
                                    low_memory=False,
                                    dtype=dtype_dict)
-            tri_part['ReleaseType'] = k
-            tri_part.columns = tri_release_output_fieldnames
-            tri_part = (
+        except FileNotFoundError:
+            log.error(f'{file}.csv file not found in {tri_csv}')
+            continue
+        if file == '1a':
+            tri_facility = (tri_file[list(TRI_FACILITY_CROSSWALK.keys())]
+                            .drop_duplicates(ignore_index=True)
+                            .rename(columns={k: v[0] for k, v in
+                                             TRI_FACILITY_CROSSWALK.items()}))
+        for k, v in release_types.items():
+            tri_part = tri_file[['TRIFID', 'CAS NUMBER', 'CHEMICAL NAME',
+                                 'UNIT OF MEASURE'] + v[4:6]]
+            tri_part.columns = tri_release_output_fieldnames[:len(v)]
+            parts[k] = (
                 tri_part
                 .dropna(subset=['FlowAmount'])
-                .assign(**{"Basis of Estimate": lambda x: 
+                .assign(**{"Basis of Estimate": lambda x:
                            x['Basis of Estimate'].str.strip()})
                 .query('FlowAmount != 0')
+                .assign(ReleaseType=k)
             )
-            df_list.append(tri_part)
-        except FileNotFoundError:
-            log.error(f'{file}.csv file not found in {tri_csv}')
-    if len(df_list) == 0:
+        del tri_file
+    if len(parts) == 0 or tri_facility is None:
         raise stewi.exceptions.DataNotFoundError
-    return pd.concat(df_list, ignore_index=True)
+    # maintain the order of release types in the dictionary
+    tri = pd.concat([parts[k] for k in d.keys() if k in parts],
+                    ignore_index=True)
+    return tri, tri_facility
 
 
 def validate_national_totals(inv, TRIyear):
@@ -242,7 +328,7 @@ def generate_TRI_files_csv(TRIyear):
     # Create dict of required fields on import for each release type
     import_dict = dict(zip(keys, values))
     # Build the TRI DataFrame
-    tri = import_TRI_by_release_type(import_dict, TRIyear)
+    tri, tri_facility = import_TRI_by_release_type(import_dict, TRIyear)
     # Import reliability scores for TRI
     tri = (pd.merge(tri, get_reliability_table_for_source('TRI'),
                     left_on='Basis of Estimate',
@@ -261,28 +347,7 @@ def generate_TRI_files_csv(TRIyear):
               .rename(columns={'Amount_kg': 'FlowAmount',
                                'DQI Reliability Score': 'DataReliability'}))
 
-    # FACILITY - import and handle TRI facility data
-    TRI_facility_name_crosswalk = {
-        'TRIFID': ['FacilityID', 'str'],
-        'FACILITY NAME': ['FacilityName', 'str'],
-        'FACILITY STREET': ['Address', 'str'],
-        'FACILITY CITY': ['City', 'str'],
-        'FACILITY COUNTY': ['County', 'str'],
-        'FACILITY STATE': ['State', 'str'],
-        'FACILITY ZIP CODE': ['Zip', 'str'],
-        'PRIMARY NAICS CODE': ['NAICS', 'str'],
-        'LATITUDE': ['Latitude', 'float64'],
-        'LONGITUDE': ['Longitude', 'float64'],
-        }
-    tri_facility = (pd.read_csv(OUTPUT_PATH.joinpath(f'US_1a_{TRIyear}.csv'),
-                                usecols=TRI_facility_name_crosswalk.keys(),
-                                low_memory=False,
-                                dtype={k:v[1] for k, v in 
-                                       TRI_facility_name_crosswalk.items()})
-                      .drop_duplicates(ignore_index=True)
-                      .rename(columns={k:v[0] for k, v in 
-                                       TRI_facility_name_crosswalk.items()})
-                      )
+    # FACILITY - handle TRI facility data
     tri_facility, parameters = assign_secondary_context(
         tri_facility, int(TRIyear), 'urb')
     store_inventory(tri_facility, f'TRI_{TRIyear}', 'facility')
@@ -309,7 +374,8 @@ def generate_TRI_files_csv(TRIyear):
     return parameters
 
 
-def generate_metadata(year, files, parameters=None, datatype='inventory'):
+def generate_metadata(year, files, parameters=None, datatype='inventory',
+                      extraction_stats=None):
     """Get metadata and writes to .json."""
     if datatype == 'source':
         source_path = [str(OUTPUT_PATH.joinpath(f'US_{p}_{year}.csv')) for p in files]
@@ -317,6 +383,8 @@ def generate_metadata(year, files, parameters=None, datatype='inventory'):
         source_meta['SourceType'] = 'Zip file'
         tri_version = 'last'
         source_meta['SourceVersion'] = tri_version
+        if extraction_stats:
+            source_meta['ExtractionStats'] = extraction_stats
         write_metadata(f'TRI_{year}', source_meta, category=EXT_DIR,
                        datatype='source')
     else:
@@ -364,8 +432,9 @@ def main(**kwargs):
             if url_is_alive(tri_url):
                 link_zip_TRI = _config.get('zip_url').replace("{year}", year)
                 log.info(f'downloading from {link_zip_TRI}')
-                extract_TRI_data_files(link_zip_TRI, files, year)
-                generate_metadata(year, files, datatype='source')
+                stats = extract_TRI_data_files(link_zip_TRI, files, year)
+                generate_metadata(year, files, datatype='source',
+                                  extraction_stats=stats)
             else:
                 log.error('The URL in config.yaml ({}) for TRI is not '
                           'reachable.'.format(tri_url))
@@ -6,17 +6,107 @@ Public API for stewi. Functions to return inventory data for a single
 inventory in standard formats.
 """
 
+import os
+import threading
+from collections import OrderedDict
 
 from esupy.processed_data_mgmt import read_source_metadata
 from stewi.globals import log, add_missing_fields,\
     WRITE_FORMAT, read_inventory, paths,\
-    set_stewi_meta, aggregate
+    set_stewi_meta, aggregate, find_inventory_files, set_categorical
 from stewi.globals import STEWI_DATA_VINTAGES
 from stewi.globals import linear_search
-from stewi.filter import apply_filters_to_inventory, filter_config
+from stewi.filter import apply_filters_to_inventory, filter_config,\
+    FILTER_FIELDS
 from stewi.formats import StewiFormat, ensure_format
 
 
+class _InventoryCache:
+    """Size-bounded LRU cache of dataframes returned by getInventory.
+
+    Entries are keyed on the getInventory arguments and a signature of the
+    stored inventory files, so regenerating or replacing a file invalidates
+    the entry. Dataframes are copied on the way out so callers can not
+    modify the cached data.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0].copy()
+
+    def put(self, key, df):
+        size = int(df.memory_usage(index=True, deep=True).sum())
+        if size > self.max_bytes:
+            log.debug('inventory exceeds cache size, not cached')
+            return
+        with self._lock:
+            if key in self._data:
+                self.current_bytes -= self._data.pop(key)[1]
+            self._data[key] = (df.copy(), size)
+            self.current_bytes += size
+            self._evict()
+
+    def resize(self, max_bytes):
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def _evict(self):
+        """Drop least recently used entries until within max_bytes."""
+        while self._data and self.current_bytes > self.max_bytes:
+            _, (_, evicted_size) = self._data.popitem(last=False)
+            self.current_bytes -= evicted_size
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'entries': len(self._data),
+                    'current_bytes': self.current_bytes,
+                    'max_bytes': self.max_bytes,
+                    }
+
+
+# maximum memory (bytes) held by the getInventory cache, off (0) by default.
+# Set with the STEWI_INVENTORY_CACHE_BYTES environment variable or
+# setInventoryCacheSize
+INVENTORY_CACHE_MAX_BYTES = int(os.environ.get('STEWI_INVENTORY_CACHE_BYTES',
+                                               0))
+_inventory_cache = _InventoryCache(INVENTORY_CACHE_MAX_BYTES)
+
+
+def _inventory_file_signature(inventory_acronym, year, f):
+    """Return name, modification time and size of the files an inventory
+    request depends on; facility files are included as some filters use them.
+    """
+    formats = {f, StewiFormat.FACILITY}
+    return tuple((p.name, p.stat().st_mtime_ns, p.stat().st_size)
+                 for fmt in sorted(formats, key=lambda x: x.value)
+                 for p in find_inventory_files(inventory_acronym, year, fmt))
+
+
 def getAllInventoriesandYears(year=None):
     """Return inventory year(s) of interest.
 
@@ -94,7 +184,9 @@ def printAvailableInventories(stewiformat='flowbyfacility'):
 
 def getInventory(inventory_acronym, year, stewiformat='flowbyfacility',
                  filters=None, filter_for_LCI=False, US_States_Only=False,
-                 download_if_missing=False, keep_sec_cntx=False):
+                 download_if_missing=False, keep_sec_cntx=False,
+                 columns=None, facility_ids=None, flow_names=None,
+                 compartments=None, categorical=False):
     """Return or generate an inventory in a standard output format.
 
     :param inventory_acronym: like 'TRI'
@@ -108,19 +200,74 @@ def getInventory(inventory_acronym, year, stewiformat='flowbyfacility',
     :param download_if_missing: bool, if True will attempt to load from
         remote server prior to generating if file not found locally
     :param keep_sec_cntx: bool, if False only preserves primary contexts
+    :param columns: optional list of fields to return, the inventory is
+        aggregated to the returned fields
+    :param facility_ids: optional list of FacilityIDs to return
+    :param flow_names: optional list of FlowNames to return
+    :param compartments: optional list of primary compartments to return,
+        e.g. ['air']
+    :param categorical: bool, if True fields with few distinct values
+        (e.g. FlowName, Compartment) are returned as categoricals to reduce
+        memory, by default as strings
     :return: dataframe with standard fields depending on output format
+
+    Inventories can be kept in memory so that repeated requests are not
+    read again, by setting a cache size with setInventoryCacheSize or the
+    STEWI_INVENTORY_CACHE_BYTES environment variable; the cache is off by
+    default. Cached inventories are copied when returned, so memory use can
+    reach twice the cache size.
     """
     f = ensure_format(stewiformat)
+    request = (inventory_acronym, str(year), str(f),
+               tuple(filters) if filters else (),
+               filter_for_LCI, US_States_Only, keep_sec_cntx, categorical,
+               *(tuple(x) if x is not None else None for x in
+                 (columns, facility_ids, flow_names, compartments)))
+    use_cache = _inventory_cache.max_bytes > 0
+    if use_cache:
+        inventory = _inventory_cache.get(
+            request + _inventory_file_signature(inventory_acronym, year, f))
+        if inventory is not None:
+            log.debug(f'loaded {inventory_acronym}_{year} from cache')
+            return inventory
+
+    row_filters = {k: v for k, v in {'FacilityID': facility_ids,
+                                     'FlowName': flow_names,
+                                     'Compartment': compartments}.items()
+                   if v is not None}
+    inventory = _getInventory(inventory_acronym, year, f, filters,
+                              filter_for_LCI, US_States_Only,
+                              download_if_missing, keep_sec_cntx,
+                              columns, row_filters, categorical)
+    if use_cache and inventory is not None:
+        # signature taken after reading in case the inventory was generated
+        _inventory_cache.put(
+            request + _inventory_file_signature(inventory_acronym, year, f),
+            inventory)
+    return inventory
+
+
+def _getInventory(inventory_acronym, year, f, filters, filter_for_LCI,
+                  US_States_Only, download_if_missing, keep_sec_cntx,
+                  columns=None, row_filters=None, categorical=False):
+    """Read, aggregate and filter an inventory, see getInventory."""
+    read_columns = None
+    if columns is not None:
+        # fields needed for aggregation and named filters are also read
+        read_columns = list(columns) + ['FlowAmount', 'DataReliability']
+        if filters or filter_for_LCI or US_States_Only:
+            read_columns += FILTER_FIELDS
     inventory = read_inventory(inventory_acronym, year, f,
-                               download_if_missing)
+                               download_if_missing, columns=read_columns,
+                               row_filters=row_filters,
+                               categorical=categorical)
 
     if (not keep_sec_cntx) and ('Compartment' in inventory):
         inventory['Compartment'] = (inventory['Compartment']
                                     .str.partition('/')[0])
         inventory = aggregate(inventory)
 
-    if not filters:
-        filters = []
+    filters = list(filters) if filters else []
     if f.value > 2:  # exclude FLOW and FACILITY
         # for backwards compatability, maintain these optional parameters in getInventory
         if filter_for_LCI:
@@ -138,50 +285,65 @@ def getInventory(inventory_acronym, year, stewiformat='flowbyfacility',
 
         inventory = apply_filters_to_inventory(inventory, inventory_acronym, year,
                                                filters, download_if_missing)
-        # After filting, may be necessary to reaggregate inventory again
-        inventory = aggregate(inventory)
+        # After filting, may be necessary to reaggregate inventory again,
+        # fields read only for the filters are not kept
+        inventory = aggregate(inventory, [
+            c for c in inventory if c not in ['FlowAmount', 'DataReliability']
+            and (columns is None or c in columns)])
 
     inventory = add_missing_fields(inventory, inventory_acronym, f,
                                    maintain_columns=False)
+    if columns is not None:
+        inventory = inventory[[c for c in inventory if c in columns]]
 
+    if categorical:
+        inventory = set_categorical(inventory, f)
     return inventory
 
 
 def getInventoryFlows(inventory_acronym, year,
-                      download_if_missing=False):
+                      download_if_missing=False, categorical=False):
     """Return flows for an inventory.
 
     :param inventory_acronym: e.g. 'TRI'
     :param year: e.g. 2014
     :param download_if_missing: bool, if True will attempt to load from
         remote server prior to generating if file not found locally
+    :param categorical: bool, if True returns fields with few distinct
+        values as categoricals, by default as strings
     :return: dataframe with standard flows format
     """
     flows = read_inventory(inventory_acronym, year, StewiFormat.FLOW,
-                           download_if_missing)
+                           download_if_missing, categorical=categorical)
     if flows is None:
         return
     flows = add_missing_fields(flows, inventory_acronym, StewiFormat.FLOW,
                                maintain_columns=False)
+    if categorical:
+        flows = set_categorical(flows, StewiFormat.FLOW)
     return flows
 
 
 def getInventoryFacilities(inventory_acronym, year,
-                           download_if_missing=False):
+                           download_if_missing=False, categorical=False):
     """Return flows for an inventory.
 
     :param inventory_acronym: e.g. 'TRI'
     :param year: e.g. 2014
     :param download_if_missing: bool, if True will attempt to load from
         remote server prior to generating if file not found locally
+    :param categorical: bool, if True returns fields with few distinct
+        values as categoricals, by default as strings
     :return: dataframe with standard flows format
     """
     facilities = read_inventory(inventory_acronym, year, StewiFormat.FACILITY,
-                                download_if_missing)
+                                download_if_missing, categorical=categorical)
     if facilities is None:
         return
     facilities = add_missing_fields(facilities, inventory_acronym, StewiFormat.FACILITY,
                                     maintain_columns=True)
+    if categorical:
+        facilities = set_categorical(facilities, StewiFormat.FACILITY)
     return facilities
 
 
@@ -205,3 +367,25 @@ def seeAvailableInventoryFilters():
         if (filter_config[f]['type'] == 'set'):
             print('Includes the following filters: ' + ', '.join(
                 filter_config[f]['filters']))
+
+
+def getInventoryCacheStats():
+    """Return counters for the in-memory cache used by getInventory.
+
+    :return: dictionary of hits, misses, evictions, entries, and current and
+        maximum cache size in bytes
+    """
+    return _inventory_cache.stats()
+
+
+def setInventoryCacheSize(max_bytes):
+    """Set the maximum memory (bytes) held by the getInventory cache.
+
+    :param max_bytes: int, 0 disables caching
+    """
+    _inventory_cache.resize(max_bytes)
+
+
+def clearInventoryCache():
+    """Remove all inventories held in the getInventory cache."""
+    _inventory_cache.clear()
@@ -18,16 +18,20 @@ Year:
 """
 
 import pandas as pd
+import numpy as np
 import argparse
 import zipfile
 import io
+import re
+import openpyxl
 
 from esupy.remote import make_url_request
 from esupy.processed_data_mgmt import read_source_metadata
 from stewi.globals import DATA_PATH, write_metadata,\
     unit_convert, log, MMBtu_MJ, MWh_MJ, config, USton_kg, lb_kg,\
     compile_source_metadata, remove_line_breaks, paths, store_inventory,\
-    set_stewi_meta, aggregate
+    set_stewi_meta, aggregate, workbook_cache_path, read_workbook_manifest,\
+    write_workbook_manifest
 from stewi.validate import update_validationsets_sources, validate_inventory,\
     write_validation_result
 from stewi.formats import StewiFormat
@@ -41,6 +45,17 @@ EXT_DIR = 'eGRID Data Files'
 OUTPUT_PATH = paths.local_path / EXT_DIR
 eGRID_DATA_DIR = DATA_PATH / 'eGRID'
 
+# national totals by column code on the US sheet
+US_TOTALS = {'USHTIANT': 'Heat',
+             'USNGENAN': 'Electricity',
+             #'USETHRMO':'Steam', #PLNTYR sheet
+             'USNOXAN': 'Nitrogen oxides',
+             'USSO2AN': 'Sulfur dioxide',
+             'USCO2AN': 'Carbon dioxide',
+             'USCH4AN': 'Methane',
+             'USN2OAN': 'Nitrous oxide',
+             }
+
 
 def imp_fields(filename, year):
     """Import list of fields from egrid that are desired for LCI.
@@ -118,17 +133,86 @@ def generate_metadata(year, datatype='inventory'):
         write_metadata('eGRID_' + year, source_meta, datatype=datatype)
 
 
-def extract_eGRID_excel(year, sheetname, index='field'):
-    """Generate a dataframe from eGRID sheetname from file stored locally."""
+def get_required_columns(year):
+    """Return the columns needed from each eGRID sheet, by field name
+    (first header row) or by column code (second header row)."""
+    return {'PLNT': {'field': imp_fields('eGRID_required_fields.csv', year)[0],
+                     'code': ['USETHRMO']},
+            'UNT': {'field': imp_fields('eGRID_unit_level_required_fields.csv',
+                                        year)[0]},
+            'US': {'code': list(US_TOTALS.keys())},
+            }
+
+
+def convert_eGRID_excel(year):
+    """Convert the required columns of each eGRID sheet to parquet.
+
+    Sheets are streamed once in read-only mode, the cache is kept for each
+    eGRID file and only rebuilt if the file or required columns change.
+    :param year: str, year of eGRID dataset
+    :return: Path to the cache and dictionary of field names by column code
+        for each sheet
+    """
     eGRIDfile = OUTPUT_PATH.joinpath(_config[year]['file_name'])
-    if index != 'field': header = 1
-    else: header = 0
-    df = pd.read_excel(eGRIDfile, sheet_name=sheetname + year[2:],
-                       header=header, engine='openpyxl')
-    df = remove_line_breaks(df)
+    cache_path = workbook_cache_path(eGRIDfile, OUTPUT_PATH)
+    required = get_required_columns(year)
+    manifest = read_workbook_manifest(cache_path)
+    if manifest.get('required') == required:
+        return cache_path, manifest['fields']
+    log.info(f'converting required columns of {eGRIDfile.name} to parquet')
+    cache_path.mkdir(parents=True, exist_ok=True)
+    fields = {}
+    wb = openpyxl.load_workbook(eGRIDfile, read_only=True, data_only=True)
+    try:
+        for sheetname, columns in required.items():
+            rows = wb[sheetname + year[2:]].iter_rows(values_only=True)
+            names = [re.sub('\r|\n', ' ', str(c)) if c is not None else None
+                     for c in next(rows)]
+            codes = [c if c is not None else names[i]
+                     for i, c in enumerate(next(rows))]
+            keep = {find_column(names, codes, c, sheetname)
+                    for c in columns.get('field', []) if c in names}
+            keep.update(codes.index(c) for c in columns.get('code', [])
+                        if c in codes)
+            keep = sorted(keep)
+            df = pd.DataFrame([[row[i] if i < len(row) else None
+                                for i in keep] for row in rows],
+                              columns=[codes[i] for i in keep])
+            df = df.dropna(how='all').reset_index(drop=True)
+            # parquet columns require a single type
+            for c in df.select_dtypes('object'):
+                df[c] = df[c].where(df[c].isna(), df[c].astype(str))
+            df.to_parquet(cache_path.joinpath(f'{sheetname}.parquet'),
+                          index=False)
+            fields[sheetname] = {codes[i]: names[i] for i in keep}
+    finally:
+        wb.close()
+    manifest.update({'required': required, 'fields': fields})
+    write_workbook_manifest(cache_path, manifest)
+    return cache_path, fields
+
+
+def find_column(names, codes, name, sheetname):
+    """Return the position of the column with field name, the first when the
+    name is repeated, as read by pd.read_excel."""
+    positions = [i for i, c in enumerate(names) if c == name]
+    if len(positions) > 1:
+        log.warning(f'{name} is repeated on {sheetname} for columns '
+                    f'{", ".join(str(codes[i]) for i in positions)}, '
+                    f'using {codes[positions[0]]}')
+    return positions[0]
+
+
+def extract_eGRID_excel(year, sheetname, index='field'):
+    """Generate a dataframe of the required columns of eGRID sheetname
+    from the parquet cache of the file stored locally.
+
+    :param index: str, 'field' to name columns by field name, or 'code'
+    """
+    cache_path, fields = convert_eGRID_excel(year)
+    df = pd.read_parquet(cache_path.joinpath(f'{sheetname}.parquet'))
     if index == 'field':
-        # drop first row which are column name abbreviations
-        df = df.drop([0])
+        df = df.rename(columns=fields[sheetname])
     return df
 
 
@@ -193,17 +277,20 @@ def generate_eGRID_files(year):
 
     unit_egrid.update(unit_egrid[rel_score_cols].fillna(''))
     unit_egrid.update(unit_egrid[flows_used_for_weighting].fillna(0))
-    # Generate combined columns as lists before exploding lists into multiple rows
-    unit_egrid['FlowName'] = unit_egrid.apply(lambda _: unit_emissions_with_rel_scores, axis=1)
-    unit_egrid['ReliabilitySource'] = unit_egrid[rel_score_cols].values.tolist()
-    unit_egrid['FlowAmount'] = unit_egrid[flows_used_for_weighting].values.tolist()
-    unit_egrid = unit_egrid.drop(columns=rel_score_cols + flows_used_for_weighting)
-    unit_egrid = unit_egrid.set_index(list(unit_egrid.columns
-                                           .difference(['FlowName',
-                                                        'ReliabilitySource',
-                                                        'FlowAmount']))
-                                      ).apply(pd.Series.explode).reset_index()
-    unit_egrid['FlowAmount'] = pd.to_numeric(unit_egrid['FlowAmount'])
+    # Reshape to one row per unit and flow, pairing each reliability source
+    # column with its weighting flow column, in the order of the units
+    n_flows = len(unit_emissions_with_rel_scores)
+    unit_cols = unit_egrid.columns.difference(rel_score_cols +
+                                              flows_used_for_weighting)
+    reliability = unit_egrid[rel_score_cols].to_numpy().ravel()
+    amounts = unit_egrid[flows_used_for_weighting].to_numpy().ravel()
+    unit_egrid = (unit_egrid[unit_cols]
+                  .loc[unit_egrid.index.repeat(n_flows)]
+                  .reset_index(drop=True)
+                  .assign(FlowName=np.tile(unit_emissions_with_rel_scores,
+                                           len(unit_egrid)),
+                          ReliabilitySource=reliability,
+                          FlowAmount=pd.to_numeric(amounts)))
 
     dq_mapping = pd.read_csv(eGRID_DATA_DIR
                              .joinpath('eGRID_unit_level_reliability_scores.csv'))
@@ -310,20 +397,10 @@ def generate_national_totals(year):
     Resulting file is stored in repository
     """
     log.info(f'Processing eGRID national totals for validation of {year}')
-    totals_dict = {'USHTIANT': 'Heat',
-                   'USNGENAN': 'Electricity',
-                   #'USETHRMO':'Steam', #PLNTYR sheet
-                   'USNOXAN': 'Nitrogen oxides',
-                   'USSO2AN': 'Sulfur dioxide',
-                   'USCO2AN': 'Carbon dioxide',
-                   'USCH4AN': 'Methane',
-                   'USN2OAN': 'Nitrous oxide',
-                   }
-
     us_totals = extract_eGRID_excel(year, 'US', index='code')
-    us_totals = us_totals[list(totals_dict.keys())]
+    us_totals = us_totals[list(US_TOTALS.keys())]
     us_totals = (us_totals
-                 .rename(columns=totals_dict)
+                 .rename(columns=US_TOTALS)
                  .transpose().reset_index()
                  .rename(columns={'index': 'FlowName',
                                   0: 'FlowAmount'})
@@ -11,6 +11,10 @@ from stewi.formats import StewiFormat
 
 filter_config = config(file='filter.yaml')
 
+# inventory fields used by the named filters
+FILTER_FIELDS = ['FacilityID', 'FlowName', 'State', 'Source Code',
+                 'Generator Waste Stream Included in NBR']
+
 
 def apply_filters_to_inventory(inventory, inventory_acronym, year, filters,
                                download_if_missing=False):
@@ -33,10 +33,21 @@ class StewiFormat(Enum):
         """Return list of fields."""
         return [f for f in self.specs().keys()]
 
-    def field_types(self):
-        """Return dictionary of fields and dtypes."""
-        return {key: value[0]['dtype'] for key, value
-                in self.specs().items()}
+    def field_types(self, categorical=False):
+        """Return dictionary of fields and dtypes.
+
+        :param categorical: bool, if True returns 'category' as the dtype
+            for fields specified as categorical
+        """
+        return {key: 'category' if categorical and key in
+                self.categorical_fields() else value[0]['dtype']
+                for key, value in self.specs().items()}
+
+    def categorical_fields(self):
+        """Return list of fields with few distinct values, which are stored
+        and returned as categoricals."""
+        return [key for key, value in self.specs().items()
+                if len(value) > 2 and value[2]['categorical'] is True]
 
     def required_fields(self):
         """Return dictionary of fields and dtypes for required fields."""
@@ -60,10 +71,13 @@ def ensure_format(f):
 
 
 flowbyfacility_fields = {'FacilityID': [{'dtype': 'str'}, {'required': True}],
-                         'FlowName': [{'dtype': 'str'}, {'required': True}],
-                         'Compartment': [{'dtype': 'str'}, {'required': True}],
+                         'FlowName': [{'dtype': 'str'}, {'required': True},
+                                      {'categorical': True}],
+                         'Compartment': [{'dtype': 'str'}, {'required': True},
+                                         {'categorical': True}],
                          'FlowAmount': [{'dtype': 'float'}, {'required': True}],
-                         'Unit': [{'dtype': 'str'}, {'required': True}],
+                         'Unit': [{'dtype': 'str'}, {'required': True},
+                                  {'categorical': True}],
                          'DataReliability': [{'dtype': 'float'}, {'required': True}],
                          }
 
@@ -71,31 +85,42 @@ facility_fields = {'FacilityID': [{'dtype': 'str'}, {'required': True}],
                    'FacilityName': [{'dtype': 'str'}, {'required': False}],
                    'Address': [{'dtype': 'str'}, {'required': False}],
                    'City': [{'dtype': 'str'}, {'required': False}],
-                   'State': [{'dtype': 'str'}, {'required': True}],
+                   'State': [{'dtype': 'str'}, {'required': True},
+                             {'categorical': True}],
                    'Zip': [{'dtype': 'str'}, {'required': False}],
                    'Latitude': [{'dtype': 'float'}, {'required': False}],
                    'Longitude': [{'dtype': 'float'}, {'required': False}],
-                   'County': [{'dtype': 'str'}, {'required': False}],
-                   'NAICS': [{'dtype': 'str'}, {'required': False}],
-                   'SIC': [{'dtype': 'str'}, {'required': False}],
-                   'UrbanRural': [{'dtype': 'str'}, {'required': False}],
+                   'County': [{'dtype': 'str'}, {'required': False},
+                              {'categorical': True}],
+                   'NAICS': [{'dtype': 'str'}, {'required': False},
+                             {'categorical': True}],
+                   'SIC': [{'dtype': 'str'}, {'required': False},
+                           {'categorical': True}],
+                   'UrbanRural': [{'dtype': 'str'}, {'required': False},
+                                  {'categorical': True}],
                    }
 
 flowbyprocess_fields = {'FacilityID': [{'dtype': 'str'}, {'required': True}],
-                        'FlowName': [{'dtype': 'str'}, {'required': True}],
-                        'Compartment': [{'dtype': 'str'}, {'required': True}],
+                        'FlowName': [{'dtype': 'str'}, {'required': True},
+                                     {'categorical': True}],
+                        'Compartment': [{'dtype': 'str'}, {'required': True},
+                                        {'categorical': True}],
                         'FlowAmount': [{'dtype': 'float'}, {'required': True}],
-                        'Unit': [{'dtype': 'str'}, {'required': True}],
+                        'Unit': [{'dtype': 'str'}, {'required': True},
+                                 {'categorical': True}],
                         'DataReliability': [{'dtype': 'float'}, {'required': True}],
                         'Process': [{'dtype': 'str'}, {'required': True}],
-                        'ProcessType': [{'dtype': 'str'}, {'required': False}],
+                        'ProcessType': [{'dtype': 'str'}, {'required': False},
+                                        {'categorical': True}],
                         }
 
 flow_fields = {'FlowName': [{'dtype': 'str'}, {'required': True}],
                'FlowID': [{'dtype': 'str'}, {'required': True}],
                'CAS': [{'dtype': 'str'}, {'required': False}],
-               'Compartment': [{'dtype': 'str'}, {'required': False}],
-               'Unit': [{'dtype': 'str'}, {'required': False}],
+               'Compartment': [{'dtype': 'str'}, {'required': False},
+                               {'categorical': True}],
+               'Unit': [{'dtype': 'str'}, {'required': False},
+                        {'categorical': True}],
                }
 
 format_dict = {'flowbyfacility': flowbyfacility_fields,
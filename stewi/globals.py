@@ -5,9 +5,15 @@
 Supporting variables and functions used in stewi.
 """
 
+import hashlib
+import importlib
 import json
 import logging as log
+import multiprocessing as mp
+import multiprocessing.connection
 import os
+import sys
+import tempfile
 import time
 import copy
 from datetime import datetime
@@ -18,10 +24,9 @@ import numpy as np
 import yaml
 
 from esupy.processed_data_mgmt import Paths, FileMeta,\
-    load_preprocessed_output, remove_extra_files,\
+    load_preprocessed_output, remove_extra_files, find_file,\
     write_df_to_file, write_metadata_to_file,\
     download_from_remote
-from esupy.dqi import get_weighted_average
 from esupy.util import get_git_hash
 import stewi.exceptions
 
@@ -50,6 +55,26 @@ paths.local_path = paths.local_path / 'stewi'
 # global variable to replace stored inventory files when saving
 REPLACE_FILES = False
 
+# parquet copies of Excel workbook sheets, in a directory of each source
+WORKBOOK_CACHE = 'workbook_cache'
+WORKBOOK_MANIFEST = '_manifest.json'
+# workbook hashes by path, with the size and modification time they are for
+WORKBOOK_HASHES = '_hashes.json'
+
+# rows per parquet row group for stored inventories, small enough that
+# filters on the sort columns can skip most of a file
+ROW_GROUP_SIZE = 100000
+
+# approximate peak memory (MB) to generate one year of each inventory, used
+# to admit concurrent jobs in generate_inventories()
+INVENTORY_PEAK_MEMORY_MB = {'DMR': 2000,
+                            'eGRID': 1000,
+                            'GHGRP': 8000,
+                            'NEI': 16000,
+                            'RCRAInfo': 6000,
+                            'TRI': 3000,
+                            }
+
 GIT_HASH_LONG = os.environ.get('GITHUB_SHA') or get_git_hash('long')
 if GIT_HASH_LONG:
     GIT_HASH = GIT_HASH_LONG[0:7]
@@ -107,17 +132,33 @@ def aggregate(df, grouping_vars=None):
     """Aggregate a 'FlowAmount' in a dataframe based on the passed grouping_vars
     and generating a weighted average for data quality fields.
 
+    The sum and the FlowAmount weighted average are computed in a single
+    grouped reduction, equivalent to esupy.dqi.get_weighted_average.
+
     :param df: dataframe to aggregate
     :param grouping_vars: list of df column headers on which to groupby
     :return: aggregated dataframe with weighted average data reliability score
     """
     if grouping_vars is None:
         grouping_vars = [x for x in df.columns if x not in ['FlowAmount', 'DataReliability']]
-    df_agg = df.groupby(grouping_vars).agg({'FlowAmount': ['sum']})
-    df_agg['DataReliability'] = get_weighted_average(
-        df, 'DataReliability', 'FlowAmount', grouping_vars)
-    df_agg = df_agg.reset_index()
-    df_agg.columns = df_agg.columns.droplevel(level=1)
+    # rows without an amount are skipped by the sums, drop them up front;
+    # zero amounts are kept as they can change the compensated summation
+    df = df[df['FlowAmount'].notna()]
+    df = (df[grouping_vars]
+          .assign(FlowAmount=df['FlowAmount'],
+                  _weighted=df['DataReliability'] * df['FlowAmount'],
+                  _weight=df['FlowAmount'] * df['DataReliability'].notna()))
+    if df.duplicated(subset=grouping_vars).any():
+        df = df.groupby(grouping_vars, sort=False, observed=True).sum()
+    else:
+        # already unique, match the sum of a group with a single NaN value
+        df = (df.dropna(subset=grouping_vars)
+                .set_index(grouping_vars)
+                .fillna({'FlowAmount': 0, '_weighted': 0, '_weight': 0}))
+    df['DataReliability'] = np.divide(df['_weighted'], df['_weight'],
+                                      out=np.zeros(len(df)),
+                                      where=df['_weight'] != 0)
+    df_agg = df.drop(columns=['_weighted', '_weight']).reset_index()
     # drop those rows where flow amount is negative, zero, or NaN
     df_agg = df_agg[df_agg['FlowAmount'] > 0]
     df_agg = df_agg[df_agg['FlowAmount'].notna()]
@@ -161,6 +202,94 @@ def unit_convert(df, coln1, coln2, unit, conversion_factor, coln3):
     return df
 
 
+def get_peak_memory_mb():
+    """Return the peak resident memory (MB) of the current process.
+
+    Returns None where it can not be determined (e.g., Windows).
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # reported in bytes on macOS and in kilobytes on Linux
+    if sys.platform == 'darwin':
+        return round(peak / 1024**2, 1)
+    return round(peak / 1024, 1)
+
+
+def get_total_memory_mb():
+    """Return the physical memory (MB) of the system.
+
+    Returns None where it can not be determined (e.g., Windows).
+    """
+    try:
+        return round(os.sysconf('SC_PAGE_SIZE') *
+                     os.sysconf('SC_PHYS_PAGES') / 1024**2, 1)
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def get_file_hash(filepath: Path, chunk_size=2**20) -> str:
+    """Return the sha256 hex digest of a file's contents."""
+    h = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def get_workbook_hash(path: Path, output_path: Path) -> str:
+    """Return the hash of a workbook, hashing it again only when its size or
+    modification time changed.
+
+    :param path: Path, Excel workbook
+    :param output_path: Path, directory of the source's downloaded files
+    """
+    stat = path.stat()
+    hashes_path = output_path.joinpath(WORKBOOK_CACHE, WORKBOOK_HASHES)
+    try:
+        with open(hashes_path) as f:
+            hashes = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        hashes = {}
+    key = str(path.resolve())
+    entry = hashes.get(key, {})
+    if (entry.get('size') == stat.st_size and
+            entry.get('mtime') == stat.st_mtime_ns):
+        return entry['hash']
+    hashes[key] = {'size': stat.st_size, 'mtime': stat.st_mtime_ns,
+                   'hash': get_file_hash(path)}
+    hashes_path.parent.mkdir(parents=True, exist_ok=True)
+    temp = hashes_path.with_name(f'{WORKBOOK_HASHES}.{os.getpid()}.tmp')
+    with open(temp, 'w') as f:
+        json.dump(hashes, f, indent=2)
+    temp.replace(hashes_path)
+    return hashes[key]['hash']
+
+
+def workbook_cache_path(path: Path, output_path: Path) -> Path:
+    """Return the cache directory for the current contents of a workbook."""
+    workbook_hash = get_workbook_hash(path, output_path)
+    return output_path.joinpath(WORKBOOK_CACHE,
+                                f'{path.stem}_{workbook_hash[:16]}')
+
+
+def read_workbook_manifest(cache_path: Path) -> dict:
+    try:
+        with open(cache_path.joinpath(WORKBOOK_MANIFEST)) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {'sheets': {}}
+
+
+def write_workbook_manifest(cache_path: Path, manifest: dict):
+    temp = cache_path.joinpath(WORKBOOK_MANIFEST + '.tmp')
+    with open(temp, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    temp.replace(cache_path.joinpath(WORKBOOK_MANIFEST))
+
+
 def write_metadata(file_name, metadata_dict, category='',
                    datatype="inventory", parameters=None):
     """Write JSON metadata specific to inventory to local directory.
@@ -268,17 +397,99 @@ def store_inventory(df, file_name, f, replace_files=REPLACE_FILES):
     :param replace_files: bool, True will use esupy function to delete existing
         files of the same name
     """
+    from stewi.formats import ensure_format
     meta = set_stewi_meta(file_name, str(f))
+    # sort so that row groups cover narrow ranges of facilities and flows
+    sort_cols = [c for c in ['FacilityID', 'FlowName'] if c in df]
+    if sort_cols:
+        df = df.sort_values(sort_cols, kind='stable').reset_index(drop=True)
+    # categorical fields are written as dictionary encoded columns
+    df = set_categorical(df, ensure_format(f))
     try:
         log.info(f'saving {meta.name_data} to {paths.local_path / meta.category}')
-        write_df_to_file(df, paths, meta)
+        if meta.ext == 'parquet':
+            # written with smaller row groups to support filtered reads, to
+            # the file name given by esupy
+            folder = paths.local_path / meta.category
+            folder.mkdir(parents=True, exist_ok=True)
+            with tempfile.TemporaryDirectory(dir=folder) as temp:
+                staging = copy.copy(paths)
+                staging.local_path = Path(temp)
+                write_df_to_file(df.iloc[:0], staging, meta)
+                name = next(Path(temp).rglob(f'*.{meta.ext}')).name
+            df.to_parquet(folder / name, row_group_size=ROW_GROUP_SIZE)
+        else:
+            write_df_to_file(df, paths, meta)
         if replace_files:
             remove_extra_files(meta, paths)
     except OSError:
         log.error('Failed to save inventory')
 
 
-def read_inventory(inventory_acronym, year, f, download_if_missing=False):
+def load_inventory_file(meta, columns=None, row_filters=None):
+    """Load a stored inventory, reading only the requested columns and rows.
+
+    :param meta: FileMeta of the stored inventory
+    :param columns: list of columns to read, columns not in the file are
+        ignored; None reads all columns
+    :param row_filters: dictionary of column name and list of values to keep,
+        values for 'Compartment' are matched on the primary compartment.
+        Filters are applied while reading so that row groups without
+        matching values are skipped
+    :return: dataframe, or None if no file is found
+    """
+    if columns is None and not row_filters:
+        return load_preprocessed_output(meta, paths)
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+    # the same file as selected by esupy when loading the whole file
+    file = find_file(meta, paths)
+    if file is None:
+        return None
+    schema = pq.read_schema(file)
+    if columns is not None:
+        columns = [c for c in schema.names if c in columns]
+    expression = None
+    for col, values in (row_filters or {}).items():
+        if col not in schema.names:
+            log.warning(f'{col} not found in {file.name}, filter not applied')
+            continue
+        field_type = schema.field(col).type
+        if pa.types.is_dictionary(field_type):
+            field_type = field_type.value_type
+        if pa.types.is_integer(field_type):
+            values = [int(v) for v in values if str(v).lstrip('-').isdigit()]
+        else:
+            values = [str(v) for v in values]
+        condition = pc.field(col).isin(pa.array(values, type=field_type))
+        if col == 'Compartment':
+            # string kernels do not accept dictionary encoded columns
+            field = pc.field(col).cast(field_type)
+            for value in values:
+                condition = condition | pc.starts_with(field,
+                                                       pattern=f'{value}/')
+        expression = (condition if expression is None
+                      else expression & condition)
+    return pq.read_table(file, columns=columns,
+                         filters=expression).to_pandas()
+
+
+def find_inventory_files(inventory_acronym, year, f):
+    """Return local inventory files for an inventory year in a given format.
+
+    :param inventory_acronym: like 'TRI'
+    :param year: year as number like 2010
+    :param f: object of class StewiFormat
+    :return: list of paths, sorted by name
+    """
+    if not f.path().is_dir():
+        return []
+    return sorted(f.path().glob(f'{inventory_acronym}_{year}_v*.{WRITE_FORMAT}'))
+
+
+def read_inventory(inventory_acronym, year, f, download_if_missing=False,
+                   columns=None, row_filters=None, categorical=False):
     """Return the inventory from local directory. If not found, generate it.
 
     :param inventory_acronym: like 'TRI'
@@ -286,11 +497,16 @@ def read_inventory(inventory_acronym, year, f, download_if_missing=False):
     :param f: object of class StewiFormat
     :param download_if_missing: bool, if True will attempt to load from
         remote server prior to generating if file not found locally
+    :param columns: optional list of columns to read
+    :param row_filters: optional dictionary of column and values to keep,
+        see load_inventory_file
+    :param categorical: bool, if True returns the categorical fields of the
+        format as categoricals, otherwise as strings
     :return: dataframe of stored inventory; if not present returns None
     """
     file_name = f'{inventory_acronym}_{year}'
     meta = set_stewi_meta(file_name, str(f))
-    inventory = load_preprocessed_output(meta, paths)
+    inventory = load_inventory_file(meta, columns, row_filters)
     method_path = paths.local_path / meta.category
     if inventory is None:
         log.info(f'{meta.name_data} not found in {method_path}')
@@ -306,55 +522,230 @@ def read_inventory(inventory_acronym, year, f, download_if_missing=False):
             log.info('requested inventory does not exist in local directory, '
                      'it will be generated...')
             generate_inventory(inventory_acronym, year)
-        inventory = load_preprocessed_output(meta, paths)
+        inventory = load_inventory_file(meta, columns, row_filters)
         if inventory is None:
             log.error('error generating inventory')
     if inventory is not None:
         log.info(f'loaded {meta.name_data} from {method_path}')
         # ensure dtypes
-        fields = f.field_types()
+        fields = f.field_types(categorical)
         fields = {key: value for key, value in fields.items()
                   if key in list(inventory)}
         inventory = inventory.astype(fields)
     return inventory
 
 
-def generate_inventory(inventory_acronym, year):
+def set_categorical(df, f):
+    """Cast the categorical fields of a format found in df to categoricals.
+
+    :param f: object of class StewiFormat
+    """
+    return df.astype({c: 'category' for c in f.categorical_fields()
+                      if c in df})
+
+
+def hash_stage_files(root: Path, patterns, year, cache):
+    """Return content hashes of the files matching glob patterns.
+
+    :param root: Path, directory of the patterns
+    :param patterns: list of glob patterns, may include {year}
+    :param year: str
+    :param cache: dict of file: [size, mtime_ns, hash] of previously hashed
+        files, updated in place; files of unchanged size and modification
+        time are not hashed again
+    :return: dict of file, relative to root, and its sha256 hash
+    """
+    hashes = {}
+    for pattern in patterns:
+        for file in sorted(root.glob(pattern.format(year=year))):
+            if not file.is_file():
+                continue
+            key = file.relative_to(root).as_posix()
+            stat = file.stat()
+            cached = cache.get(key)
+            if not (cached and cached[:2] == [stat.st_size, stat.st_mtime_ns]):
+                cached = [stat.st_size, stat.st_mtime_ns, get_file_hash(file)]
+                cache[key] = cached
+            hashes[key] = cached[2]
+    return hashes
+
+
+def stage_record_path(inventory_acronym, year) -> Path:
+    """Return the file recording the stages run for an inventory year."""
+    return paths.local_path / 'stages' / f'{inventory_acronym}_{year}_stages.json'
+
+
+def generate_inventory(inventory_acronym, year, force=False):
     """Generate inventory data by running the appropriate modules.
 
+    The stages of each inventory are defined in stages.yaml. A stage is
+    skipped when its options, the hashes of its input files, of the
+    inventory module and of the outputs of the stages it runs after, and the
+    hashes of its own outputs are the same as when it last completed. Input
+    hashes are recorded after the stage runs, as a stage may write its own
+    inputs.
+
     :param inventory_acronym: like 'TRI'
     :param year: year as number like 2010
+    :param force: bool, if True runs all stages
     """
     if inventory_acronym not in config()['databases']:
         raise stewi.exceptions.InventoryNotAvailableError(
             message=f'"{inventory_acronym}" is not an available inventory')
     year = str(year)
-    if inventory_acronym == 'DMR':
-        import stewi.DMR as DMR
-        DMR.main(Option= 'A', Year = [year])
-        DMR.main(Option= 'B', Year = [year])
-    elif inventory_acronym == 'eGRID':
-        import stewi.egrid as eGRID
-        eGRID.main(Option = 'A', Year = [year])
-        eGRID.main(Option = 'B', Year = [year])
-    elif inventory_acronym == 'GHGRP':
-        import stewi.GHGRP as GHGRP
-        GHGRP.main(Option = 'A', Year = [year])
-        GHGRP.main(Option = 'B', Year = [year])
-    elif inventory_acronym == 'NEI':
-        import stewi.NEI as NEI
-        NEI.main(Option = 'A', Year = [year])
-    elif inventory_acronym == 'RCRAInfo':
-        import stewi.RCRAInfo as RCRAInfo
-        RCRAInfo.main(Option = 'A', Year = [year],
-                      Tables = ['BR_REPORTING', 'HD_LU_WASTE_CODE'])
-        RCRAInfo.main(Option = 'B', Year = [year],
-                      Tables = ['BR_REPORTING'])
-        RCRAInfo.main(Option = 'C', Year = [year])
-    elif inventory_acronym == 'TRI':
-        import stewi.TRI as TRI
-        TRI.main(Option = 'A', Year = [year], Files = ['1a', '3a'])
-        TRI.main(Option = 'C', Year = [year], Files = ['1a', '3a'])
+    inventory_stages = config(file='stages.yaml')[inventory_acronym]
+    module = importlib.import_module(f'stewi.{inventory_stages["module"]}')
+
+    record_path = stage_record_path(inventory_acronym, year)
+    try:
+        with open(record_path) as f:
+            record = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        record = {}
+    record.setdefault('stages', {})
+    file_cache = record.setdefault('files', {})
+
+    def hash_inputs(stage):
+        # the module's source is an input of each of its stages
+        inputs = hash_stage_files(MODULEPATH, [Path(module.__file__).name],
+                                  year, file_cache)
+        inputs.update(hash_stage_files(DATA_PATH, stage.get('inputs', []),
+                                       year, file_cache))
+        for upstream in stage.get('after', []):
+            inputs.update(outputs[upstream])
+        return inputs
+
+    outputs = {}
+    for name, stage in inventory_stages['stages'].items():
+        inputs = hash_inputs(stage)
+        options = stage['options']
+        previous = record['stages'].get(name, {})
+        outputs[name] = hash_stage_files(paths.local_path, stage['outputs'],
+                                         year, file_cache)
+        if (not force and outputs[name] and
+                previous.get('options') == options and
+                previous.get('inputs') == inputs and
+                previous.get('outputs') == outputs[name]):
+            log.info(f'{inventory_acronym} {year} {name} is up to date')
+            continue
+        if previous:
+            changed = sorted(k for k in inputs.keys() | previous['inputs'].keys()
+                             if inputs.get(k) != previous['inputs'].get(k))
+            log.info(f'running {inventory_acronym} {year} {name}'
+                     + (f', changed inputs: {", ".join(changed)}'
+                        if changed else ''))
+        module.main(**options, Year=[year])
+        # inputs such as validation totals may be written by the stage
+        inputs = hash_inputs(stage)
+        outputs[name] = hash_stage_files(paths.local_path, stage['outputs'],
+                                         year, file_cache)
+        record['stages'][name] = {'options': options,
+                                  'inputs': inputs,
+                                  'outputs': outputs[name],
+                                  'completed': datetime.now().isoformat(
+                                      timespec='seconds')}
+        record_path.parent.mkdir(parents=True, exist_ok=True)
+        temp = record_path.with_suffix('.tmp')
+        with open(temp, 'w') as f:
+            json.dump(record, f, indent=4)
+        temp.replace(record_path)
+
+
+def _generate_inventory_job(inventory_acronym, year, conn):
+    """Run generate_inventory() in a worker process and send the result,
+    with the peak memory of the process, through conn."""
+    result = {'status': 'success', 'error': None}
+    try:
+        generate_inventory(inventory_acronym, year)
+    except Exception as e:
+        log.exception(f'{inventory_acronym} {year} failed')
+        result = {'status': 'error', 'error': f'{type(e).__name__}: {e}'}
+    result['peak_memory_MB'] = get_peak_memory_mb()
+    conn.send(result)
+    conn.close()
+
+
+def generate_inventories(jobs, max_workers=None, memory_limit_mb=None,
+                         memory_estimates=None):
+    """Generate inventories for (inventory, year) jobs in parallel.
+
+    Each job runs in its own process, so that peak memory is reported per
+    job and a job that fails or is killed does not affect the others. Jobs
+    are started in order as long as the estimated memory of running jobs,
+    per INVENTORY_PEAK_MEMORY_MB, stays within memory_limit_mb; a job that
+    does not fit is passed over for a smaller one, and a single job always
+    runs regardless of its estimate. Years of the same inventory run one
+    after another, as they share downloads and intermediate files; only
+    different inventories run at the same time.
+
+    :param jobs: iterable of (inventory_acronym, year) tuples
+    :param max_workers: int, maximum concurrent jobs, defaults to cpu count
+    :param memory_limit_mb: float, memory available to jobs, defaults to
+        the physical memory of the system
+    :param memory_estimates: dict, optional peak memory (MB) by inventory
+        to override INVENTORY_PEAK_MEMORY_MB
+    :return: list of dicts by job, in order of jobs, with keys 'inventory',
+        'year', 'status', 'error', 'seconds' and 'peak_memory_MB'
+    """
+    jobs = [(inventory, str(year)) for inventory, year in jobs]
+    max_workers = max_workers or os.cpu_count() or 1
+    if memory_limit_mb is None:
+        memory_limit_mb = get_total_memory_mb()
+    estimates = {**INVENTORY_PEAK_MEMORY_MB, **(memory_estimates or {})}
+    default_estimate = max(estimates.values())
+
+    results = [None] * len(jobs)
+    pending = list(range(len(jobs)))
+    running = {}  # job index: (process, connection, estimate, start time)
+    while pending or running:
+        for i in list(pending):
+            if len(running) >= max_workers:
+                break
+            inventory, year = jobs[i]
+            if any(jobs[j][0] == inventory for j in running):
+                continue
+            estimate = estimates.get(inventory, default_estimate)
+            in_use = sum(r[2] for r in running.values())
+            if running and memory_limit_mb and (
+                    in_use + estimate > memory_limit_mb):
+                continue
+            conn, child_conn = mp.Pipe(duplex=False)
+            process = mp.Process(target=_generate_inventory_job,
+                                 args=(inventory, year, child_conn),
+                                 name=f'{inventory}_{year}')
+            process.start()
+            child_conn.close()
+            running[i] = (process, conn, estimate, time.perf_counter())
+            pending.remove(i)
+            log.info(f'started {inventory} {year} ({len(running)} running, '
+                     f'~{in_use + estimate:.0f} MB estimated)')
+
+        mp.connection.wait([r[1] for r in running.values()])
+        for i, (process, conn, _, start) in list(running.items()):
+            if not conn.poll():
+                continue
+            try:
+                result = conn.recv()
+            except EOFError:
+                # process exited without a result, e.g. killed when out of
+                # memory
+                process.join()
+                result = {'status': 'error', 'peak_memory_MB': None,
+                          'error': f'process exited with code '
+                                   f'{process.exitcode}'}
+            process.join()
+            conn.close()
+            inventory, year = jobs[i]
+            results[i] = {'inventory': inventory, 'year': year, **result,
+                          'seconds': round(time.perf_counter() - start, 1)}
+            del running[i]
+            if result['status'] == 'success':
+                log.info(f'completed {inventory} {year} in '
+                         f'{results[i]["seconds"]} s, peak memory '
+                         f'{result["peak_memory_MB"]} MB')
+            else:
+                log.error(f'{inventory} {year} failed: {result["error"]}')
+    return results
 
 
 def get_reliability_table_for_source(source):
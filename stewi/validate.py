@@ -47,57 +47,40 @@ def validate_inventory(inventory_df, reference_df, group_by=None,
     validation_df = inventory_sums.merge(reference_sums, how='outer',
                                          on=group_by_columns).reset_index(drop=True)
     validation_df = validation_df.fillna(0.0)
-    amount_x_list = []
-    amount_y_list = []
-    pct_diff_list = []
-    conclusion = []
-    error_count = 0
-    for index, row in validation_df.iterrows():
-        amount_x = float(row['FlowAmount_x'])
-        amount_y = float(row['FlowAmount_y'])
-        if amount_x == 0.0:
-            amount_x_list.append(amount_x)
-            if amount_y == 0.0:
-                pct_diff_list.append(0.0)
-                amount_y_list.append(amount_y)
-                conclusion.append('Both inventory and reference are zero or null')
-            elif amount_y == np.inf:
-                amount_y_list.append(np.nan)
-                pct_diff_list.append(100.0)
-                conclusion.append('Reference contains infinity values. '
-                                  'Check prior calculations.')
-            else:
-                amount_y_list.append(amount_y)
-                pct_diff_list.append(100.0)
-                conclusion.append('Inventory value is zero or null')
-                error_count += 1
-        elif amount_y == 0.0:
-            amount_x_list.append(amount_x)
-            amount_y_list.append(amount_y)
-            pct_diff_list.append(100.0)
-            conclusion.append('Reference value is zero or null')
-            continue
-        elif amount_y == np.inf:
-            amount_x_list.append(amount_x)
-            amount_y_list.append(np.nan)
-            pct_diff_list.append(100.0)
-            conclusion.append('Reference contains infinity values. '
-                              'Check prior calculations.')
-        else:
-            pct_diff = 100.0 * abs(amount_y - amount_x) / amount_y
-            pct_diff_list.append(pct_diff)
-            amount_x_list.append(amount_x)
-            amount_y_list.append(amount_y)
-            if pct_diff == 0.0:
-                conclusion.append('Identical')
-            elif pct_diff <= tolerance:
-                conclusion.append('Statistically similar')
-            elif pct_diff > tolerance:
-                conclusion.append('Percent difference exceeds tolerance')
-                error_count += 1
-    validation_df['Inventory_Amount'] = amount_x_list
-    validation_df['Reference_Amount'] = amount_y_list
-    validation_df['Percent_Difference'] = pct_diff_list
+    amount_x = validation_df['FlowAmount_x'].astype(float).to_numpy()
+    amount_y = validation_df['FlowAmount_y'].astype(float).to_numpy()
+    x_zero = amount_x == 0.0
+    y_zero = amount_y == 0.0
+    y_inf = amount_y == np.inf
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pct_diff = 100.0 * np.abs(amount_y - amount_x) / amount_y
+    # conditions in order of precedence
+    conditions = [x_zero & y_zero,
+                  x_zero & y_inf,
+                  x_zero,
+                  y_zero,
+                  y_inf,
+                  pct_diff == 0.0,
+                  pct_diff <= tolerance,
+                  pct_diff > tolerance]
+    conclusions = ['Both inventory and reference are zero or null',
+                   'Reference contains infinity values. '
+                   'Check prior calculations.',
+                   'Inventory value is zero or null',
+                   'Reference value is zero or null',
+                   'Reference contains infinity values. '
+                   'Check prior calculations.',
+                   'Identical',
+                   'Statistically similar',
+                   'Percent difference exceeds tolerance']
+    conclusion = np.select(conditions, conclusions, default='')
+    not_compared = x_zero | y_zero | y_inf
+    error_count = int(((x_zero & ~y_zero & ~y_inf) |
+                       (~not_compared & (pct_diff > tolerance))).sum())
+    validation_df['Inventory_Amount'] = amount_x
+    validation_df['Reference_Amount'] = np.where(y_inf, np.nan, amount_y)
+    validation_df['Percent_Difference'] = np.where(
+        x_zero & y_zero, 0.0, np.where(not_compared, 100.0, pct_diff))
     validation_df['Conclusion'] = conclusion
     validation_df = validation_df.drop(['FlowAmount_x', 'FlowAmount_y'], axis=1)
     if error_count > 0:
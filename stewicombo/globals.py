@@ -4,6 +4,7 @@
 """
 Supporting variables and functions used in stewicombo
 """
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import pandas as pd
@@ -30,7 +31,8 @@ def set_stewicombo_meta(file_name, category=''):
 
 def getInventoriesforFacilityMatches(inventory_dict, facilitymatches,
                                      filter_for_LCI, base_inventory=None,
-                                     keep_sec_cntx=False, **kwargs):
+                                     keep_sec_cntx=False, max_workers=1,
+                                     **kwargs):
     """
     Retrieve stored flowbyfacility datasets based on passed dictionary.
     Filters them if necessary. Returns only those facilities with an FRS_ID
@@ -40,53 +42,78 @@ def getInventoriesforFacilityMatches(inventory_dict, facilitymatches,
     :param filter_for_LCI:
     :param base_inventory:
     :param keep_sec_cntx: bool, if False only preserves primary contexts
+    :param max_workers: int, number of inventories to load concurrently,
+        results are combined in the order of inventory_dict
     """
+    base_FRS_list = None
     if base_inventory is not None:
         # Identify the FRS in the base inventory and keep only those
-        # base_inventory_FRS = facilitymatches[
-        #     facilitymatches['Source'] == base_inventory]
         base_FRS_list = list(pd.unique(facilitymatches[
             facilitymatches['Source'] == base_inventory]['FRS_ID']))
 
-    columns_to_keep = StewiFormat.FLOWBYFACILITY.fields() + ['Source',
-                                                             'Year', 'FRS_ID']
-    inventories = pd.DataFrame()
     filters = None
     if filter_for_LCI:
         filters = ['filter_for_LCI']
-    for source, year in inventory_dict.items():
-        inventory = stewi.getInventory(source, year,
-                                       'flowbyfacility',
-                                       filters,
-                                       keep_sec_cntx=keep_sec_cntx,
-                                       **kwargs)
-        if inventory is None:
-            continue
-        inventory["Source"] = source
-        # Merge in FRS_ID, ensure only single FRS added per facility ID, keeping
-        # first listed
-        facmatches = facilitymatches[facilitymatches['Source'] == source]
-        facmatches = facmatches.drop_duplicates(subset=['FacilityID', 'Source'],
-                                                keep='first')
-        inventory = pd.merge(inventory,
-                             facmatches,
-                             on=['FacilityID', 'Source'], how='left')
-        if inventory['FRS_ID'].isna().sum() > 0:
-            log.debug('Some facilities missing FRS_ID')
-
-        # If this isn't the base inventory, filter records for facilities not
-        # found in the base inventory
-        if source is not base_inventory and base_inventory is not None:
-            inventory = inventory[inventory['FRS_ID'].isin(
-                base_FRS_list)]
-
-        # Add metadata
-        inventory["Year"] = str(year)
-        cols_to_keep = [c for c in columns_to_keep if c in inventory]
-        inventory = inventory[cols_to_keep]
-        inventories = pd.concat([inventories, inventory], ignore_index=True)
+    # inventories are combined as strings
+    kwargs.setdefault('categorical', False)
 
-    return inventories
+    def load(source, year):
+        return getInventoryforFacilityMatches(
+            source, year, facilitymatches, filters, base_inventory,
+            base_FRS_list, keep_sec_cntx=keep_sec_cntx, **kwargs)
+
+    if max_workers is not None and max_workers <= 1:
+        inventories = [load(source, year)
+                       for source, year in inventory_dict.items()]
+    else:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            inventories = list(executor.map(load, inventory_dict.keys(),
+                                            inventory_dict.values()))
+    inventories = [inventory for inventory in inventories
+                   if inventory is not None]
+    if len(inventories) == 0:
+        return pd.DataFrame()
+    return pd.concat(inventories, ignore_index=True)
+
+
+def getInventoryforFacilityMatches(source, year, facilitymatches, filters,
+                                   base_inventory=None, base_FRS_list=None,
+                                   keep_sec_cntx=False, **kwargs):
+    """
+    Retrieve a single flowbyfacility dataset with FRS_ID merged in, see
+    getInventoriesforFacilityMatches.
+    """
+    columns_to_keep = StewiFormat.FLOWBYFACILITY.fields() + ['Source',
+                                                             'Year', 'FRS_ID']
+    inventory = stewi.getInventory(source, year,
+                                   'flowbyfacility',
+                                   filters,
+                                   keep_sec_cntx=keep_sec_cntx,
+                                   **kwargs)
+    if inventory is None:
+        return None
+    inventory["Source"] = source
+    # Merge in FRS_ID, ensure only single FRS added per facility ID, keeping
+    # first listed
+    facmatches = facilitymatches[facilitymatches['Source'] == source]
+    facmatches = facmatches.drop_duplicates(subset=['FacilityID', 'Source'],
+                                            keep='first')
+    inventory = pd.merge(inventory,
+                         facmatches,
+                         on=['FacilityID', 'Source'], how='left')
+    if inventory['FRS_ID'].isna().sum() > 0:
+        log.debug('Some facilities missing FRS_ID')
+
+    # If this isn't the base inventory, filter records for facilities not
+    # found in the base inventory
+    if source != base_inventory and base_inventory is not None:
+        inventory = inventory[inventory['FRS_ID'].isin(
+            base_FRS_list)]
+
+    # Add metadata
+    inventory["Year"] = str(year)
+    cols_to_keep = [c for c in columns_to_keep if c in inventory]
+    return inventory[cols_to_keep]
 
 
 def addChemicalMatches(inventories_df):
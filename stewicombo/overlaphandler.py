@@ -2,6 +2,7 @@
 
 from pathlib import Path
 
+import numpy as np
 import pandas as pd
 
 from stewi.globals import log
@@ -20,6 +21,41 @@ inv_pref = {  # inventory source preference by compartment
     }
 
 
+def get_source_rank_table():
+    """
+    Return the inventory source preference in inv_pref as a table of
+    integer ranks by primary compartment and source, lower is preferred.
+    """
+    return pd.DataFrame(
+        [(cmpt, source, rank) for cmpt, sources in inv_pref.items()
+         for rank, source in enumerate(
+             (sources,) if isinstance(sources, str) else sources)],
+        columns=['_CompartmentPrimary', 'Source', '_SourcePref'])
+
+
+def get_primary_compartment(compartment):
+    """Return the primary compartment, e.g. 'air' for 'air/urban'."""
+    # split each unique compartment once
+    unique = compartment.dropna().unique()
+    primary = pd.Series(unique).str.split('/', n=1).str[0]
+    return compartment.map(dict(zip(unique, primary)))
+
+
+def join_by_group(values, group, sep='_'):
+    """
+    Join string values by integer group codes 0..n-1, in order of
+    appearance, equivalent to values.groupby(group).agg(sep.join).
+    """
+    if len(group) == 0:
+        return []
+    order = np.argsort(group.values, kind='stable')
+    codes = group.values[order]
+    starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+    joined = np.add.reduceat(
+        np.asarray(values, dtype=object)[order] + sep, starts)
+    return [s[:-len(sep)] for s in joined]
+
+
 def remove_flow_overlap(df, flow_cpst, flows_cntb, cmpt='air', SCC=False):
     """
     Subtract double-counted contributing flow quantities from a composite flow.
@@ -37,7 +73,7 @@ def remove_flow_overlap(df, flow_cpst, flows_cntb, cmpt='air', SCC=False):
         cols_agg.append('Process')
     # sum contributing flows' FlowAmounts by cols_agg (i.e., across SRS_IDs)
     if '_CompartmentPrimary' not in df:
-        df['_CompartmentPrimary'] = df['Compartment'].apply(lambda x: x.split('/')[0])
+        df['_CompartmentPrimary'] = get_primary_compartment(df['Compartment'])
     df_cf = (df.query('SRS_ID in @flows_cntb and '
                       '_CompartmentPrimary == @cmpt')
                .groupby(cols_agg, as_index=False)
@@ -93,7 +129,7 @@ def aggregate_and_remove_overlap(df):
     ## TODO: implement args for different duplicate handling schemes
         # see commented-out code in commit f2fc7c2 (or earlier, uncommented)
 
-    df['_CompartmentPrimary'] = df['Compartment'].apply(lambda x: x.split('/')[0])
+    df['_CompartmentPrimary'] = get_primary_compartment(df['Compartment'])
 
     # split off rows w/ NaN FRS_ID or SRS_ID & later recombine into output
     df_nans = df.query('FRS_ID.isnull() or SRS_ID.isnull()')
@@ -118,10 +154,14 @@ def aggregate_and_remove_overlap(df):
     id_duplicates = df.duplicated(subset=cols_inter, keep=False)
     df_unq = df[~id_duplicates]
     df_dup = df.copy()[id_duplicates]
+    # group on categorical codes rather than strings
+    dtypes = df_dup.dtypes
+    str_cols = df_dup.select_dtypes(include=['object', 'string']).columns
+    df_dup[str_cols] = df_dup[str_cols].astype('category')
 
     # functions by column for intra-inventory aggregation
     funcs_agg = {
-        'FacilityID':       '_'.join, # or `set` or `'unique'` to get unique set of vals
+        'FacilityID':       '_'.join, # applied via join_by_group
         'FlowAmount':       'sum',
         'DataReliability':  'sum',  # sums FlowAmount-weighted elements
         'FlowName':         'first', # get the first element in .agg
@@ -131,27 +171,48 @@ def aggregate_and_remove_overlap(df):
     cols_intra = list(set(df_dup.columns) - set(funcs_agg.keys()))
     # affirm that cols_intra produces same number of groups as minimal cols
     cols_min = cols_inter + ['Source', 'Compartment', 'FlowName']
-    if not (df_dup.groupby(cols_intra).ngroups == df_dup.groupby(cols_min).ngroups):
+    if not (df_dup.groupby(cols_intra, observed=True).ngroups ==
+            df_dup.groupby(cols_min, observed=True).ngroups):
         log.error('intra-inventory unique-flow-defining cols are insufficient')
 
-    df_dup['_FlowAmountSum'] = (df_dup.groupby(cols_intra)['FlowAmount']
+    # code each intra-inventory group once and aggregate on the codes,
+    # groups are numbered in sorted order of cols_intra
+    group = df_dup.groupby(cols_intra, observed=True).ngroup()
+    if group.isna().any():
+        df_dup = df_dup[group.notna()].copy()
+        group = group.dropna()
+    group = group.astype(int)
+    df_dup['_FlowAmountSum'] = (df_dup.groupby(group)['FlowAmount']
                                       .transform('sum'))
     df_dup['DataReliability'] = df_dup.eval(
         'DataReliability * FlowAmount / _FlowAmountSum')
-    df_dup = df_dup.groupby(cols_intra, as_index=False).agg(funcs_agg)
+    grouped = df_dup.groupby(group)
+    df_agg = grouped[cols_intra + ['FlowName']].first()
+    df_agg['FlowAmount'] = grouped['FlowAmount'].sum()
+    df_agg['DataReliability'] = grouped['DataReliability'].sum()
+    df_agg['FacilityID'] = join_by_group(df_dup['FacilityID'], group)
+    df_dup = df_agg.reset_index(drop=True)
 
     # get source preference score (ordered, integer positions in inv_pref tuples)
     # via each entry's compartment and inventory source acronym
-
-    df_dup['_SourcePref'] = df_dup.apply(
-        lambda x: inv_pref.get(x['_CompartmentPrimary']).index(x['Source']),
-        axis='columns')
-    # df_dup.groupby(['Source', '_CompartmentPrimary', '_SourcePref']).size()
+    ranks = (get_source_rank_table()
+             .set_index(['_CompartmentPrimary', 'Source'])['_SourcePref'])
+    df_dup['_SourcePref'] = ranks.reindex(pd.MultiIndex.from_arrays(
+        [df_dup['_CompartmentPrimary'].astype(object),
+         df_dup['Source'].astype(object)])).values
+    if df_dup['_SourcePref'].isna().any():
+        missing = (df_dup.loc[df_dup['_SourcePref'].isna(),
+                              ['_CompartmentPrimary', 'Source']]
+                   .astype(str).drop_duplicates()
+                   .agg(': '.join, axis='columns'))
+        raise ValueError('No source preference in inv_pref for '
+                         f'{", ".join(missing)}')
 
     # then drop cross-inventory dups by keeping entries w/ min _SourcePref
-    df_dup['_SourcePrefMin'] = (df_dup.groupby(cols_inter)['_SourcePref']
-                                      .transform('min'))
-    df_dup = df_dup.query('_SourcePref == _SourcePrefMin')
+    df_dup['_SourcePrefMin'] = (df_dup.groupby(cols_inter, observed=True)
+                                ['_SourcePref'].transform('min'))
+    df_dup = (df_dup.query('_SourcePref == _SourcePrefMin')
+                    .astype(dtypes[str_cols].to_dict()))
 
     log.debug('Reincorporating rows with NaN FRS_ID or SRS_ID')
     df = pd.concat([df_unq, df_dup, df_nans], ignore_index=True)
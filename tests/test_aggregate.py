@@ -0,0 +1,38 @@
+"""Test aggregating flow amounts with a weighted data reliability score."""
+
+import numpy as np
+import pandas as pd
+import pytest
+from esupy.dqi import get_weighted_average
+
+from stewi.globals import aggregate
+
+
+def aggregate_by_weighted_average(df, grouping_vars):
+    """Aggregate as before, grouping again with esupy."""
+    df_agg = df.groupby(grouping_vars).agg({'FlowAmount': ['sum']})
+    df_agg['DataReliability'] = get_weighted_average(
+        df, 'DataReliability', 'FlowAmount', grouping_vars)
+    df_agg = df_agg.reset_index()
+    df_agg.columns = df_agg.columns.droplevel(level=1)
+    df_agg = df_agg[df_agg['FlowAmount'] > 0]
+    return df_agg[df_agg['FlowAmount'].notna()]
+
+
+@pytest.mark.parametrize('duplicates', [True, False])
+def test_aggregate_matches_weighted_average(duplicates):
+    rng = np.random.default_rng(0)
+    n = 500
+    df = pd.DataFrame({
+        'FacilityID': rng.choice(['1', '2', '3', None], n),
+        'FlowName': rng.choice(['A', 'B', 'C', 'D'], n),
+        'FlowAmount': rng.choice([np.nan, 0, -1.5, 0.1, 2.3, 1e6], n),
+        'DataReliability': rng.choice([np.nan, 1, 3, 5], n)})
+    if not duplicates:
+        df = df.drop_duplicates(subset=['FacilityID', 'FlowName'])
+    grouping_vars = ['FacilityID', 'FlowName']
+    expected = aggregate_by_weighted_average(df, grouping_vars)
+    result = aggregate(df, grouping_vars)
+    pd.testing.assert_frame_equal(
+        result.sort_values(grouping_vars).reset_index(drop=True),
+        expected.reset_index(drop=True), check_exact=True)
@@ -0,0 +1,168 @@
+"""Test concurrent DMR state queries against a local HTTP server."""
+
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+import pytest
+
+import stewi.DMR as DMR
+
+
+class FakeECHO(BaseHTTPRequestHandler):
+    """Minimal stand-in for the ECHO DMR custom data service."""
+
+    requests = []
+    fail_once = {'CA'}
+    split = {'TX'}
+    active = 0
+    max_active = 0
+    lock = threading.Lock()
+
+    def do_GET(self):
+        params = dict(urllib.parse.parse_qsl(
+            urllib.parse.urlsplit(self.path).query))
+        state = params.get('p_st')
+        with self.lock:
+            FakeECHO.requests.append(params)
+            FakeECHO.active += 1
+            FakeECHO.max_active = max(FakeECHO.max_active, FakeECHO.active)
+        try:
+            if state in self.fail_once:
+                self.fail_once.discard(state)
+                self.send_response(503)
+                self.end_headers()
+                return
+            if state in self.split and 'p_permit_type' not in params:
+                body = b'Maximum number of records exceeded'
+            else:
+                permit = params.get('p_permit_type', 'NPD')
+                body = ('NPDES Permit Number,State,Permit Type,'
+                        'Facility Latitude,Pollutant Code\n'
+                        f'{state}0001,{state},{permit},35.1,00530\n'
+                        f'{state}0002,{state},{permit},,00530\n'
+                        f'{state}0003,{state},{permit},36.2,\n').encode()
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        finally:
+            with self.lock:
+                FakeECHO.active -= 1
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def echo_server(monkeypatch, tmp_path):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeECHO)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setitem(DMR._config, 'base_url',
+                        f'http://127.0.0.1:{server.server_port}/?')
+    monkeypatch.setattr(DMR, 'OUTPUT_PATH', tmp_path)
+    monkeypatch.setattr(DMR, 'BACKOFF_FACTOR', 0.01)
+    monkeypatch.setattr(FakeECHO, 'fail_once', {'CA'})
+    FakeECHO.requests = []
+    FakeECHO.max_active = 0
+    yield FakeECHO
+    server.shutdown()
+    server.server_close()
+
+
+def test_query_dmr_concurrent_and_resumable(echo_server, tmp_path):
+    states = ['AL', 'AK', 'CA', 'TX', 'VA', 'WA']
+    results = DMR.query_dmr('2020', state_list=states, nutrient='N',
+                            max_workers=3, requests_per_second=100)
+    assert results == {s: 'success' for s in states}
+    assert list(results) == states
+    assert echo_server.max_active <= 3
+    # CA failed once and was retried; TX was split by permit type
+    queried = [r['p_st'] for r in echo_server.requests]
+    assert queried.count('CA') == 2
+    assert queried.count('TX') == 4
+
+    df = pd.read_parquet(DMR.state_file(tmp_path / 'year=2020', 'TX', 'N'))
+    assert set(df['Permit Type']) == {'NGP', 'GPC', 'NPD'}
+    manifest = DMR.read_manifest(tmp_path / 'year=2020')
+    assert {k: v['result'] for k, v in manifest.items()} == {
+        f'N_{s}': 'success' for s in states}
+
+    # a repeated run resumes from stored results without new requests
+    n_requests = len(echo_server.requests)
+    assert DMR.query_dmr('2020', state_list=states, nutrient='N',
+                         max_workers=3) == results
+    assert len(echo_server.requests) == n_requests
+
+    # a file that does not match the manifest is queried again
+    DMR.state_file(tmp_path / 'year=2020', 'VA', 'N').write_bytes(b'PAR1')
+    assert DMR.query_dmr('2020', state_list=states, nutrient='N',
+                         max_workers=3) == results
+    assert [r['p_st'] for r in echo_server.requests[n_requests:]] == ['VA']
+
+
+def test_query_dmr_records_failures(echo_server, tmp_path, monkeypatch):
+    monkeypatch.setattr(FakeECHO, 'fail_once', {'AL', 'AK'})
+    monkeypatch.setattr(DMR, 'MAX_ATTEMPTS', 1)
+    results = DMR.query_dmr('2020', state_list=['AL', 'AK', 'VA'])
+    assert results == {'AL': 'error', 'AK': 'error', 'VA': 'success'}
+    manifest = DMR.read_manifest(tmp_path / 'year=2020')
+    assert manifest['none_AL']['result'] == 'error'
+    assert not DMR.state_file(tmp_path / 'year=2020', 'AL').exists()
+
+    # failed states are queried again on the next run
+    results = DMR.query_dmr('2020', state_list=['AL', 'AK', 'VA'])
+    assert set(results.values()) == {'success'}
+
+
+def test_combine_dmr_inventory(echo_server, tmp_path, monkeypatch):
+    monkeypatch.setattr(DMR, 'STATES', ('AL', 'TX', 'VA'))
+    DMR.query_dmr('2020', state_list=['AL', 'TX'])
+    DMR.query_dmr('2020', state_list=['AL'], nutrient='P')
+    # missing states are queried when combining the stored data
+    df = DMR.combine_DMR_inventory('2020')
+    assert list(df.columns) == DMR.read_required_fields()
+    assert len(df) == 3 + 9 + 3
+    assert set(df['State']) == {'AL', 'TX', 'VA'}
+    assert df['Facility Latitude'].dtype == 'float64'
+    assert set(df['Pollutant Code'].dropna()) == {'00530'}
+
+    df = DMR.combine_DMR_inventory('2020', nutrient='P')
+    assert len(df) == 3 + 9 + 3
+
+
+def test_query_dmr_converts_pickled_files(echo_server, tmp_path):
+    (tmp_path / '2020').mkdir()
+    pd.DataFrame({'NPDES Permit Number': ['AL0001', 'AL0002'],
+                  'Facility Latitude': [35.1, None],
+                  'SIC Code': [111.0, None],
+                  'Pollutant Code': [530, 530]}
+                 ).to_pickle(tmp_path / '2020' / 'P_state_AL.pickle')
+    results = DMR.query_dmr('2020', state_list=['AL', 'AK'], nutrient='P')
+    assert results == {'AL': 'success', 'AK': 'success'}
+    assert [r['p_st'] for r in echo_server.requests] == ['AK']
+    df = pd.read_parquet(DMR.state_file(tmp_path / 'year=2020', 'AL', 'P'))
+    assert list(df['SIC Code'].fillna('')) == ['111', '']
+    assert list(df['Pollutant Code']) == ['530', '530']
+    assert df['Facility Latitude'].dtype == 'float64'
+
+
+def test_standardize_df_flow_ids(monkeypatch):
+    monkeypatch.setattr(DMR, 'PARAM_GROUP', True)
+    monkeypatch.setattr(DMR, 'read_pollutant_parameter_list', lambda: (
+        pd.DataFrame({'FlowName': ['Solids, total suspended', 'Copper'],
+                      'FlowID': ['530', '1119'],
+                      'PARAMETER_CODE': ['00530', '01119']})))
+    df = pd.DataFrame({c: None for c in DMR.read_required_fields()},
+                      index=range(3), dtype=object)
+    df['Pollutant Description'] = ['Solids, total suspended', 'Copper',
+                                   'Nitrogen']
+    df['Pollutant Code'] = ['00530', '01119', 'N']
+    df['SIC Code'] = ['0111', '2011', None]
+    df['Pollutant Load (kg/yr)'] = ['1,000', '2', '3']
+    df = DMR.standardize_df(df)
+    assert list(df['FlowID'].fillna('')) == ['530', '1119', '']
+    assert list(df['SIC'].fillna('')) == ['111', '2011', '']
+    assert list(df['FlowAmount']) == [1000, 2, 3]
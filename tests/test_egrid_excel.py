@@ -0,0 +1,66 @@
+"""Test the parquet cache of the required columns of eGRID sheets."""
+
+import openpyxl
+import pandas as pd
+
+import stewi.egrid as egrid
+import stewi.globals as sg
+from stewi.globals import remove_line_breaks
+
+
+def write_egrid_workbook(path):
+    wb = openpyxl.Workbook()
+    plnt = wb.active
+    plnt.title = 'PLNT20'
+    plnt.append(['Plant ID', 'Plant\nname', 'Plant annual heat input',
+                 'Plant ID', 'Notes', 'Plant steam'])
+    plnt.append(['ORISPL', 'PNAME', 'PLHTIAN', 'ORISPL2', None, 'USETHRMO'])
+    plnt.append([1, 'A', 10.5, 101, 'x', 3])
+    plnt.append([2, 'B', None, 102, None, None])
+    plnt.append([None] * 6)
+    plnt.append([3, 'C\nD', 2, 103, 'y', 4.5])
+    us = wb.create_sheet('US20')
+    us.append(['Heat', 'Electricity'])
+    us.append(['USHTIANT', 'USNGENAN'])
+    us.append([100.0, 200])
+    wb.save(path)
+
+
+def read_excel(path, sheetname, index='field'):
+    """Read a sheet as before the parquet cache."""
+    df = pd.read_excel(path, sheet_name=sheetname,
+                       header=0 if index == 'field' else 1, engine='openpyxl')
+    df = remove_line_breaks(df)
+    if index == 'field':
+        df = df.drop([0])
+    return df.dropna(how='all').reset_index(drop=True).infer_objects()
+
+
+def test_extract_egrid_excel(tmp_path, monkeypatch, caplog):
+    monkeypatch.setattr(egrid, 'OUTPUT_PATH', tmp_path)
+    monkeypatch.setitem(egrid._config, '2020', {'file_name': 'egrid.xlsx'})
+    fields = ['Plant ID', 'Plant name', 'Plant annual heat input']
+    monkeypatch.setattr(egrid, 'get_required_columns', lambda year: {
+        'PLNT': {'field': fields, 'code': ['USETHRMO']},
+        'US': {'code': ['USHTIANT', 'USNGENAN']}})
+    path = tmp_path / 'egrid.xlsx'
+    write_egrid_workbook(path)
+
+    df = egrid.extract_eGRID_excel('2020', 'PLNT')
+    expected = read_excel(path, 'PLNT20')
+    pd.testing.assert_frame_equal(df[fields],
+                                  expected[fields], check_dtype=False)
+    assert 'Plant ID is repeated on PLNT for columns ORISPL, ORISPL2' in (
+        caplog.text)
+    df = egrid.extract_eGRID_excel('2020', 'PLNT', index='code')
+    pd.testing.assert_frame_equal(
+        df[['USETHRMO']], read_excel(path, 'PLNT20', 'code')[['USETHRMO']])
+    df = egrid.extract_eGRID_excel('2020', 'US', index='code')
+    pd.testing.assert_frame_equal(
+        df, read_excel(path, 'US20', 'code'), check_dtype=False)
+
+    # the cache is read without parsing or hashing the workbook again
+    monkeypatch.setattr(egrid.openpyxl, 'load_workbook', None)
+    monkeypatch.setattr(sg, 'get_file_hash', None)
+    assert egrid.extract_eGRID_excel('2020', 'PLNT')['Plant ID'].tolist() == [
+        1, 2, 3]
@@ -1,10 +1,12 @@
 """Test the access of facilitymatcher and chemicalmatcher datasets."""
 
+import pandas as pd
 import pytest
 
 from stewi.globals import config
 import chemicalmatcher
 import facilitymatcher
+import facilitymatcher.globals as fmg
 
 
 @pytest.mark.skip(reason="skip download of facility matcher source data "
@@ -13,6 +15,29 @@ def test_facilitymatcher_file():
     assert facilitymatcher.get_matches_for_inventories(["TRI"]) is not None
 
 
+def test_facilitymatcher_index(tmp_path, monkeypatch):
+    monkeypatch.setattr(fmg, 'output_dir', tmp_path)
+    monkeypatch.setattr(fmg.paths, 'local_path', tmp_path)
+    monkeypatch.setattr(fmg, 'cache_dir', tmp_path / 'cache')
+    monkeypatch.setattr(fmg, '_fm_tables', {})
+    pd.DataFrame({'FRS_ID': ['1', '1', '2', '3', '3'],
+                  'Source': ['TRI', 'NEI', 'TRI', 'NEI', 'DMR'],
+                  'FacilityID': ['a', 'b', 'c', 'd', 'e']}
+                 ).to_parquet(tmp_path / 'FacilityMatchList_forStEWI_v1.parquet')
+
+    df = facilitymatcher.get_matches_for_id_list('TRI', ['a', 'x'],
+                                                 ['TRI', 'NEI'])
+    assert list(df['FacilityID']) == ['a', 'b']
+    assert list(df.index) == [0, 1]
+    df = facilitymatcher.get_matches_for_id_list('NEI', ['d'])
+    assert list(df['FacilityID']) == ['d', 'e']
+    assert len(facilitymatcher.get_matches_for_id_list('DMR', ['a'])) == 0
+    df = facilitymatcher.get_matches_for_inventories(['NEI'])
+    assert list(df['FacilityID']) == ['b', 'd']
+    assert list(df.index) == [1, 3]
+    assert len(list((tmp_path / 'cache').iterdir())) == 1
+
+
 def test_chemical_matches():
     assert chemicalmatcher.get_matches_for_StEWI(
         config()['databases'].keys()) is not None
@@ -0,0 +1,191 @@
+"""Test streaming FRS downloads against a local HTTP server."""
+
+import base64
+import hashlib
+import io
+import re
+import threading
+import time
+import zipfile
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import facilitymatcher.globals as fmg
+
+
+BRIDGE = b'REGISTRY_ID,PGM_SYS_ACRNM,PGM_SYS_ID\n' + b'1,TRIS,a\n' * 20000
+
+
+def make_zip():
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as z:
+        z.writestr('NATIONAL_ENVIRONMENTAL_INTEREST_FILE.CSV', BRIDGE)
+        z.writestr('NATIONAL_NAICS_FILE.CSV', b'REGISTRY_ID\n1\n')
+    return buffer.getvalue()
+
+
+class FakeFRS(BaseHTTPRequestHandler):
+    """Serves a zip file with range support, optionally cutting off the
+    first response."""
+
+    body = b''
+    ranges = []
+    truncate = None  # bytes sent before the first response is cut off
+    modified = 0  # Last-Modified, seconds since the epoch
+    content_md5 = None
+    etag = None
+    if_ranges = []
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(self.body)))
+        self.send_header('Last-Modified', formatdate(self.modified,
+                                                     usegmt=True))
+        self.end_headers()
+
+    def do_GET(self):
+        start = 0
+        range_header = self.headers.get('Range')
+        if_range = self.headers.get('If-Range')
+        FakeFRS.ranges.append(range_header)
+        FakeFRS.if_ranges.append(if_range)
+        if range_header and if_range in (None, self.etag):
+            start = int(re.match(r'bytes=(\d+)-', range_header)[1])
+            self.send_response(206)
+            self.send_header('Content-Range',
+                             f'bytes {start}-{len(self.body) - 1}/'
+                             f'{len(self.body)}')
+        else:
+            self.send_response(200)
+        if self.content_md5:
+            self.send_header('Content-MD5', self.content_md5)
+        if self.etag:
+            self.send_header('ETag', self.etag)
+        self.send_header('Content-Length', str(len(self.body) - start))
+        self.end_headers()
+        if self.truncate is not None:
+            self.wfile.write(self.body[start:self.truncate])
+            FakeFRS.truncate = None
+            self.close_connection = True
+            return
+        self.wfile.write(self.body[start:])
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def frs(tmp_path, monkeypatch):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeFRS)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setitem(fmg.FRS_config, 'url',
+                        f'http://127.0.0.1:{server.server_port}/'
+                        'national_combined.zip')
+    monkeypatch.setattr(fmg, 'FRSpath', tmp_path / 'FRS Data Files')
+    monkeypatch.setattr(fmg.paths, 'local_path', tmp_path)
+    monkeypatch.setattr(fmg, 'BACKOFF_FACTOR', 0.01)
+    FakeFRS.body = make_zip()
+    FakeFRS.ranges = []
+    FakeFRS.if_ranges = []
+    FakeFRS.truncate = None
+    FakeFRS.etag = None
+    FakeFRS.modified = time.time() - 3600
+    FakeFRS.content_md5 = base64.b64encode(
+        hashlib.md5(FakeFRS.body).digest()).decode()
+    yield FakeFRS
+    server.shutdown()
+    server.server_close()
+
+
+def test_download_resumes_and_extracts_member(frs, monkeypatch):
+    monkeypatch.setattr(fmg, 'CHUNK_SIZE', 64)
+    cut = len(frs.body) // 128 * 64
+    frs.truncate = cut
+    fmg.download_extract_FRS_combined_national(
+        'NATIONAL_ENVIRONMENTAL_INTEREST_FILE.CSV')
+    assert frs.ranges == [None, f'bytes={cut}-']
+    files = sorted(p.name for p in fmg.FRSpath.iterdir()
+                   if not p.name.endswith('_metadata.json'))
+    assert files == ['NATIONAL_ENVIRONMENTAL_INTEREST_FILE.CSV',
+                     'national_combined.zip']
+    assert (fmg.FRSpath / files[0]).read_bytes() == BRIDGE
+
+    # other files are extracted from the downloaded archive
+    fmg.download_extract_FRS_combined_national('NATIONAL_NAICS_FILE.CSV')
+    assert len(frs.ranges) == 2
+    assert (fmg.FRSpath / 'NATIONAL_NAICS_FILE.CSV').exists()
+
+    # an archive updated on the server is downloaded again
+    frs.modified = time.time() + 60
+    fmg.download_extract_FRS_combined_national('NATIONAL_NAICS_FILE.CSV')
+    assert frs.ranges[2:] == [None]
+
+
+def test_download_checksum_mismatch(frs, tmp_path, monkeypatch):
+    monkeypatch.setattr(fmg, 'MAX_ATTEMPTS', 2)
+    frs.content_md5 = base64.b64encode(hashlib.md5(b'x').digest()).decode()
+    filepath = tmp_path / 'national_combined.zip'
+    with pytest.raises(ConnectionError):
+        fmg.download_file(fmg.FRS_config['url'], filepath)
+    assert frs.ranges == [None, None]
+    assert list(tmp_path.iterdir()) == []
+
+    frs.content_md5 = None
+    digest = fmg.download_file(fmg.FRS_config['url'], filepath,
+                               sha256=hashlib.sha256(frs.body).hexdigest())
+    assert digest == hashlib.sha256(frs.body).hexdigest()
+    assert filepath.read_bytes() == frs.body
+
+
+def test_download_restarts_changed_file(frs, tmp_path, monkeypatch):
+    monkeypatch.setattr(fmg, 'MAX_ATTEMPTS', 1)
+    monkeypatch.setattr(fmg, 'CHUNK_SIZE', 64)
+    filepath = tmp_path / 'national_combined.zip'
+    frs.etag = '"v1"'
+    frs.truncate = 640
+    with pytest.raises(ConnectionError):
+        fmg.download_file(fmg.FRS_config['url'], filepath)
+    assert (tmp_path / 'national_combined.zip.part').stat().st_size == 640
+
+    # the archive is replaced on the server before the download resumes
+    frs.body = frs.body[::-1]
+    frs.etag = '"v2"'
+    frs.content_md5 = None
+    fmg.download_file(fmg.FRS_config['url'], filepath)
+    assert frs.ranges == [None, 'bytes=640-']
+    assert frs.if_ranges == [None, '"v1"']
+    assert filepath.read_bytes() == frs.body
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        'national_combined.zip']
+
+
+def test_read_FRS_file_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(fmg, 'FRSpath', tmp_path)
+    monkeypatch.setattr(fmg, 'cache_dir', tmp_path / 'cache')
+    path = tmp_path / 'NATIONAL_NAICS_FILE.CSV'
+    path.write_text('REGISTRY_ID,PGM_SYS_ACRNM,NAICS_CODE,OTHER\n'
+                    '110000491735,TRIS,0325,x\n'
+                    '110000491744,ICIS,325,y\n'
+                    '110000491744,EIS,,z\n')
+    col_dict = {'REGISTRY_ID': 'str', 'PGM_SYS_ACRNM': 'str',
+                'NAICS_CODE': 'str'}
+    df = fmg.read_FRS_file(path.name, col_dict, ['TRIS', 'EIS'])
+    assert list(df.columns) == list(col_dict)
+    assert df.iloc[0].tolist() == ['110000491735', 'TRIS', '0325']
+    assert df['PGM_SYS_ACRNM'].tolist() == ['TRIS', 'EIS']
+    assert df['NAICS_CODE'].isna().tolist() == [False, True]
+    cache = list((tmp_path / 'cache').glob('*.parquet'))
+    assert len(cache) == 1
+    monkeypatch.setattr(fmg.pacsv, 'open_csv', None)
+    assert fmg.read_FRS_file(path.name, col_dict, ['TRIS', 'EIS']).equals(df)
+
+    # a changed file replaces the cache
+    monkeypatch.undo()
+    monkeypatch.setattr(fmg, 'FRSpath', tmp_path)
+    monkeypatch.setattr(fmg, 'cache_dir', tmp_path / 'cache')
+    path.write_text('REGISTRY_ID,PGM_SYS_ACRNM,NAICS_CODE\n1,TRIS,1\n')
+    assert len(fmg.read_FRS_file(path.name, col_dict, ['TRIS'])) == 1
+    assert not cache[0].exists()
@@ -0,0 +1,75 @@
+"""Test reading stored inventories with getInventory."""
+
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+
+import stewi
+import stewi.globals as sg
+from stewi.formats import StewiFormat
+
+
+@pytest.fixture
+def inventory(tmp_path, monkeypatch):
+    monkeypatch.setattr(sg.paths, 'local_path', tmp_path)
+    df = pd.DataFrame({'FacilityID': ['1', '2', '3', '1'],
+                       'FlowName': ['A', 'B', 'B', 'B'],
+                       'Compartment': ['air', 'air', 'air', 'water'],
+                       'FlowAmount': [1.0, 4.0, 5.0, 3.0],
+                       'Unit': 'kg',
+                       'DataReliability': 1.0})
+    facilities = pd.DataFrame({'FacilityID': ['1', '2', '3'],
+                               'State': ['NC', 'NC', 'XX']})
+    sg.store_inventory(df, 'NEI_2017', StewiFormat.FLOWBYFACILITY)
+    sg.store_inventory(facilities, 'NEI_2017', StewiFormat.FACILITY)
+    stewi.clearInventoryCache()
+    yield df
+    stewi.clearInventoryCache()
+    stewi.setInventoryCacheSize(stewi.INVENTORY_CACHE_MAX_BYTES)
+
+
+def test_inventory_cache(inventory):
+    stewi.setInventoryCacheSize(2**20)
+    df = stewi.getInventory('NEI', 2017)
+    assert stewi.getInventoryCacheStats()['entries'] == 1
+    assert stewi.getInventory('NEI', 2017).equals(df)
+    assert stewi.getInventoryCacheStats()['hits'] == 1
+
+    stewi.setInventoryCacheSize(0)
+    assert stewi.getInventoryCacheStats()['entries'] == 0
+    assert stewi.getInventory('NEI', 2017).equals(df)
+    assert stewi.getInventoryCacheStats()['entries'] == 0
+
+
+def test_inventory_columns_with_filter(inventory):
+    df = stewi.getInventory('NEI', 2017, columns=['FlowName', 'FlowAmount'],
+                            filters=['US_States_only'])
+    assert list(df.columns) == ['FlowName', 'FlowAmount']
+    assert dict(zip(df['FlowName'], df['FlowAmount'])) == {'A': 1.0, 'B': 7.0}
+    df = stewi.getInventory('NEI', 2017, columns=['FlowName', 'FlowAmount'])
+    assert dict(zip(df['FlowName'], df['FlowAmount'])) == {'A': 1.0, 'B': 12.0}
+
+
+def test_store_inventory_writes_current_version(inventory, tmp_path):
+    newer = tmp_path / 'flowbyfacility' / 'NEI_2017_v9.9.9.parquet'
+    newer.write_bytes(b'other version')
+    meta = sg.set_stewi_meta('NEI_2017', 'flowbyfacility')
+    sg.store_inventory(inventory.iloc[:2], 'NEI_2017',
+                       StewiFormat.FLOWBYFACILITY)
+    assert newer.read_bytes() == b'other version'
+    files = sorted((tmp_path / 'flowbyfacility').iterdir())
+    assert len(files) == 2 and files[-1] == newer
+    assert pq.read_metadata(files[0]).num_rows == 2
+    # the stored file is read with and without filters
+    assert sg.find_file(meta, sg.paths) == files[0]
+    assert len(stewi.getInventory('NEI', 2017)) == 2
+    assert len(stewi.getInventory('NEI', 2017, flow_names=['A', 'B'])) == 2
+
+
+def test_inventory_categorical(inventory):
+    df = stewi.getInventory('NEI', 2017)
+    assert not any(isinstance(df[c].dtype, pd.CategoricalDtype) for c in df)
+    df = stewi.getInventory('NEI', 2017, categorical=True)
+    assert isinstance(df['FlowName'].dtype, pd.CategoricalDtype)
+    facilities = stewi.getInventoryFacilities('NEI', 2017)
+    assert not isinstance(facilities['State'].dtype, pd.CategoricalDtype)
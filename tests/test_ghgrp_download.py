@@ -0,0 +1,147 @@
+"""Test chunked GHGRP table downloads against a local HTTP server."""
+
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+import pytest
+
+import stewi.GHGRP as GHGRP
+
+
+N_ROWS = 23
+
+
+class FakeEnvirofacts(BaseHTTPRequestHandler):
+    """Minimal stand-in for the Envirofacts data service."""
+
+    requests = []
+    fail = {}  # row_start: number of failed responses before success
+    active = 0
+    max_active = 0
+    lock = threading.Lock()
+
+    def do_GET(self):
+        if self.path.endswith('/COUNT'):
+            body = (f'<Envirofacts><REQUESTRECORDCOUNT>{N_ROWS}'
+                    '</REQUESTRECORDCOUNT></Envirofacts>').encode()
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        rows = re.search(r'/ROWS/(\d+):(\d+)/', self.path)
+        start, end = int(rows[1]), int(rows[2])
+        with self.lock:
+            FakeEnvirofacts.requests.append(start)
+            FakeEnvirofacts.active += 1
+            FakeEnvirofacts.max_active = max(FakeEnvirofacts.max_active,
+                                             FakeEnvirofacts.active)
+            failing = self.fail.get(start, 0) > 0
+            if failing:
+                self.fail[start] -= 1
+        try:
+            if failing:
+                self.send_response(503)
+                self.end_headers()
+                return
+            lines = ['t_subpart.facility_id,t_subpart.reporting_year,'
+                     't_subpart.ghg_quantity,t_subpart.gas_name,'
+                     't_subpart.not_used'] + [
+                f'{i},2020,{i * 1.5},{i},x'
+                for i in range(start, min(end, N_ROWS) + 1)]
+            body = '\n'.join(lines).encode()
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        finally:
+            with self.lock:
+                FakeEnvirofacts.active -= 1
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def envirofacts(monkeypatch):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeEnvirofacts)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setitem(GHGRP._config, 'enviro_url',
+                        f'http://127.0.0.1:{server.server_port}/')
+    monkeypatch.setattr(GHGRP, 'CHUNK_SIZE', 5)
+    monkeypatch.setattr(GHGRP, 'BACKOFF_FACTOR', 0.01)
+    monkeypatch.setattr(FakeEnvirofacts, 'fail', {})
+    FakeEnvirofacts.requests = []
+    FakeEnvirofacts.max_active = 0
+    yield FakeEnvirofacts
+    server.shutdown()
+    server.server_close()
+
+
+def test_download_chunks_ordered(envirofacts, tmp_path):
+    envirofacts.fail = {10: 2}
+    filepath = tmp_path / 'T_SUBPART.csv'
+    df = GHGRP.download_chunks('T_SUBPART', N_ROWS, GHGRP.MetaGHGRP(),
+                               report_year='2020', filepath=filepath,
+                               max_workers=3)
+    assert list(df.columns) == ['FACILITY_ID', 'REPORTING_YEAR',
+                                'GHG_QUANTITY', 'GAS_NAME', 'NOT_USED']
+    assert list(df['FACILITY_ID']) == list(range(N_ROWS + 1))
+    assert envirofacts.max_active <= 3
+    assert sorted(envirofacts.requests) == [0, 5, 10, 10, 10, 15, 20]
+    pd.testing.assert_frame_equal(pd.read_csv(filepath),
+                                  df.reset_index(drop=True))
+    assert not GHGRP.chunk_dir(filepath).exists()
+
+
+def test_download_chunks_resumes(envirofacts, tmp_path, monkeypatch):
+    monkeypatch.setattr(GHGRP, 'MAX_ATTEMPTS', 2)
+    envirofacts.fail = {15: 2}
+    filepath = tmp_path / 'T_SUBPART.csv'
+    with pytest.raises(ConnectionError):
+        GHGRP.download_chunks('T_SUBPART', N_ROWS, GHGRP.MetaGHGRP(),
+                              report_year='2020', filepath=filepath)
+    assert not filepath.exists()
+    assert len(list(GHGRP.chunk_dir(filepath).glob('*.csv'))) == 4
+
+    # only the failed chunk is requested again
+    envirofacts.requests = []
+    df = GHGRP.download_chunks('T_SUBPART', N_ROWS, GHGRP.MetaGHGRP(),
+                               report_year='2020', filepath=filepath)
+    assert envirofacts.requests == [15]
+    assert list(df['FACILITY_ID']) == list(range(N_ROWS + 1))
+
+
+def test_download_chunks_parquet(envirofacts, tmp_path):
+    filepath = tmp_path / 'T_SUBPART.parquet'
+    m = GHGRP.MetaGHGRP()
+    downloaded = GHGRP.import_or_download_table(filepath, 'T_SUBPART',
+                                                '2020', m)
+    df = GHGRP.import_or_download_table(filepath, 'T_SUBPART', '2020', m)
+    # only columns in ghgrp_columns.csv are stored, with explicit types
+    assert df.dtypes.astype(str).to_dict() == {
+        'FACILITY_ID': 'Int64', 'REPORTING_YEAR': 'Int64',
+        'GHG_QUANTITY': 'float64', 'GAS_NAME': df['GAS_NAME'].dtype.name}
+    assert df['GAS_NAME'].iloc[3] == '3'
+    assert len(df) == N_ROWS + 1
+    # a fresh download returns the table as stored
+    pd.testing.assert_frame_equal(downloaded, df)
+
+
+def test_write_parquet_missing_integers(tmp_path, caplog):
+    filepath = tmp_path / 'GHGRP_2020.parquet'
+    ghgrp = pd.DataFrame({'FacilityID': [1, None, 'x', 2.5],
+                          'REPORTING_YEAR': 2020,
+                          'FlowAmount': [1.0, 2.0, 3.0, 4.0],
+                          'FlowName': 'Methane',
+                          'Flow Description': 'CH4'})
+    df = GHGRP.write_parquet(ghgrp, filepath, GHGRP.GHGRP_SCHEMA)
+    assert list(df.columns) == ['FacilityID', 'REPORTING_YEAR',
+                                'FlowAmount', 'FlowName']
+    assert df['FacilityID'].dtype == 'Int64'
+    assert df['FacilityID'].isna().tolist() == [False, True, True, True]
+    assert '2 values of FacilityID are not integers' in caplog.text
+    pd.testing.assert_frame_equal(GHGRP.read_parquet(filepath), df)
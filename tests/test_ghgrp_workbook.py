@@ -0,0 +1,60 @@
+"""Test the parquet cache of GHGRP Excel workbook sheets."""
+
+import pandas as pd
+
+import stewi.GHGRP as GHGRP
+import stewi.globals as sg
+
+
+def test_read_workbook_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(GHGRP, 'OUTPUT_PATH', tmp_path)
+    path = tmp_path / 'subparts.xlsx'
+    with pd.ExcelWriter(path) as writer:
+        pd.DataFrame({'Facility ID': [1, 2],
+                      'Emissions\n(metric tons)': [1.5, 'confidential'],
+                      'Notes': ['a', 'b']}
+                     ).to_excel(writer, sheet_name='Subpart X', index=False)
+        pd.DataFrame({'Other': [1]}).to_excel(writer, sheet_name='FAQs',
+                                              index=False)
+    assert GHGRP.get_sheet_names(path) == ['Subpart X', 'FAQs']
+
+    columns = ['Facility ID', 'Emissions (metric tons)']
+    df = GHGRP.read_workbook(path, ['Subpart X'], columns=columns)['Subpart X']
+    assert list(df.columns) == columns
+    assert list(df['Emissions (metric tons)']) == ['1.5', 'confidential']
+    cache_path = GHGRP.workbook_cache_path(path, tmp_path)
+    assert len(list(cache_path.glob('*.parquet'))) == 1
+
+    # cached sheets are read without parsing or hashing the workbook again
+    monkeypatch.setattr(pd, 'read_excel', None)
+    monkeypatch.setattr(sg, 'get_file_hash', None)
+    df2 = GHGRP.read_workbook(path, ['Subpart X'], columns=columns[:1])
+    assert list(df2['Subpart X']['Facility ID']) == [1, 2]
+
+    # a changed workbook gets a new cache
+    monkeypatch.undo()
+    monkeypatch.setattr(GHGRP, 'OUTPUT_PATH', tmp_path)
+    pd.DataFrame({'Facility ID': [3]}).to_excel(path, sheet_name='Subpart X',
+                                                index=False)
+    assert GHGRP.workbook_cache_path(path, tmp_path) != cache_path
+    df3 = GHGRP.read_workbook(path, ['Subpart X'], columns=columns)
+    assert list(df3['Subpart X']['Facility ID']) == [3]
+
+
+def test_additional_subparts_year(tmp_path, monkeypatch):
+    monkeypatch.setattr(GHGRP, 'OUTPUT_PATH', tmp_path)
+    cols_file = tmp_path / 'subparts_columns.csv'
+    pd.DataFrame({'subpart_abbr': 'L', 'tab_name': 'Emissions',
+                  'column_type': ['quantity', 'flow'],
+                  'column_name': ['Emissions (mt)', 'Gas']}
+                 ).to_csv(cols_file, index=False)
+    path = tmp_path / 'subparts.xlsx'
+    # a note below the data makes the year column text in the cache
+    pd.DataFrame({'Facility ID': [1, 2, None],
+                  'Reporting Year': [2020, 2021, 'Note: see FAQs'],
+                  'Gas': ['HFC-23', 'HFC-23', None],
+                  'Emissions (mt)': [1.5, 2.5, None]}
+                 ).to_excel(path, sheet_name='Emissions', index=False)
+    df = GHGRP.parse_additional_suparts_data(path, cols_file, '2021')
+    assert df['FACILITY_ID'].tolist() == [2]
+    assert df['REPORTING_YEAR'].tolist() == [2021]
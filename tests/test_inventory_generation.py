@@ -1,9 +1,15 @@
 """Test the creation of all inventories."""
 
+import multiprocessing as mp
+import shutil
+import time
+
 import pytest
 
 import stewi
-from stewi.globals import config, generate_inventory
+import stewi.globals
+import stewi.TRI
+from stewi.globals import config, generate_inventory, generate_inventories
 from stewi.exceptions import InventoryNotAvailableError
 import stewicombo
 import facilitymatcher
@@ -33,6 +39,91 @@ def test_generate_inventories(year):
             continue
 
 
+def test_generate_inventories_isolates_failures():
+    jobs = [('NotAnInventory', 2018), ('AlsoNotAnInventory', 2019)]
+    results = generate_inventories(jobs, max_workers=2, memory_limit_mb=1)
+    assert [(r['inventory'], r['year']) for r in results] == [
+        ('NotAnInventory', '2018'), ('AlsoNotAnInventory', '2019')]
+    for r in results:
+        assert r['status'] == 'error'
+        assert r['error'].startswith('InventoryNotAvailableError')
+        assert r['seconds'] >= 0
+
+
+@pytest.mark.skipif(mp.get_start_method() != 'fork',
+                    reason='patched function is not used by spawned processes')
+def test_generate_inventories_runs_years_in_sequence(tmp_path, monkeypatch):
+    def generate(inventory, year):
+        start = time.time()
+        time.sleep(0.5)
+        (tmp_path / f'{inventory}_{year}').write_text(f'{start} {time.time()}')
+    monkeypatch.setattr(stewi.globals, 'generate_inventory', generate)
+    jobs = [('RCRAInfo', 2019), ('RCRAInfo', 2021), ('GHGRP', 2019)]
+    results = generate_inventories(jobs, max_workers=3, memory_limit_mb=0)
+    assert [r['status'] for r in results] == ['success'] * 3
+    times = {name: [float(t) for t in (tmp_path / name).read_text().split()]
+             for name in ['RCRAInfo_2019', 'RCRAInfo_2021', 'GHGRP_2019']}
+    # years of one inventory do not overlap, other inventories run alongside
+    assert times['RCRAInfo_2021'][0] >= times['RCRAInfo_2019'][1]
+    assert times['GHGRP_2019'][0] < times['RCRAInfo_2019'][1]
+
+
+def test_generate_inventory_skips_unchanged_stages(tmp_path, monkeypatch):
+    data_path = tmp_path / 'data'
+    shutil.copytree(stewi.globals.DATA_PATH / 'TRI', data_path / 'TRI')
+    monkeypatch.setattr(stewi.globals, 'DATA_PATH', data_path)
+    monkeypatch.setattr(stewi.globals.paths, 'local_path', tmp_path / 'local')
+    module_path = tmp_path / 'stewi'
+    module_path.mkdir()
+    shutil.copy(stewi.TRI.__file__, module_path)
+    monkeypatch.setattr(stewi.globals, 'MODULEPATH', module_path)
+    calls = []
+
+    def main(**kwargs):
+        calls.append(kwargs['Option'])
+        year = kwargs['Year'][0]
+        if kwargs['Option'] == 'A':
+            files = [f'TRI Data Files/US_{f}_{year}.csv'
+                     for f in kwargs['Files']]
+        else:
+            files = [f'flowbyfacility/TRI_{year}_v1.parquet']
+            # validation totals are written when missing
+            totals = data_path / f'TRI_{year}_NationalTotals.csv'
+            if not totals.exists():
+                totals.write_text('totals')
+        for file in files:
+            path = tmp_path / 'local' / file
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(kwargs['Option'])
+
+    monkeypatch.setattr(stewi.TRI, 'main', main)
+    generate_inventory('TRI', 2020)
+    assert calls == ['A', 'C']
+    generate_inventory('TRI', 2020)
+    assert calls == ['A', 'C']
+
+    # a changed mapping file only runs the stages that use it
+    with open(data_path / 'TRI' / 'TRI_ReleaseType_to_Compartment.csv',
+              'a') as f:
+        f.write('\n')
+    generate_inventory('TRI', 2020)
+    assert calls == ['A', 'C', 'C']
+
+    # a missing output runs its stage again, the download is unchanged so
+    # the inventory is not generated again
+    (tmp_path / 'local' / 'TRI Data Files' / 'US_1a_2020.csv').unlink()
+    generate_inventory('TRI', 2020)
+    assert calls == ['A', 'C', 'C', 'A']
+    generate_inventory('TRI', 2020, force=True)
+    assert calls == ['A', 'C', 'C', 'A', 'A', 'C']
+
+    # a changed module runs its stages again
+    with open(module_path / 'TRI.py', 'a') as f:
+        f.write('\n')
+    generate_inventory('TRI', 2020)
+    assert calls == ['A', 'C', 'C', 'A', 'A', 'C', 'A', 'C']
+
+
 @pytest.mark.combined
 def test_generate_fm_files():
     df_naics = facilitymatcher.get_FRS_NAICSInfo_for_facility_list(
@@ -0,0 +1,45 @@
+"""Test organizing RCRAInfo BR_REPORTING files by report cycle."""
+
+import pandas as pd
+
+import stewi.RCRAInfo as RCRAInfo
+
+
+def write_br_reporting(path, handlers, cycle):
+    fields = pd.read_csv(RCRAInfo.RCRA_DATA_PATH.joinpath(
+        'RCRA_FlatFile_LineComponents.csv'))['Data Element Name']
+    df = pd.DataFrame('', index=range(len(handlers)), columns=fields)
+    df['Handler ID'] = handlers
+    df['Report Cycle'] = cycle
+    df.to_csv(path, index=False)
+
+
+def test_organize_requested_years(tmp_path, monkeypatch):
+    monkeypatch.setattr(RCRAInfo, 'OUTPUT_PATH', tmp_path)
+    monkeypatch.setattr(RCRAInfo, 'DIR_RCRA_BY_YEAR', tmp_path / 'by_year')
+    monkeypatch.setattr(RCRAInfo, 'BR_DATASET',
+                        tmp_path / 'by_year' / 'br_reporting')
+    monkeypatch.setattr(RCRAInfo, 'generate_metadata', lambda *a, **k: None)
+    write_br_reporting(tmp_path / 'BR_REPORTING_2019_0.csv', ['a', 'b'], 2019)
+    write_br_reporting(tmp_path / 'BR_REPORTING_2021_0.csv', ['c'], 2021)
+
+    def handlers(year):
+        return sorted(pd.read_parquet(RCRAInfo.BR_DATASET / f'year={year}')
+                      ['Handler ID'])
+
+    RCRAInfo.main(Option='B', Year=['2019'], Tables=['BR_REPORTING'])
+    assert [p.name for p in RCRAInfo.BR_DATASET.iterdir()] == ['year=2019']
+    assert handlers(2019) == ['a', 'b']
+
+    # organizing another year keeps the partitions of other years
+    write_br_reporting(tmp_path / 'BR_REPORTING_2019_0.csv', ['a'], 2019)
+    RCRAInfo.main(Option='B', Year=['2021'], Tables=['BR_REPORTING'])
+    assert handlers(2019) == ['a', 'b']
+    assert handlers(2021) == ['c']
+    assert sorted(p.name for p in RCRAInfo.DIR_RCRA_BY_YEAR.iterdir()) == [
+        'br_reporting']
+
+    # all years are organized when none is passed
+    RCRAInfo.organize_br_reporting_files(['BR_REPORTING'])
+    assert handlers(2019) == ['a']
+    assert handlers(2021) == ['c']
@@ -0,0 +1,152 @@
+"""Test concurrent, cached SRS name lookups against a local HTTP server."""
+
+import json
+import threading
+import time
+import urllib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+import pytest
+
+import chemicalmatcher.globals as cmg
+import chemicalmatcher.writeStEWIchemicalmatchesbyinventory as wcm
+
+
+SUBSTANCES = {'Methane': ('4594', '74-82-8'),
+              'Carbon dioxide': ('1842', '124-38-9'),
+              'Nitrous oxide': ('5207', '10024-97-2')}
+
+
+class FakeSRS(BaseHTTPRequestHandler):
+    """Minimal stand-in for the SRS substance name service."""
+
+    requests = []
+    active = 0
+    max_active = 0
+    lock = threading.Lock()
+
+    def do_GET(self):
+        path = urllib.parse.urlsplit(self.path).path
+        name = urllib.parse.unquote(path.rsplit('/', 1)[-1])
+        with self.lock:
+            FakeSRS.requests.append(name)
+            FakeSRS.active += 1
+            FakeSRS.max_active = max(FakeSRS.max_active, FakeSRS.active)
+        try:
+            time.sleep(0.02)
+            if name == 'missing':
+                self.send_response(404)
+                self.end_headers()
+                return
+            result = ([{'subsKey': SUBSTANCES[name][0],
+                        'currentCasNumber': SUBSTANCES[name][1]}]
+                      if name in SUBSTANCES else [])
+            body = json.dumps(result).encode()
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        finally:
+            with self.lock:
+                FakeSRS.active -= 1
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def srs(tmp_path, monkeypatch):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeSRS)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(cmg, 'base', f'http://127.0.0.1:{server.server_port}/')
+    monkeypatch.setattr(cmg, 'SRS_CACHE', tmp_path / 'srs_cache.sqlite')
+    FakeSRS.requests = []
+    FakeSRS.max_active = 0
+    yield FakeSRS
+    server.shutdown()
+    server.server_close()
+
+
+def test_substance_names_cached(srs):
+    names = list(SUBSTANCES) * 4 + ['Unobtainium', 'missing', 'Methane']
+    df, errors = cmg.get_SRSInfo_for_substance_names(names, max_workers=3)
+    assert list(df['FlowName']) == list(SUBSTANCES) * 4 + ['Methane']
+    assert list(df['SRS_ID'][:3]) == ['4594', '1842', '5207']
+    assert list(df['SRS_CAS'][:3]) == ['74-82-8', '124-38-9', '10024-97-2']
+    assert errors.values.tolist() == [
+        ['Unobtainium', 'Error: No SRS info found'],
+        ['missing', 'Error:404']]
+    # each name is requested once, with at most max_workers at a time
+    assert sorted(srs.requests) == sorted(list(SUBSTANCES) +
+                                          ['Unobtainium', 'missing'])
+    assert 1 < srs.max_active <= 3
+
+    srs.requests = []
+    df2, errors2 = cmg.get_SRSInfo_for_substance_names(names)
+    assert srs.requests == []
+    assert df2.equals(df) and errors2.equals(errors)
+    assert cmg.get_SRSInfo_for_substance_name('Methane').loc[
+        0, 'SRS_ID'] == '4594'
+    assert srs.requests == []
+
+    # expired responses are requested again
+    cmg.fetch_SRS_responses([cmg.get_SRS_name_url('Methane')], ttl=0)
+    assert srs.requests == ['Methane']
+
+
+def test_normalize_SRS_url():
+    assert (cmg.normalize_SRS_url('HTTP://Example.gov/a/B?y=2&x=1') ==
+            cmg.normalize_SRS_url('http://example.gov/a/B?x=1&y=2'))
+
+
+
+def test_chemical_matches_only_new_flow_files(tmp_path, monkeypatch):
+    pd.DataFrame({'FlowID': ['900001'], 'FlowName': ['Benzene'],
+                  'SRS_CAS': ['71-43-2'], 'SRS_ID': ['1'], 'Source': ['TRI']}
+                 ).to_csv(tmp_path / 'ChemicalsByInventorywithSRS_IDS_forStEWI.csv',
+                          index=False)
+    pd.DataFrame(columns=['FlowID', 'FlowName', 'SRS_CAS', 'SRS_ID', 'Source']
+                 ).to_csv(tmp_path / 'flows_missing_SRS_ID.csv', index=False)
+    flows = {'2019': pd.DataFrame({'FlowID': ['900001'],
+                                   'FlowName': ['Benzene']}),
+             '2020': pd.DataFrame({'FlowID': ['900001', '900002'],
+                                   'FlowName': ['Benzene', 'Toluene']})}
+    srs = pd.DataFrame(columns=['PGM_ID', 'SRS_ID', 'SRS_CAS'])
+    hashes = {'TRI': {'2019': 'a', '2020': 'b'}}
+    read, queried = [], []
+
+    def get_program_list(source):
+        queried.append(source)
+        return srs
+    monkeypatch.setattr(wcm, 'OUTPUT_PATH', tmp_path)
+    monkeypatch.setattr(wcm, 'MATCHED_FLOW_FILES', tmp_path / 'matched.json')
+    monkeypatch.setattr(wcm, 'get_flow_file_hashes', lambda: hashes)
+    monkeypatch.setattr(wcm, 'get_SRSInfo_for_program_list', get_program_list)
+    monkeypatch.setattr(wcm.stewi, 'getInventoryFlows',
+                        lambda s, y: read.append(y) or flows[y])
+
+    def srs_ids():
+        df = pd.read_csv(tmp_path / 'ChemicalsByInventorywithSRS_IDS_forStEWI.csv',
+                         dtype={'SRS_ID': str})
+        return sorted(zip(df['FlowName'], df['SRS_ID'].fillna('')))
+
+    wcm.writeChemicalMatches()
+    assert sorted(read) == ['2019', '2020'] and queried == ['TRI']
+    assert srs_ids() == [('Benzene', '1'), ('Toluene', '')]
+
+    # flows without a match are queried again, without reading flow files
+    read.clear()
+    srs = pd.DataFrame({'PGM_ID': ['900002'], 'SRS_ID': ['2'],
+                        'SRS_CAS': ['108-88-3']})
+    wcm.writeChemicalMatches()
+    assert read == [] and queried == ['TRI', 'TRI']
+    assert srs_ids() == [('Benzene', '1'), ('Toluene', '2')]
+    wcm.writeChemicalMatches()
+    assert queried == ['TRI', 'TRI']
+
+    # only changed flow files are read, their matched flows are not queried
+    hashes['TRI']['2020'] = 'c'
+    wcm.writeChemicalMatches()
+    assert read == ['2020'] and queried == ['TRI', 'TRI']
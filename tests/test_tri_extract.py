@@ -0,0 +1,36 @@
+"""Test extracting TRI Basic Plus files from a zip archive."""
+
+import zipfile
+
+import pandas as pd
+
+import stewi.TRI as TRI
+
+
+def test_extract_TRI_zip(tmp_path, monkeypatch):
+    monkeypatch.setattr(TRI, 'OUTPUT_PATH', tmp_path)
+    monkeypatch.setattr(TRI, 'CHUNK_SIZE', 2)
+    columns = list(pd.read_csv(TRI.TRI_DATA_PATH / 'TRI_File_1a_columns.txt')
+                   ['Names'])
+    full = '\t'.join(str(i) for i in range(len(columns) + 2))
+    lines = ['header',
+             full,
+             'A\t2020\t"ACME, "INC"',  # quotes are kept as is
+             'B\t2020',
+             'C',
+             full]
+    zip_path = tmp_path / 'US_2020.zip'
+    with zipfile.ZipFile(zip_path, 'w') as z:
+        z.writestr('US_1a_2020.txt', '\r\n'.join(lines) + '\r\n')
+    stats = TRI.extract_TRI_zip(zip_path, ['1a'], 2020)
+    assert stats['US_1a_2020']['rows'] == 5
+
+    df = pd.read_csv(tmp_path / 'US_1a_2020.csv', dtype=str,
+                     keep_default_na=False)
+    assert list(df.columns) == columns
+    assert df.iloc[0].tolist() == [str(i) for i in range(len(columns))]
+    assert df.iloc[1, :4].tolist() == ['A', '2020', '"ACME, "INC"', '']
+    assert df.iloc[2, :3].tolist() == ['B', '2020', '']
+    # a chunk of only short rows is padded
+    assert df.iloc[3, :2].tolist() == ['C', '']
+    assert (df.iloc[1:4, 4:] == '').all().all()
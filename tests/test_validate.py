@@ -0,0 +1,114 @@
+"""Test the vectorized validation of inventories against reference data."""
+
+import logging
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from stewi.validate import validate_inventory
+
+
+def validate_inventory_by_row(validation_df, tolerance):
+    """Row-wise classification from prior releases of validate_inventory,
+    retained as the reference for the vectorized implementation."""
+    amount_x_list = []
+    amount_y_list = []
+    pct_diff_list = []
+    conclusion = []
+    error_count = 0
+    for index, row in validation_df.iterrows():
+        amount_x = float(row['FlowAmount_x'])
+        amount_y = float(row['FlowAmount_y'])
+        if amount_x == 0.0:
+            amount_x_list.append(amount_x)
+            if amount_y == 0.0:
+                pct_diff_list.append(0.0)
+                amount_y_list.append(amount_y)
+                conclusion.append('Both inventory and reference are zero or null')
+            elif amount_y == np.inf:
+                amount_y_list.append(np.nan)
+                pct_diff_list.append(100.0)
+                conclusion.append('Reference contains infinity values. '
+                                  'Check prior calculations.')
+            else:
+                amount_y_list.append(amount_y)
+                pct_diff_list.append(100.0)
+                conclusion.append('Inventory value is zero or null')
+                error_count += 1
+        elif amount_y == 0.0:
+            amount_x_list.append(amount_x)
+            amount_y_list.append(amount_y)
+            pct_diff_list.append(100.0)
+            conclusion.append('Reference value is zero or null')
+            continue
+        elif amount_y == np.inf:
+            amount_x_list.append(amount_x)
+            amount_y_list.append(np.nan)
+            pct_diff_list.append(100.0)
+            conclusion.append('Reference contains infinity values. '
+                              'Check prior calculations.')
+        else:
+            pct_diff = 100.0 * abs(amount_y - amount_x) / amount_y
+            pct_diff_list.append(pct_diff)
+            amount_x_list.append(amount_x)
+            amount_y_list.append(amount_y)
+            if pct_diff == 0.0:
+                conclusion.append('Identical')
+            elif pct_diff <= tolerance:
+                conclusion.append('Statistically similar')
+            elif pct_diff > tolerance:
+                conclusion.append('Percent difference exceeds tolerance')
+                error_count += 1
+    validation_df['Inventory_Amount'] = amount_x_list
+    validation_df['Reference_Amount'] = amount_y_list
+    validation_df['Percent_Difference'] = pct_diff_list
+    validation_df['Conclusion'] = conclusion
+    validation_df = validation_df.drop(['FlowAmount_x', 'FlowAmount_y'], axis=1)
+    return validation_df, error_count
+
+
+def synthetic_data(n=2000, seed=0):
+    rng = np.random.default_rng(seed)
+    flows = [f'Flow {i}' for i in range(n)]
+    reference = rng.choice([0.0, np.nan, np.inf, 1.0, 50.0, 1e6], size=n)
+    reference = np.where(rng.random(n) < 0.5, rng.random(n) * 1000, reference)
+    # inventory values identical, similar, or divergent from the reference
+    factor = rng.choice([1.0, 1.03, 0.97, 1.05, 1.2, 0.0, 3.0], size=n)
+    inventory = np.where(np.isinf(reference), rng.random(n), reference * factor)
+    inventory = np.where(rng.random(n) < 0.05, np.nan, inventory)
+    inventory_df = pd.DataFrame({'FlowName': flows, 'FlowAmount': inventory,
+                                 'Compartment': 'air'})
+    reference_df = pd.DataFrame({'FlowName': flows, 'FlowAmount': reference,
+                                 'Compartment': 'air'})
+    # flows missing from one or the other dataset
+    inventory_df = inventory_df.drop(index=range(0, n, 37))
+    reference_df = reference_df.drop(index=range(5, n, 41))
+    return inventory_df, reference_df
+
+
+@pytest.mark.parametrize("tolerance", [5.0, 0.0])
+def test_validate_inventory_matches_row_classification(tolerance, caplog):
+    inventory_df, reference_df = synthetic_data()
+    with caplog.at_level(logging.WARNING):
+        result = validate_inventory(inventory_df.copy(), reference_df.copy(),
+                                    group_by=['FlowName'], tolerance=tolerance)
+
+    # rebuild the merged frame that is classified
+    inventory_sums = (inventory_df.fillna({'FlowAmount': 0.0})
+                      .groupby('FlowName')[['FlowAmount']].sum().reset_index())
+    reference_sums = (reference_df.fillna({'FlowAmount': 0.0})
+                      .groupby('FlowName')[['FlowAmount']].sum().reset_index())
+    merged = (inventory_sums.merge(reference_sums, how='outer', on='FlowName')
+              .reset_index(drop=True).fillna(0.0))
+    expected, error_count = validate_inventory_by_row(merged, tolerance)
+
+    pd.testing.assert_frame_equal(result, expected, check_dtype=False)
+    assert set(result['Conclusion']) >= {
+        'Both inventory and reference are zero or null',
+        'Inventory value is zero or null', 'Reference value is zero or null',
+        'Identical', 'Percent difference exceeds tolerance'}
+    warnings = [r.message for r in caplog.records
+                if 'potential issues' in r.message]
+    assert warnings == [f'{error_count} potential issues in validation '
+                        'exceeding tolerance']